@@ -0,0 +1,551 @@
+#!/usr/bin/env python
+#################################################################################
+# Hermetic benchmark for the handle() of cc_condor, cc_cvmfs and cc_ganglia.	#
+# Every scenario runs in its own process against a sandbox root: all the	#
+# absolute paths of the modules (tools, config files, /proc, caches) are	#
+# re-rooted into it and the tools are stub scripts. Runs on a plain Linux box	#
+# with python 2 and no network. Not part of the package.			#
+#										#
+#   python bench_handlers.py [--module condor|cvmfs|ganglia] [--quick] [--json]	#
+#   python bench_handlers.py --aggregation NODES [--shards N]			#
+#   python bench_handlers.py --churn HOURS [--arrivals N] [--lifetime H]	#
+#   python bench_handlers.py --web-load POLLERS [--minutes N]			#
+#################################################################################
+
+import json
+import optparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SAMPLES_DIR = os.path.join(BENCH_DIR, 'samples')
+CONFIG_DIR = os.path.join(os.path.dirname(BENCH_DIR), 'src', 'usr', 'lib', 'python2.6', 'site-packages', 'cloudinit', 'config')
+
+MODULES = ('cern_util', 'cern_trace', 'cern_facts', 'cern_fetch', 'cern_packages', 'cern_phases', 'cc_condor', 'cc_cvmfs', 'cc_ganglia')
+
+# Tools reached through PATH rather than a module constant
+PATH_TOOLS = ('cvmfs_config',)
+
+STUB = '''#!/bin/sh
+echo "$0 $*" >> "%(log)s"
+case "$0 $*" in
+  *"rpm -q"*) exit 0 ;;
+esac
+exit 0
+'''
+
+
+class NullLog(object):
+  def info(self, *args):
+    pass
+  debug = warning = error = info
+
+
+def make_shim(root):
+  # A minimal cloudinit package whose 'config' subpackage is the source tree of the modules
+  shim = os.path.join(root, 'shim')
+  os.makedirs(os.path.join(shim, 'cloudinit', 'config'))
+  open(os.path.join(shim, 'cloudinit', '__init__.py'), 'w').close()
+  open(os.path.join(shim, 'cloudinit', 'util.py'), 'w').close()
+  f = open(os.path.join(shim, 'cloudinit', 'config', '__init__.py'), 'w')
+  f.write('__path__.append(%r)\n' % CONFIG_DIR)
+  f.close()
+  return shim
+
+def write(path, content):
+  if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  f = open(path, 'w')
+  f.write(content)
+  f.close()
+
+def make_stub(path, log):
+  write(path, STUB % {'log': log})
+  os.chmod(path, 0755)
+
+def make_proc(root, cores, memory_mb, nodes=1):
+  cpuinfo = ''
+  for n in range(cores):
+    cpuinfo += 'processor\t: %d\nmodel name\t: Bench CPU\n\n' % n
+  write(root+'/proc/cpuinfo', cpuinfo)
+  write(root+'/proc/meminfo', 'MemTotal:       %d kB\nSwapTotal:      %d kB\n' % (memory_mb * 1024, 2048 * 1024))
+  write(root+'/proc/sys/kernel/random/boot_id', 'bench-boot\n')
+  write(root+'/proc/sys/fs/nr_open', '1048576\n')
+  write(root+'/proc/sys/fs/file-max', '%d\n' % (memory_mb * 100))
+  write(root+'/proc/cgroups', '#subsys_name\thierarchy\tnum_cgroups\tenabled\ncpuset\t1\t1\t1\nmemory\t2\t1\t1\n')
+  make_sys(root, cores, nodes)
+
+def make_sys(root, cores, nodes):
+  # 'nodes' NUMA nodes of two way SMT cores, numbered like Linux does: the siblings of CPU n are n and n + cores/2
+  half = max(1, cores / 2)
+  per_node = max(1, half / nodes)
+  for n in range(cores):
+    core = n % half
+    siblings = sorted(set([core, core + half]) & set(range(cores)))
+    write(root+'/sys/devices/system/cpu/cpu%d/topology/thread_siblings_list' % n, ','.join(map(str, siblings))+'\n')
+  for node in range(nodes):
+    cpus = [n for n in range(cores) if min(nodes - 1, (n % half) / per_node) == node]
+    write(root+'/sys/devices/system/node/node%d/cpulist' % node, ','.join(map(str, cpus))+'\n')
+  write(root+'/etc/redhat-release', 'Scientific Linux CERN SLC release 6.4 (Carbon)\n')
+
+def gmond_conf(extra_groups):
+  # The stock gmond.conf, grown by extra collection groups as pulled in by large metric module configs
+  conf = open(os.path.join(SAMPLES_DIR, 'gmond.conf')).read()
+  for n in range(extra_groups):
+    conf += 'collection_group {\n  collect_every = 60\n  time_threshold = 300\n'
+    for m in range(4):
+      conf += '  metric {\n    name = "bench_%d_%d"\n    value_threshold = 1.0\n  }\n' % (n, m)
+    conf += '}\n\n'
+  return conf
+
+
+def reroot(module, root, log):
+  # Point every absolute path constant of the module into the sandbox, with stubs for the tools
+  for name in dir(module):
+    value = getattr(module, name)
+    if not name.isupper() and not name.endswith('_cmd') and name not in ('LocalFile', 'DomainFile', 'CMS_LocalFile'):
+      continue
+    if not isinstance(value, str) or not value.startswith('/'):
+      continue
+    setattr(module, name, root+value)
+    if name.endswith('_cmd') or name == 'CHKCONFIG':
+      make_stub(root+value, log)
+
+class Counters(object):
+  def __init__(self):
+    self.forks = 0
+    self.writes = 0
+    self.bytes = 0
+
+class CountingFile(object):
+  def __init__(self, f, counters):
+    self._f = f
+    self._counters = counters
+    counters.writes += 1
+
+  def write(self, data):
+    self._counters.bytes += len(data)
+    return self._f.write(data)
+
+  def writelines(self, lines):
+    for line in lines:
+      self.write(line)
+
+  def __getattr__(self, name):
+    return getattr(self._f, name)
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self._f.close()
+
+def count_everything(counters):
+  import __builtin__
+  real_open = __builtin__.open
+  real_fdopen = os.fdopen
+  real_execute = subprocess.Popen._execute_child
+  real_system = os.system
+
+  def counting_open(path, mode='r', *args):
+    f = real_open(path, mode, *args)
+    if 'w' in mode or 'a' in mode:
+      return CountingFile(f, counters)
+    return f
+
+  def counting_fdopen(fd, mode='r', *args):
+    f = real_fdopen(fd, mode, *args)
+    if 'w' in mode or 'a' in mode:
+      return CountingFile(f, counters)
+    return f
+
+  def counting_execute(self, *args, **kwargs):
+    counters.forks += 1
+    return real_execute(self, *args, **kwargs)
+
+  def counting_system(command):
+    counters.forks += 1
+    return real_system(command)
+
+  __builtin__.open = counting_open
+  os.fdopen = counting_fdopen
+  subprocess.Popen._execute_child = counting_execute
+  os.system = counting_system
+
+
+def run_scenario(scenario):
+  # Runs in a child process: build the sandbox, import the modules, time handle()
+  root = tempfile.mkdtemp(prefix='bench-cloudinit-')
+  try:
+    log = os.path.join(root, 'commands.log')
+    sys.path.insert(0, make_shim(root))
+    os.environ['PATH'] = root+'/usr/bin:'+os.environ.get('PATH', '')
+    for tool in PATH_TOOLS:
+      make_stub(root+'/usr/bin/'+tool, log)
+    make_proc(root, scenario.get('cores', 4), scenario.get('memory_mb', 8192), scenario.get('numa_nodes', 1))
+    write(root+'/etc/ganglia/gmond.conf', gmond_conf(scenario.get('gmond_groups', 0)))
+    write(root+'/etc/ganglia/gmetad.conf', open(os.path.join(SAMPLES_DIR, 'gmetad.conf')).read())
+    write(root+'/etc/httpd/conf.d/ganglia.conf', open(os.path.join(SAMPLES_DIR, 'ganglia-httpd.conf')).read())
+    for directory in ('/etc/condor/config.d', '/etc/cvmfs/domain.d', '/etc/cvmfs/config.d', '/var/log', '/var/lib/cloud/data', '/var/run',
+                      '/etc/sysconfig', '/etc/cron.d', '/etc/ganglia/conf.d',
+                      '/cvmfs/atlas.cern.ch', '/cvmfs/cms.cern.ch'):
+      os.makedirs(root+directory)
+
+    modules = {}
+    for name in MODULES:
+      __import__('cloudinit.config.'+name)
+      modules[name] = sys.modules['cloudinit.config.'+name]
+      reroot(modules[name], root, log)
+    handler = modules['cc_'+scenario['module']]
+
+    os.chdir(root)
+    counters = Counters()
+    count_everything(counters)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+      start = time.time()
+      handler.handle(scenario['module'], scenario['cfg'], None, NullLog(), [])
+      wall = time.time() - start
+    finally:
+      sys.stdout = stdout
+
+    commands = 0
+    if os.path.exists(log):
+      commands = len(open(log).readlines())
+    return {'wall_ms': round(wall * 1000, 2), 'forks': counters.forks, 'commands': commands,
+            'writes': counters.writes, 'bytes_written': counters.bytes}
+  finally:
+    os.chdir('/')
+    shutil.rmtree(root, ignore_errors=True)
+
+
+def condor_params(cc_condor, count):
+  # The first 'count' keys of the workernode table, with dummy values
+  params = {}
+  for key, knob in cc_condor.WORKERNODE_PARAMS[:count]:
+    if key is not None:
+      params[key] = 'bench-'+key
+  return params
+
+def scenarios(module, quick):
+  cores = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+  sizes = (0, 10, 40)
+  groups = (0, 100, 1000)
+  if quick:
+    cores, sizes, groups = (1, 16, 256), (0, 40), (0, 1000)
+
+  result = []
+  if module in (None, 'condor'):
+    shim = tempfile.mkdtemp(prefix='bench-shim-')
+    sys.path.insert(0, make_shim(shim))
+    import cloudinit.config.cc_condor as cc_condor
+    shutil.rmtree(shim)
+    for n in cores:
+      for size in sizes:
+        result.append(('condor workernode cores=%d params=%d' % (n, size),
+                       {'module': 'condor', 'cores': n, 'cfg': {'condor': {'workernode': condor_params(cc_condor, size)}}}))
+    for layout in ('static', 'partitionable', 'mixed'):
+      result.append(('condor workernode cores=%d slot-layout=%s' % (cores[-1], layout),
+                     {'module': 'condor', 'cores': cores[-1], 'cfg': {'condor': {'workernode': {'slot-layout': layout}}}}))
+    for nodes in (2, 4):
+      result.append(('condor workernode cores=%d numa_nodes=%d cpu-affinity' % (cores[-1], nodes),
+                     {'module': 'condor', 'cores': cores[-1], 'numa_nodes': nodes,
+                      'cfg': {'condor': {'workernode': {'slot-layout': 'mixed', 'cpu-affinity': True}}}}))
+    hosts = ['127.0.0.1:%d' % port for port in (1, 2, 3, 4)]
+    result.append(('condor workernode condor-host x%d' % len(hosts),
+                   {'module': 'condor', 'cfg': {'condor': {'workernode': {'condor-host': hosts}}}}))
+    result.append(('condor workernode with cvmfs', {'module': 'condor', 'cfg': {'condor': {'workernode': {}},
+                                                                              'cvmfs': {'local': {'repositories': 'atlas.cern.ch'}},
+                                                                              'contextualization': {'workers': 4}}}))
+    result.append(('condor master', {'module': 'condor', 'cfg': {'condor': {'master': {}}}}))
+    for size, largest in cc_condor.POOL_SIZES:
+      result.append(('condor master pool-size=%s' % size, {'module': 'condor', 'cfg': {'condor': {'master': {'pool-size': size}}}}))
+  if module in (None, 'cvmfs'):
+    local = {'repositories': 'atlas.cern.ch,cms.cern.ch', 'cache-base': '/var/cache/cvmfs2',
+             'default-domain': 'cern.ch', 'http-proxy': 'http://squid:3128', 'quota-limit': 10000}
+    result.append(('cvmfs minimal', {'module': 'cvmfs', 'cfg': {'cvmfs': {'local': {'repositories': 'atlas.cern.ch'}}}}))
+    result.append(('cvmfs full', {'module': 'cvmfs', 'cfg': {'cvmfs': {'local': local, 'domain': {'server': 'http://s1/cvmfs/@fqrn@'}}}}))
+    auto = {'repositories': 'atlas.cern.ch', 'quota-limit': 'auto', 'memcache-size': 'auto', 'nfiles': 'auto'}
+    result.append(('cvmfs auto sizes', {'module': 'cvmfs', 'cfg': {'cvmfs': {'local': auto}}}))
+    proxies = {'repositories': 'atlas.cern.ch', 'http-proxy': ['http://127.0.0.1:%d' % port for port in (1, 2, 3)] + ['DIRECT']}
+    result.append(('cvmfs http-proxy x3', {'module': 'cvmfs', 'cfg': {'cvmfs': {'local': proxies}}}))
+    prefetch = {'paths': ['atlas.cern.ch/repo/sw'], 'threads': 8, 'deadline': 600}
+    result.append(('cvmfs prefetch', {'module': 'cvmfs', 'cfg': {'cvmfs': {'local': {'repositories': 'atlas.cern.ch'},
+                                                                        'prefetch': prefetch}}}))
+  if module in (None, 'ganglia'):
+    for n in groups:
+      nodes = {'cluster': {'name': 'bench'}, 'udpSendChannel': {'host': 'head', 'port': 8649},
+               'udpRecvChannel': {'port': 8649}, 'tcpAcceptChannel': {'port': 8649}}
+      result.append(('ganglia node gmond_groups=%d' % n,
+                     {'module': 'ganglia', 'gmond_groups': n, 'cfg': {'ganglia': {'nodes': nodes}}}))
+    for preset in ('minimal', 'batch-worker'):
+      nodes = {'cluster': {'name': 'bench'}, 'udpSendChannel': {'host': 'head', 'port': 8649}, 'preset': preset,
+               'collectionGroups': [{'metrics': ['load_one', 'load_five'], 'collect-every': 120, 'time-threshold': 600}],
+               'expected-hosts': 5000}
+      result.append(('ganglia node preset=%s' % preset,
+                     {'module': 'ganglia', 'gmond_groups': groups[-1], 'cfg': {'ganglia': {'nodes': nodes}}}))
+    result.append(('ganglia headnode', {'module': 'ganglia', 'cfg': {'ganglia': {'headnode': {'source': '"bench"'}}}}))
+    aggregated = {'cluster': {'name': 'bench'}, 'aggregators': [['agg%02da:8649' % n, 'agg%02db:8649' % n] for n in range(16)]}
+    result.append(('ganglia node aggregators=16x2', {'module': 'ganglia', 'cfg': {'ganglia': {'nodes': aggregated}}}))
+    result.append(('ganglia headnode aggregators=16x2', {'module': 'ganglia', 'cfg': {'ganglia': {'headnode': {
+      'source': '"bench"', 'aggregators': aggregated['aggregators']}}}}))
+    ephemeral = {'cluster': {'name': 'bench'}, 'udpSendChannel': {'host': 'head', 'port': 8649}, 'ephemeral': True}
+    result.append(('ganglia node ephemeral', {'module': 'ganglia', 'cfg': {'ganglia': {'nodes': ephemeral}}}))
+    result.append(('ganglia node cvmfs metrics', {'module': 'ganglia', 'cfg': {
+      'ganglia': {'nodes': ephemeral}, 'cvmfs': {'local': {'repositories': 'atlas.cern.ch,cms.cern.ch'}}}}))
+    result.append(('ganglia node condor metrics', {'module': 'ganglia', 'cfg': {
+      'ganglia': {'nodes': ephemeral}, 'condor': {'workernode': {'condor-host': 'head'}}}}))
+    scaling = {'source': '"bench"', 'expected-hosts': 5000, 'rrdcached': True, 'rrd-tmpfs': {'snapshot-every': 10},
+               'rrd-retention': {'expire-after': 12, 'archive-dir': '/var/lib/ganglia/archive'}}
+    result.append(('ganglia headnode rrdcached+tmpfs+retention', {'module': 'ganglia', 'cfg': {'ganglia': {'headnode': scaling}}}))
+  return result
+
+
+def simulate_aggregation(nodes, shards):
+  # Per shard load of the ganglia aggregation for 'nodes' hosts, and how many of them move when a shard
+  # is removed or added
+  root = tempfile.mkdtemp(prefix='bench-cloudinit-')
+  try:
+    sys.path.insert(0, make_shim(root))
+    import cloudinit.config.cc_ganglia as cc_ganglia
+  finally:
+    shutil.rmtree(root)
+  hostnames = ['vm%06d.cern.ch' % n for n in range(nodes)]
+  aggregators = [['agg%02da.cern.ch' % n, 'agg%02db.cern.ch' % n] for n in range(shards + 1)]
+
+  def assign(count):
+    shard_list = cc_ganglia.aggregator_shards(aggregators[:count])
+    return dict([(hostname, cc_ganglia.pick_shard(hostname, shard_list)[0][0]) for hostname in hostnames])
+
+  start = time.time()
+  picked = assign(shards)
+  ms = (time.time() - start) * 1000
+  load = {}
+  for shard in picked.values():
+    load[shard] = load.get(shard, 0) + 1
+  print '%-20s %8s %8s' % ('aggregator', 'nodes', 'share')
+  for shard in sorted(load.keys()):
+    print '%-20s %8d %7.1f%%' % (shard, load[shard], 100.0 * load[shard] / nodes)
+  mean = float(nodes) / shards
+  print 'max/mean %.3f, min/mean %.3f, %.1f us per node' % (max(load.values()) / mean, min(load.values()) / mean, 1000 * ms / nodes)
+  for label, count in (('removing one shard', shards - 1), ('adding one shard', shards + 1)):
+    if count < 1:
+      continue
+    other = assign(count)
+    moved = len([hostname for hostname in hostnames if other[hostname] != picked[hostname]])
+    print '%s moves %d nodes (%.1f%%, ideal %.1f%%)' % (label, moved, 100.0 * moved / nodes, 100.0 / max(shards, count))
+
+def simulate_churn(hours, arrivals, lifetime, expire_after):
+  # Host directories on the ganglia headnode while 'arrivals' hosts start every hour and live 'lifetime' hours,
+  # with the hourly expiry of the hosts gone for 'expire_after' hours
+  root = tempfile.mkdtemp(prefix='bench-cloudinit-')
+  try:
+    sys.path.insert(0, make_shim(root))
+    import cloudinit.config.cern_rrdexpire as cern_rrdexpire
+    cluster = os.path.join(root, 'rrds', 'bench')
+    os.makedirs(cluster)
+    base = time.time() - hours * 3600
+    alive = {}
+    started = 0
+    print '%6s %8s %12s %14s %12s' % ('hour', 'alive', 'host dirs', 'without expiry', 'expiry ms')
+    for hour in range(hours):
+      now = base + hour * 3600
+      for n in range(arrivals):
+        directory = os.path.join(cluster, 'vm%06d.cern.ch' % started)
+        os.makedirs(directory)
+        for metric in ('heartbeat', 'load_one', 'cpu_idle', 'mem_free'):
+          open(os.path.join(directory, metric+'.rrd'), 'w').close()
+        alive[directory] = hour + lifetime
+        started += 1
+      for directory in alive.keys():
+        if alive[directory] <= hour:
+          del alive[directory]
+          continue
+        for name in os.listdir(directory):
+          os.utime(os.path.join(directory, name), (now, now))
+      start = time.time()
+      cern_rrdexpire.expire(os.path.join(root, 'rrds'), expire_after * 3600, now=now)
+      ms = (time.time() - start) * 1000
+      if hour % 6 == 5 or hour == hours - 1:
+        print '%6d %8d %12d %14d %12.1f' % (hour + 1, len(alive), len(os.listdir(cluster)), started, ms)
+  finally:
+    shutil.rmtree(root)
+
+# The stub ganglia-web of --web-load: what a dashboard refresh fetches, and how long a graph takes to render.
+# It is not httpd: it only applies the mod_deflate and mod_expires directives of the ganglia.conf it is given
+WEB_FILES = (('styles.css', 'text/css', 30), ('jquery.js', 'application/javascript', 90), ('logo.gif', 'image/gif', 5),
+             ('host_view.json', 'application/json', 120), ('graph-load.png', 'image/png', 15),
+             ('graph-cpu.png', 'image/png', 15), ('graph-mem.png', 'image/png', 15), ('graph-net.png', 'image/png', 15))
+GRAPH_RENDER_MS = 20
+
+def web_content(name, kb):
+  # Text compresses like the real thing (repetitive markup and numbers), images do not
+  if name.endswith('.png') or name.endswith('.gif'):
+    return os.urandom(kb * 1024)
+  row = '{"host": "vm%06d.cern.ch", "metric": "load_one", "value": %d.%02d}, '
+  content = ''
+  n = 0
+  while len(content) < kb * 1024:
+    content += row % (n, n % 17, n % 100)
+    n += 1
+  return content
+
+def httpd_directives(conf):
+  # The content types compressed by 'AddOutputFilterByType DEFLATE' and the seconds of each 'ExpiresByType'
+  # of an httpd configuration such as ganglia.conf
+  deflate = []
+  expiry = {}
+  for line in conf.splitlines():
+    fields = line.split()
+    if fields[:2] == ['AddOutputFilterByType', 'DEFLATE']:
+      deflate.extend(fields[2:])
+    elif fields[:1] == ['ExpiresByType'] and fields[2:3] == ['"access'] and fields[3:4] == ['plus']:
+      expiry[fields[1]] = int(fields[4])
+  return deflate, expiry
+
+def simulate_web(pollers, minutes):
+  # Dashboards refreshing every 15s against a stub ganglia-web that applies the compression and expiry of
+  # samples/ganglia-httpd.conf (the stock file) and of the ganglia.conf cc_ganglia writes. It estimates the
+  # requests and bytes the headers save, it does not load test httpd. The browsers keep what the expiry allows
+  import BaseHTTPServer
+  import SocketServer
+  import gzip
+  import httplib
+  import socket
+  import StringIO
+  import threading
+  root = tempfile.mkdtemp(prefix='bench-cloudinit-')
+  try:
+    sys.path.insert(0, make_shim(root))
+    import cloudinit.config.cc_ganglia as cc_ganglia
+  finally:
+    shutil.rmtree(root)
+  stock = open(os.path.join(SAMPLES_DIR, 'ganglia-httpd.conf')).read()
+  confs = (('stock', httpd_directives(stock)), ('cloud-init', httpd_directives(cc_ganglia.ganglia_httpd_conf({}))))
+  files = dict([(name, (content_type, web_content(name, kb))) for name, content_type, kb in WEB_FILES])
+
+  class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    deflate = []
+    expiry = {}
+
+    def setup(self):
+      # Like httpd and the browsers, no Nagle: otherwise delayed ACKs add 40ms to the small responses
+      self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def do_GET(self):
+      content_type, content = files[self.path.lstrip('/')]
+      if content_type == 'image/png':
+        time.sleep(GRAPH_RENDER_MS / 1000.0)
+      self.send_response(200)
+      self.send_header('Content-Type', content_type)
+      if content_type in self.deflate and 'gzip' in self.headers.get('Accept-Encoding', ''):
+        out = StringIO.StringIO()
+        f = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=6)
+        f.write(content)
+        f.close()
+        content = out.getvalue()
+        self.send_header('Content-Encoding', 'gzip')
+      if content_type in self.expiry:
+        self.send_header('Cache-Control', 'max-age=%d' % self.expiry[content_type])
+      self.send_header('Content-Length', str(len(content)))
+      self.end_headers()
+      self.wfile.write(content)
+
+    def log_message(self, *args):
+      pass
+
+  class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+  print '%-12s %9s %10s %9s %14s' % ('ganglia.conf', 'requests', 'MB sent', 'wall s', 'refreshes/s')
+  for label, (deflate, expiry) in confs:
+    Handler.deflate, Handler.expiry = deflate, expiry
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    connections = [httplib.HTTPConnection('127.0.0.1', server.server_address[1]) for n in range(pollers)]
+    for connection in connections:
+      connection.connect()
+      connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    caches = [{} for n in range(pollers)]
+    requests = sent = refreshes = 0
+    start = time.time()
+    for tick in range(minutes * 4):
+      now = tick * 15
+      for connection, cache in zip(connections, caches):
+        for name, content_type, kb in WEB_FILES:
+          if cache.get(name, -1) > now:
+            continue
+          connection.request('GET', '/'+name, headers={'Accept-Encoding': 'gzip'})
+          response = connection.getresponse()
+          sent += len(response.read())
+          requests += 1
+          control = response.getheader('Cache-Control') or ''
+          if control.startswith('max-age='):
+            cache[name] = now + int(control[len('max-age='):])
+        refreshes += 1
+    wall = time.time() - start
+    for connection in connections:
+      connection.close()
+    server.shutdown()
+    server.server_close()
+    print '%-12s %9d %10.1f %9.2f %14.1f' % (label, requests, sent / (1024.0 * 1024), wall, refreshes / wall)
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option('--module', choices=('condor', 'cvmfs', 'ganglia'))
+  parser.add_option('--quick', action='store_true', help='fewer points per sweep')
+  parser.add_option('--json', action='store_true', help='one JSON object per scenario')
+  parser.add_option('--aggregation', type='int', metavar='NODES', help='simulate the ganglia aggregation of NODES hosts')
+  parser.add_option('--shards', type='int', default=8, help='aggregator shards of --aggregation')
+  parser.add_option('--churn', type='int', metavar='HOURS', help='simulate the ganglia RRD expiry for HOURS hours')
+  parser.add_option('--arrivals', type='int', default=100, help='hosts started every hour in --churn')
+  parser.add_option('--lifetime', type='int', default=4, help='hours every host of --churn lives')
+  parser.add_option('--expire-after', type='int', default=12, help='hours of --churn after which the RRDs of a host expire')
+  parser.add_option('--web-load', type='int', metavar='POLLERS', help='estimate the traffic of POLLERS dashboards under the compression and expiry of ganglia.conf')
+  parser.add_option('--minutes', type='int', default=10, help='minutes of dashboard refreshes of --web-load')
+  parser.add_option('--run', help=optparse.SUPPRESS_HELP)
+  options, args = parser.parse_args()
+
+  if options.web_load:
+    simulate_web(options.web_load, options.minutes)
+    return
+
+  if options.churn:
+    simulate_churn(options.churn, options.arrivals, options.lifetime, options.expire_after)
+    return
+
+  if options.aggregation:
+    simulate_aggregation(options.aggregation, options.shards)
+    return
+
+  if options.run:
+    print json.dumps(run_scenario(json.loads(options.run)))
+    return
+
+  if not options.json:
+    print '%-55s %10s %6s %9s %7s %10s' % ('scenario', 'wall ms', 'forks', 'commands', 'writes', 'bytes')
+  for name, scenario in scenarios(options.module, options.quick):
+    child = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--run', json.dumps(scenario)], stdout=subprocess.PIPE)
+    output, err = child.communicate()
+    if child.returncode:
+      print '%-55s FAILED' % name
+      continue
+    result = json.loads(output.splitlines()[-1])
+    if options.json:
+      result['scenario'] = name
+      print json.dumps(result, sort_keys=True)
+    else:
+      print '%-55s %10.2f %6d %9d %7d %10d' % (name, result['wall_ms'], result['forks'], result['commands'],
+                                              result['writes'], result['bytes_written'])
+
+if __name__ == '__main__':
+  main()
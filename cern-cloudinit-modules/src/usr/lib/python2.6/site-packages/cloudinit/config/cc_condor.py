@@ -8,89 +8,83 @@
 
 import subprocess
 import cloudinit.config as cc
-import urllib
+import cloudinit.config.cc_cvmfs as cc_cvmfs
+import cloudinit.config.cern_facts as facts
+import cloudinit.config.cern_fetch as cern_fetch
+import cloudinit.config.cern_packages as cern_packages
+import cloudinit.config.cern_phases as cern_phases
+import cloudinit.config.cern_trace as cern_trace
+import cloudinit.config.cern_util as cern_util
 import os
-import re
-import platform
-import tempfile
+import pwd
+import shutil
+import sys
+import time
 
 # In case this runs to early during the boot, the PATH environment can still be unset. Let's define each necessary command's path
 # Using subprocess calls so it raises exceptions directly from the child process to the parent
 YUM_cmd = '/usr/bin/yum'
-GREP_cmd = '/bin/grep'
 RPM_cmd = '/bin/rpm'
 SERVICE_cmd = '/sbin/service'
-CAT_cmd = '/bin/cat'
-AWK_cmd = '/bin/awk'
-CP_cmd = '/bin/cp'
-RM_cmd = '/bin/rm'
+CONDOR_RECONFIG_cmd = '/usr/sbin/condor_reconfig'
+CONDOR_STATUS_cmd = '/usr/bin/condor_status'
+IPTABLES_cmd = '/etc/init.d/iptables'
+NEWUSERS_cmd = '/usr/sbin/newusers'
+USERADD_cmd = '/usr/sbin/useradd'
+
+# Accounts the condor slots run as: user1, user2, ...
+SLOT_USER_PREFIX = 'user'
+SLOT_USER_SHELL = '/sbin/nologin'
+SKEL_DIR = '/etc/skel'
+
+# Installed condor configuration
+CONDOR_CONFIG_LOCAL = '/etc/condor/condor_config.local'
+CONDOR_CONFIG_LINK = '/etc/condor/config.d/condor_config.local'
+
+# Condor sources
+CONDOR_REPO_URL = 'http://www.cs.wisc.edu/condor/yum/repo.d/condor-stable-rhel6.repo'
+CONDOR_REPO_FILE = '/etc/yum.repos.d/condor.repo'
+CONDOR_FALLBACK_RPM_URL = 'http://research.cs.wisc.edu/htcondor/yum/stable/rhel6/condor-8.0.0-133173.rhel6.4.i686.rpm'
+CONDOR_DEPENDENCIES = ['libtool-ltdl','libvirt','perl-XML-Simple','openssl098e','compat-expat1','compat-openldap','perl-DateManip','perl-Time-HiRes','policycoreutils-python']
 
 ###########
 ###########
 
-def install_condor(install_from_repo=0,repo_url=''):
-  # In case a RPM is being downloaded, let's do it in a temp file
-  tp = tempfile.NamedTemporaryFile()
+def condor_package():
+  # Defining the most suitable condor version for the machine.
+  # To avoid confusions between i386 and i686, which are 32 bits, let's just install 'condor' in case the machine is 32 bits
+  if facts.get('arch') == 'x86_64':
+    return 'condor.x86_64'
+  return 'condor'
 
-  print 'Starting Condor installation: '
-  print "Installing Condor dependencies..."
-  subprocess.check_call([YUM_cmd,"-y","install","libtool-ltdl","libvirt","perl-XML-Simple","openssl098e","compat-expat1","compat-openldap","perl-DateManip","perl-Time-HiRes","policycoreutils-python"])
-  #cc.install_packages(("yum-downloadonly","libtool-ltdl","libvirt","perl-XML-Simple","openssl098e","compat-expat1","compat-openldap","perl-DateManip","perl-Time-HiRes","policycoreutils-python",))
+def package_plan(params):
+  # Prepare the condor repository and return what has to be installed. Used by cern_packages
+  if 'rpm-url' in params:
+    try:
+      CondorRPM = cern_fetch.fetch(params['rpm-url'], params.get('rpm-sha256'))
+    except:
+      print '\nATTENTION: the condor repository you provided is not valid. Skipping condor installation...\n'
+      return None
+    return CONDOR_DEPENDENCIES + [CondorRPM]
 
-  print 'Overwriting condor_config.local'
+  cern_fetch.fetch_to(CONDOR_REPO_URL, CONDOR_REPO_FILE)
+  return CONDOR_DEPENDENCIES + [condor_package()]
 
-  if install_from_repo:
+def install_condor(cfg):
+  print 'Starting Condor installation: '
+  # Condor and its dependencies are installed together with the other modules' packages
+  if not cern_packages.ensure(cfg).get('condor'):
+    # If condor is not available in the yum repository (due to some odd reason) let's download the .rpm directly from the source.
     try:
-      urllib.urlretrieve(repo_url, tp.name)
-      CondorRPM = tp.name
-      CondorVersion = "condor"
+      # Download a version that will most certainly work in every machine.
+      if 'rpm-url' in cfg['condor']:
+        CondorRPM = cern_fetch.fetch(cfg['condor']['rpm-url'], cfg['condor'].get('rpm-sha256'))
+      else:
+        CondorRPM = cern_fetch.fetch(CONDOR_FALLBACK_RPM_URL)
     except:
-      print '\nATTENTION: the condor repository you provided is not valid. Skipping condor module...\n'
+      print 'It was not possible to install Condor from any available source. Exiting condor setup...'
       return
-  else:
-    CondorRepo = "http://www.cs.wisc.edu/condor/yum/repo.d/condor-stable-rhel6.repo"
-    urllib.urlretrieve(CondorRepo,'/etc/yum.repos.d/condor.repo')
-
-    # Defining the most suitable condor version for the machine
-    arch = str(platform.machine())
-    if arch == 'x86_64': arch = '.'+str(arch)
-    else:
-      arch = '.i'
-    version0 = subprocess.Popen([YUM_cmd,'info','condor%s' % arch], stdout=subprocess.PIPE)
-    version1 = subprocess.Popen([GREP_cmd,'Version   '], stdin=version0.stdout, stdout=subprocess.PIPE)
-    version0.stdout.close()
-    yum_version, verror = version1.communicate()
-    yum_version = re.sub('\n','', yum_version)
-    yum_version = re.sub(' ','',yum_version)
-    yum_condor_version = yum_version.split(':')
-
-    DownloadManually = False
-    # If CondorVersion is empty that it means that condor is not available on the yum repository or that some error has occured
-    if not yum_condor_version:
-      # In this case let's define and download manually the condor we want to install 
-      CondorVersion = "condor-8.0.0"  # Stable version
-      DownloadManually = True
-    else:
-      CondorVersion = 'condor-'+str(yum_condor_version[1])
-
-    if arch == '.i': arch == ''     # To avoid confusions between i386 and i686, which are 32 bits. So let's just 'yum install condor' in case the machine is 32 bits
-
-  if not install_from_repo:
-    if not DownloadManually:
-      subprocess.check_call([YUM_cmd,'-y','install','condor'+arch])
-      #cc.install_packages(('condor'+arch,))
-    else:
-      # If condor is not available in the yum repository (due to some odd reason) you can uncomment the following lines to donwload the .rpm directly from the source.
-      try:
-        # Download a version that will most certainly work in every machine.
-        urllib.urlretrieve('http://research.cs.wisc.edu/htcondor/yum/stable/rhel6/condor-8.0.0-133173.rhel6.4.i686.rpm', tp.name)
-      except:
-        print 'It was not possible to install Condor from any available source. Exiting condor setup...'
-        return
-      CondorRPM = tp.name
-      subprocess.check_call([RPM_cmd,"-ivh",CondorRPM])
-  else:
-    subprocess.check_call([RPM_cmd,"-ivh",CondorRPM])
+    cern_trace.check_call([RPM_cmd,"-ivh",CondorRPM])
 
   os.environ['PATH'] = os.environ['PATH']+"/usr/sbin:/sbin"
   os.environ['CONDOR_CONFIG'] = "/etc/condor/condor_config"
@@ -99,311 +93,661 @@ def install_condor(install_from_repo=0,repo_url=''):
 ##############
 ##############
 
-def handle(_name, cfg, cloud, log, _args):
-  if 'condor' in cfg:
-    condor_cc_cfg = cfg['condor']    
-    if 'master' in condor_cc_cfg and 'workernode' in condor_cc_cfg:
-      print 'You can not set condor master and condor workernode in the same machine.\n'
-      print 'Exiting condor configuration...'
-      return
-    
-    Installation = False
-    Repo = False 
-    InstallFrom = ''
-
-    # If Install is False, this will assume that Condor is already installed in the destination
-    if 'install' in condor_cc_cfg:
-      Installation = condor_cc_cfg['install']
-		
-    # There is the possibilty of telling the module where to download Condor from		
-    if 'rpm-url' in condor_cc_cfg:
-      Repo = True
-      InstallFrom = condor_cc_cfg['rpm-url']
- 
-    # Condor configuration file
-    ConfigFile = '/root/condor_config.local'
-
-    # Default CONDOR_HOST
-    Host = subprocess.Popen(["hostname", "-f"], stdout=subprocess.PIPE)
-    Hostname, ReleaseErr = Host.communicate()
-    Hostname = re.sub('\n','',Hostname)      
-
-    if Installation == True:
-      install_condor(Repo, InstallFrom)
-
+# Parameters of the condor_config.local file: (cloud-config key, condor knob).
+# A knob is written when the key is set in the cloud-config or when the branch has a default for it.
+# A key of None means that the knob is not configurable and only its default is written.
+WORKERNODE_PARAMS = (
+  ('daemon-list', 'DAEMON_LIST'),
+  ('release-dir', 'RELEASE_DIR'),
+  ('local-dir', 'LOCAL_DIR'),
+  ('condor-admin', 'CONDOR_ADMIN'),
+  ('queue-super-users', 'QUEUE_SUPER_USERS'),
+  ('highport', 'HIGHPORT'),
+  ('lowport', 'LOWPORT'),
+  ('uid-domain', 'UID_DOMAIN'),
+  ('allow-write', 'ALLOW_WRITE'),
+  ('dedicated-execute-account-regexp', 'DEDICATED_EXECUTE_ACCOUNT_REGEXP'),
+  ('allow-daemon', 'ALLOW_DAEMON'),
+  ('starter-allow-runas-owner', 'STARTER_ALLOW_RUNAS_OWNER'),
+  ('java', 'JAVA'),
+  ('user-job-wrapper', 'USER_JOB_WRAPPER'),
+  ('gsite', 'GSITE'),
+  ('startd-attrs', 'STARTD_ATTRS'),
+  ('enable-ssh-to-job', 'ENABLE_SSH_TO_JOB'),
+  ('certificate-mapfile', 'CERTIFICATE_MAPFILE'),
+  ('ccb-address', 'CCB_ADDRESS'),
+  ('execute', 'EXECUTE'),
+  ('starter-debug', 'STARTER_DEBUG'),
+  ('startd-debug', 'STARTD_DEBUG'),
+  ('sec-default-authentication', 'SEC_DEFAULT_AUTHENTICATION'),
+  ('sec-default-authentication-methods', 'SEC_DEFAULT_AUTHENTICATION_METHODS'),
+  ('sec-daemon-authentication', 'SEC_DAEMON_AUTHENTICATION'),
+  ('sec-password-file', 'SEC_PASSWORD_FILE'),
+  ('update-collector-with-tcp', 'UPDATE_COLLECTOR_WITH_TCP'),
+  ('max-job-retirement-time', 'MAXJOBRETIREMENTTIME'),
+  ('startd-cron-joblist', 'STARTD_CRON_JOBLIST'),
+  ('startd-cron-atlval-mode', 'STARTD_CRON_ATLVAL_MODE'),
+  ('startd-cron-atlval-executable', 'STARTD_CRON_ATLVAL_EXECUTABLE'),
+  ('startd-cron-atlval-period', 'STARTD_CRON_ATLVAL_PERIOD'),
+  ('startd-cron-atlval-job-load', 'STARTD_CRON_ATLVAL_JOB_LOAD'),
+  ('hostallow-write', 'HOSTALLOW_WRITE'),
+  ('hostallow-read', 'HOSTALLOW_READ'),
+  ('start', 'START'),
+  ('suspend', 'SUSPEND'),
+  ('preempt', 'PREEMPT'),
+  ('kill', 'KILL'),
+  (None, 'CONDOR_IDS'),
+)
+
+WORKERNODE_DEFAULTS = {
+  'DAEMON_LIST': 'MASTER, STARTD',
+  'QUEUE_SUPER_USERS': 'root, condor',
+  'HIGHPORT': 24500,
+  'LOWPORT': 20000,
+  'ALLOW_WRITE': '*',
+  'ALLOW_DAEMON': '*',
+  'STARTER_ALLOW_RUNAS_OWNER': 'False',
+  'SEC_DAEMON_AUTHENTICATION': 'OPTIONAL',
+  'HOSTALLOW_WRITE': '*',
+  'HOSTALLOW_READ': '*',
+  'START': 'True',
+  'SUSPEND': 'False',
+  'PREEMPT': 'False',
+  'KILL': 'False',
+}
+
+MASTER_PARAMS = (
+  ('highport', 'HIGHPORT'),
+  ('lowport', 'LOWPORT'),
+  ('start', 'START'),
+  ('suspend', 'SUSPEND'),
+  ('preempt', 'PREEMPT'),
+  ('kill', 'KILL'),
+  ('hostallow-write', 'HOSTALLOW_WRITE'),
+  ('hostallow-read', 'HOSTALLOW_READ'),
+  ('daemon-list', 'DAEMON_LIST'),
+  (None, 'CONDOR_IDS'),
+  (None, 'SEC_DAEMON_AUTHENTICATION'),
+  (None, 'SEC_DEFAULT_AUTHENTICATION'),
+)
+
+MASTER_DEFAULTS = {
+  'HIGHPORT': 24500,
+  'LOWPORT': 20000,
+  'START': 'False',
+  'SUSPEND': 'False',
+  'PREEMPT': 'False',
+  'KILL': 'False',
+  'HOSTALLOW_WRITE': '*',
+  'HOSTALLOW_READ': '*',
+  'DAEMON_LIST': 'COLLECTOR, MASTER, NEGOTIATOR, SCHEDD',
+  'SEC_DAEMON_AUTHENTICATION': 'OPTIONAL',
+  'SEC_DEFAULT_AUTHENTICATION': 'OPTIONAL',
+}
+
+DEFAULT_COLLECTOR_PORT = 20001
+
+# 'pool-size' tiers and the number of slots each is meant for. 'expected-slots' picks the smallest tier that fits
+POOL_SIZES = (('small', 1000), ('medium', 5000), ('large', 20000), ('xlarge', 100000))
+
+# Knobs of each tier for the central manager. CLASSAD_LIFETIME, MAX_JOBS_RUNNING and the file descriptor limits
+# follow from the expected number of slots and the update interval of the workers
+POOL_MASTER_KNOBS = {
+  'small': {'NEGOTIATOR_INTERVAL': 60, 'NEGOTIATOR_CYCLE_DELAY': 20, 'NEGOTIATOR_MAX_TIME_PER_SUBMITTER': 60,
+            'COLLECTOR_QUERY_WORKERS': 2, 'SCHEDD_INTERVAL': 300, 'JOB_START_COUNT': 1, 'JOB_START_DELAY': 0},
+  'medium': {'NEGOTIATOR_INTERVAL': 90, 'NEGOTIATOR_CYCLE_DELAY': 30, 'NEGOTIATOR_MAX_TIME_PER_SUBMITTER': 120,
+             'COLLECTOR_QUERY_WORKERS': 4, 'SCHEDD_INTERVAL': 300, 'JOB_START_COUNT': 5, 'JOB_START_DELAY': 1,
+             'MAX_CONCURRENT_UPLOADS': 20, 'MAX_CONCURRENT_DOWNLOADS': 20},
+  'large': {'NEGOTIATOR_INTERVAL': 120, 'NEGOTIATOR_CYCLE_DELAY': 60, 'NEGOTIATOR_MAX_TIME_PER_SUBMITTER': 300,
+            'NEGOTIATOR_MAX_TIME_PER_PIESPIN': 120, 'COLLECTOR_QUERY_WORKERS': 8, 'SCHEDD_INTERVAL': 600,
+            'JOB_START_COUNT': 10, 'JOB_START_DELAY': 1, 'MAX_CONCURRENT_UPLOADS': 50, 'MAX_CONCURRENT_DOWNLOADS': 50,
+            'USE_SHARED_PORT': 'True'},
+  'xlarge': {'NEGOTIATOR_INTERVAL': 300, 'NEGOTIATOR_CYCLE_DELAY': 60, 'NEGOTIATOR_MAX_TIME_PER_SUBMITTER': 600,
+             'NEGOTIATOR_MAX_TIME_PER_PIESPIN': 300, 'COLLECTOR_QUERY_WORKERS': 16, 'SCHEDD_INTERVAL': 900,
+             'JOB_START_COUNT': 20, 'JOB_START_DELAY': 1, 'MAX_CONCURRENT_UPLOADS': 100, 'MAX_CONCURRENT_DOWNLOADS': 100,
+             'USE_SHARED_PORT': 'True'},
+}
+
+# Knobs of each tier for the workers, which have to be given the same 'pool-size' as the central manager
+POOL_WORKER_KNOBS = {
+  'small': {'UPDATE_INTERVAL': 300, 'MASTER_UPDATE_INTERVAL': 300},
+  'medium': {'UPDATE_INTERVAL': 300, 'MASTER_UPDATE_INTERVAL': 600},
+  'large': {'UPDATE_INTERVAL': 600, 'MASTER_UPDATE_INTERVAL': 900, 'UPDATE_COLLECTOR_WITH_TCP': 'True',
+            'USE_SHARED_PORT': 'True'},
+  'xlarge': {'UPDATE_INTERVAL': 900, 'MASTER_UPDATE_INTERVAL': 1200, 'UPDATE_COLLECTOR_WITH_TCP': 'True',
+             'USE_SHARED_PORT': 'True'},
+}
+
+# Lowest file descriptor limit set for the central manager daemons
+MIN_FILE_DESCRIPTORS = 4096
+# Seconds to probe the central managers when 'condor-host' lists more than one
+DEFAULT_PROBE_DEADLINE = 5
+# Seconds a workernode waits for the cvmfs repositories before it is configured not to start jobs. START is
+# turned back on by the cron job, which checks the repositories every minute until they are usable
+DEFAULT_CVMFS_WAIT = 600
+START_CRON = '/etc/cron.d/cern-cloudinit-condor-start'
+START_CRON_LOG = '/var/log/cern-cloudinit-condor-start.log'
+
+# Knobs that condor_reconfig does not pick up. Changing any of them requires the daemons to be restarted.
+# The master does not reliably start or stop daemons on a reconfig, and the daemons keep their ports
+RESTART_KNOBS = ('DAEMON_LIST', 'CONDOR_IDS', 'RELEASE_DIR', 'LOCAL_DIR', 'EXECUTE', 'HIGHPORT', 'LOWPORT', 'NUM_CPUS', 'MEMORY', 'DISK',
+                 'ENFORCE_CPU_AFFINITY', 'BASE_CGROUP', 'CGROUP_MEMORY_LIMIT_POLICY', 'USE_SHARED_PORT',
+                 'MAX_FILE_DESCRIPTORS', 'COLLECTOR_MAX_FILE_DESCRIPTORS')
+RESTART_KNOB_PREFIXES = ('SLOT_TYPE_', 'NUM_SLOTS')
+RESTART_KNOB_SUFFIXES = ('_CPU_AFFINITY', '_PORT')
+
+# Workernode 'slot-layout' values. Without it condor's default of one static slot per CPU is kept
+SLOT_LAYOUTS = ('static', 'partitionable', 'mixed')
+DEFAULT_EXECUTE = '/var/lib/condor/execute'
+
+# With 'cpu-affinity' the jobs run in a cgroup below this one, limited to the memory of their slot
+CONDOR_CGROUP = 'htcondor'
+DEFAULT_MEMORY_LIMIT = 'hard'
+
+def render_params(table, condor_cfg, defaults):
+  lines = []
+  for key, knob in table:
+    if key is not None and key in condor_cfg:
+      value = condor_cfg[key]
+    elif knob in defaults:
+      value = defaults[knob]
+    else:
+      continue
+    lines.append(knob+' = '+str(value)+'\n')
+  return lines
+
+def pool_size(condor_cfg):
+  # The tier of 'pool-size' or 'expected-slots' and the number of slots it stands for. (None, None) without either
+  if 'expected-slots' in condor_cfg:
+    slots = int(condor_cfg['expected-slots'])
+    for size, largest in POOL_SIZES:
+      if slots <= largest:
+        return size, slots
+    return POOL_SIZES[-1][0], slots
+  size = condor_cfg.get('pool-size')
+  if size is None:
+    return None, None
+  if size not in dict(POOL_SIZES):
+    print 'ATTENTION: unknown pool-size '+str(size)+' (use one of '+', '.join([name for name, largest in POOL_SIZES])+'). Keeping the condor defaults...'
+    return None, None
+  return size, dict(POOL_SIZES)[size]
+
+def pool_knobs(table, condor_cfg):
+  # The scaling knobs of the pool size for the workernode or master 'table'. Knobs set explicitly are left alone.
+  # The central manager gets one file descriptor per slot for the updates plus one for a CCB connection
+  size, slots = pool_size(condor_cfg)
+  if size is None:
+    return {}
+  knobs = dict(POOL_WORKER_KNOBS[size])
+  if table is MASTER_PARAMS:
+    interval = knobs['UPDATE_INTERVAL']
+    knobs = dict(POOL_MASTER_KNOBS[size])
+    knobs['CLASSAD_LIFETIME'] = 3 * interval
+    knobs['MAX_JOBS_RUNNING'] = slots
+    knobs['MAX_FILE_DESCRIPTORS'] = max(MIN_FILE_DESCRIPTORS, 2 * slots)
+    knobs['COLLECTOR_MAX_FILE_DESCRIPTORS'] = max(MIN_FILE_DESCRIPTORS, 2 * slots)
+  for key, knob in table:
+    if key is not None and key in condor_cfg and knob in knobs:
+      del knobs[knob]
+  return knobs
+
+def render_knobs(knobs):
+  return [knob+' = '+str(knobs[knob])+'\n' for knob in sorted(knobs.keys())]
+
+def render_tuned(table, condor_cfg, defaults):
+  # The knobs of 'table' followed by the scaling knobs of the pool size. With the shared port on, the shared_port
+  # daemon has to run too: it is added to DAEMON_LIST, the default one or the one given with 'daemon-list'
+  tuning = pool_knobs(table, condor_cfg)
+  if 'USE_SHARED_PORT' in tuning:
+    daemons = str(condor_cfg.get('daemon-list', defaults['DAEMON_LIST']))
+    if 'SHARED_PORT' not in daemons.upper().replace(',', ' ').split():
+      condor_cfg = dict(condor_cfg)
+      condor_cfg['daemon-list'] = daemons+', SHARED_PORT'
+  return render_params(table, condor_cfg, defaults) + render_knobs(tuning)
+
+def read_knobs(content):
+  knobs = {}
+  for line in content.splitlines():
+    if '=' in line and not line.lstrip().startswith('#'):
+      knob, value = line.split('=', 1)
+      knobs[knob.strip()] = value.strip()
+  return knobs
+
+def changed_knobs(old_content, new_content):
+  old_knobs = read_knobs(old_content)
+  new_knobs = read_knobs(new_content)
+  changed = []
+  for knob in set(old_knobs.keys()) | set(new_knobs.keys()):
+    if old_knobs.get(knob) != new_knobs.get(knob):
+      changed.append(knob)
+  changed.sort()
+  return changed
+
+def condor_running():
+  devnull = open(os.devnull, 'w')
+  try:
+    return cern_trace.call([SERVICE_cmd,'condor','status'], stdout=devnull, stderr=devnull) == 0
+  finally:
+    devnull.close()
+
+def apply_config(config_file, content):
+  # Compare the rendered configuration with the installed one and only touch condor when needed.
+  # Returns the action that was taken: 'unchanged', 'start', 'reconfig' or 'restart'
+  try:
+    f = open(config_file, 'r')
+    old_content = f.read()
+    f.close()
+  except IOError:
+    old_content = None
+
+  if old_content != content:
+    cern_util.write_atomic(config_file, content)
+
+  if not condor_running():
+    cern_trace.check_call([SERVICE_cmd,'condor','start'])
+    return 'start'
+
+  if old_content == content:
+    return 'unchanged'
+
+  changed = changed_knobs(old_content or '', content)
+  for knob in changed:
+    if knob in RESTART_KNOBS or knob.startswith(RESTART_KNOB_PREFIXES) or knob.endswith(RESTART_KNOB_SUFFIXES):
+      cern_trace.check_call([SERVICE_cmd,'condor','restart'])
+      return 'restart'
+
+  cern_trace.check_call([CONDOR_RECONFIG_cmd])
+  return 'reconfig'
+
+def start_cron(repositories, start):
+  # '%' ends a cron command, so it is escaped
+  command = sys.executable+' -c "import cloudinit.config.cc_condor as c; c.start_when_ready(%r, %r)"' % (repositories, str(start))
+  return ('# Written by cloud-init (condor): START is turned back on once the cvmfs repositories are usable\n'
+          '* * * * * root '+command.replace('%', '\\%')+' >> '+START_CRON_LOG+' 2>&1\n')
+
+def start_when_ready(repositories, start):
+  # Run by START_CRON. Once every repository mounts, START = False goes back to 'start' and the cron job removes itself
+  cc_cvmfs.check_ready({'local': {'repositories': repositories}})
+  if not cc_cvmfs.wait_ready(0):
+    return False
+  lines = []
+  for line in cern_util.read_file(CONDOR_CONFIG_LOCAL, '').splitlines(True):
+    if read_knobs(line) == {'START': 'False'}:
+      line = 'START = '+str(start)+'\n'
+    lines.append(line)
+  print 'The cvmfs repositories are usable, condor starts jobs again. Condor configuration applied: '+apply_config(CONDOR_CONFIG_LOCAL, ''.join(lines))
+  if os.path.exists(START_CRON):
+    os.unlink(START_CRON)
+  return True
+
+def user_exists(name):
+  try:
+    pwd.getpwnam(name)
+  except KeyError:
+    return False
+  return True
+
+def copy_skel(names):
+  # What 'useradd -m' does and newusers does not: fill the new home directories from /etc/skel
+  if not os.path.isdir(SKEL_DIR):
+    return
+  for name in names:
     try:
-      subprocess.call([SERVICE_cmd,'condor','stop'])
-    except:
-      print 'Please check if the previous Condor version is correctly installed.\n'
-
-    # Write new configuration file
-    f = open(ConfigFile,'w')        
-	
-    # Default variables    
-    DaemonList = 'MASTER, STARTD'
-    Highport = 24500
-    Lowport = 20000
-    CollectorHostPORT = 20001
-    Start = 'True'
-    Suspend = 'False'
-    Preempt = 'False'
-    Kill = 'False'
-    QueueSuperUsers = 'root, condor'        
-    AllowWrite = '*'
-    StarterAllowRunasOwner = 'False'
-    AllowDaemon = '*'
-    HostAllowRead = '*'
-    HostAllowWrite = '*'
-    SecDaemonAuthentication = 'OPTIONAL'
-
-    # PARAMETERS LIST
-    if 'workernode' in condor_cc_cfg:
-      condor_cfg = condor_cc_cfg['workernode']
-      if 'condor-host' in condor_cfg:
-        Hostname = condor_cfg['condor-host']
-      f.write("CONDOR_HOST = "+str(Hostname)+'\n')
-      f.write("COLLECTOR_NAME = Personal Condor at "+Hostname+'\n')
-
-      CondorAdmin = Hostname
-      UIDDomain = Hostname        
-
-      if 'collector-host-port' in condor_cfg:
-        CollectorHostPORT = condor_cfg['collector-host-port']
-      f.write("COLLECTOR_HOST = "+str(Hostname)+':'+str(CollectorHostPORT)+'\n')
-
-      if 'daemon-list' in condor_cfg:
-        DaemonList = condor_cfg['daemon-list']
-      f.write("DAEMON_LIST = "+DaemonList+'\n')
-
-      if 'release-dir' in condor_cfg:
-        f.write("RELEASE_DIR = "+condor_cfg['release-directory']+'\n')
-        
-      if 'local-dir' in condor_cfg:
-        f.write("LOCAL_DIR = "+condor_cfg['local-dir']+'\n')
-    
-      if 'condor-admin' in condor_cfg:
-        CondorAdmin = condor_cfg['condor-admin']
-      f.write("CONDOR_ADMIN = "+str(CondorAdmin)+'\n')
-
-      if 'queue-super-users' in condor_cfg:
-        QueueSuperUsers = condor_cfg['queue-super-users']
-      f.write("QUEUE_SUPER_USERS = "+str(QueueSuperUsers)+'\n')
-
-      if 'highport' in condor_cfg:
-        Highport = condor_cfg['highport']
-      f.write("HIGHPORT = "+str(Highport)+'\n')
-
-      if 'lowport' in condor_cfg:
-        Lowport = condor_cfg['lowport']
-      f.write("LOWPORT = "+str(Lowport)+'\n')
-
-      if 'uid-domain' in condor_cfg:
-        UIDDomain = condor_cfg['uid-domain']
-      f.write("UID_DOMAIN = "+str(UIDDomain)+'\n')
-
-      if 'allow-write' in condor_cfg:
-        AllowWrite = condor_cfg['allow-write']    
-      f.write("ALLOW_WRITE = "+str(AllowWrite)+'\n')
-
-      if 'dedicated-execute-account-regexp' in condor_cfg:
-        f.write("DEDICATED_EXECUTE_ACCOUNT_REGEXP = "+str(condor_cfg['dedicated-execute-account-regexp'])+'\n')
-
-      if 'allow-daemon' in condor_cfg:
-        AllowDaemon = condor_cfg['allow-daemon']
-      f.write("ALLOW_DAEMON = "+str(AllowDaemon)+'\n')
-
-      if 'starter-allow-runas-owner' in condor_cfg:
-        StarterAllowRunasOwner = condor_cfg['starter-allow-runas-owner']    
-      f.write("STARTER_ALLOW_RUNAS_OWNER = "+str(StarterAllowRunasOwner)+'\n')
-
-      if 'java' in condor_cfg:
-        f.write("JAVA = "+str(condor_cfg['java'])+'\n')
-
-      if 'user-job-wrapper' in condor_cfg:
-        f.write("USER_JOB_WRAPPER = "+str(condor_cfg['user-job-wrapper'])+'\n')
-
-      if 'gsite' in condor_cfg:
-        f.write("GSITE = "+str(condor_cfg['gsite'])+'\n')
-
-      if 'startd-attrs' in condor_cfg:
-        f.write("STARTD_ATTRS = "+str(condor_cfg['startd-attrs'])+'\n')
-
-      if 'enable-ssh-to-job' in condor_cfg:
-        f.write("ENABLE_SSH_TO_JOB = "+str(condor_cfg['enable-ssh-to-job'])+'\n')
+      user = pwd.getpwnam(name)
+    except KeyError:
+      continue
+    for directory, subdirs, files in os.walk(SKEL_DIR):
+      target = os.path.join(user.pw_dir, os.path.relpath(directory, SKEL_DIR))
+      if not os.path.isdir(target):
+        os.makedirs(target)
+        os.chown(target, user.pw_uid, user.pw_gid)
+      for f in files:
+        if not os.path.exists(os.path.join(target, f)):
+          shutil.copy2(os.path.join(directory, f), os.path.join(target, f))
+          os.chown(os.path.join(target, f), user.pw_uid, user.pw_gid)
+
+def create_users(names):
+  # A single newusers call takes the passwd/shadow lock once for the whole batch, instead of one useradd per account.
+  # With '-c NONE' the password field is stored as given, so the accounts are created locked ('!!', as useradd leaves them).
+  # If newusers fails (or does not know '-c'), the accounts it did not create are added one by one with useradd
+  if not names:
+    return
+  batch = ''.join([name+':!!::::/home/'+name+':'+SLOT_USER_SHELL+'\n' for name in names])
+  code, output = cern_trace.communicate([NEWUSERS_cmd, '-c', 'NONE'], batch)
+  if code == 0:
+    copy_skel(names)
+    return
+
+  print 'newusers failed ('+str(code)+'), creating the slot accounts with useradd'
+  failed = []
+  for name in names:
+    if not user_exists(name) and cern_trace.call([USERADD_cmd, '-m', '-s', SLOT_USER_SHELL, name]) != 0:
+      failed.append(name)
+  if failed:
+    raise subprocess.CalledProcessError(1, USERADD_cmd+' '+' '.join(failed))
+
+def provision_slot_users(slots, pool=0):
+  # Map the condor slots (ids such as '1', or '2_1' for the first dynamic slot of slot2) to the accounts
+  # user1, user2, ... and make sure that max(len(slots), pool) accounts exist.
+  # Existing accounts are skipped, so an image baked with
+  #   python -c "import cloudinit.config.cc_condor as c; c.provision_slot_users([], 128)"
+  # does not create any account at boot time.
+  lines = []
+  missing = []
+  for count in range(1, max(len(slots), int(pool))+1):
+    name = SLOT_USER_PREFIX+str(count)
+    if count <= len(slots):
+      lines.append("SLOT"+slots[count-1]+"_USER = "+name+'\n')
+    if not user_exists(name):
+      missing.append(name)
+
+  if missing:
+    print 'Creating '+str(len(missing))+' slot accounts'
+  create_users(missing)
+  return lines
+
+def device_of(path):
+  # Device of the file system that holds path, which does not need to exist yet
+  while not os.path.exists(path):
+    path = os.path.dirname(path)
+  return os.stat(path).st_dev
+
+def cvmfs_cache_mb(cfg, execute):
+  # What the cvmfs cache can still grow by if it shares the file system of the execute directory.
+  # The part already filled is not free space any more
+  if not isinstance(cfg.get('cvmfs'), dict):
+    return 0
+  local = cfg['cvmfs'].get('local', {})
+  cache_base = local.get('cache-base', cc_cvmfs.DEFAULT_CACHE_BASE)
+  if device_of(cache_base) != device_of(execute):
+    return 0
+  try:
+    quota = cc_cvmfs.quota_limit_mb(local)
+  except ValueError:
+    quota = cc_cvmfs.DEFAULT_QUOTA_LIMIT
+  return max(0, quota - facts.used_disk_mb(cache_base))
+
+def numa_cpu_sets(cpus, reserved=0):
+  # The CPUs of each NUMA node that are left to the slots, the first 'reserved' ones being kept for the OS.
+  # None on single node hosts (most VMs), where pinning the slots gains nothing
+  nodes = facts.get('numa_nodes')
+  if len(nodes) < 2:
+    print 'Single NUMA node, the condor slots are not pinned to CPUs'
+    return None
+  flat = sum(nodes, [])
+  if len(flat) - reserved != cpus:
+    print 'ATTENTION: the NUMA topology does not match the '+str(cpus)+' CPUs of the slots. The condor slots are not pinned to CPUs...'
+    return None
+  reserved = flat[:reserved]
+  nodes = [[cpu for cpu in node if cpu not in reserved] for node in nodes]
+  return [node for node in nodes if node]
+
+def memory_limits(condor_cfg):
+  # Jobs are kept within the memory of their slot by the memory cgroup controller, when the kernel has one
+  if 'memory' not in facts.get('cgroup_controllers'):
+    print 'The memory cgroup controller is not enabled, the condor slots have no memory limit'
+    return []
+  policy = condor_cfg.get('memory-limit', DEFAULT_MEMORY_LIMIT)
+  return ['BASE_CGROUP = '+CONDOR_CGROUP+'\n',
+          'CGROUP_MEMORY_LIMIT_POLICY = '+str(policy)+'\n']
+
+def slot_layout(condor_cfg, cvmfs_cache=0):
+  # Returns the slot knobs and the ids of all the slots jobs can run in.
+  # NUM_CPUS, MEMORY and DISK advertise what is left after the reservations for the OS (and the cvmfs cache),
+  # the slot types split that up.
+  cpus = facts.get('cpu_count')
+  layout = condor_cfg.get('slot-layout')
+  if layout is None:
+    return [], [str(n) for n in range(1, cpus+1)]
+  if layout not in SLOT_LAYOUTS:
+    print 'ATTENTION: unknown slot-layout '+str(layout)+' (use one of '+', '.join(SLOT_LAYOUTS)+'). Keeping the default slots...'
+    return [], [str(n) for n in range(1, cpus+1)]
+
+  cpus = max(1, cpus - int(condor_cfg.get('reserved-cpus', 0)))
+  memory = max(cpus, facts.get('memory_mb') - int(condor_cfg.get('reserved-memory', 0)))
+  execute = condor_cfg.get('execute', DEFAULT_EXECUTE)
+  disk = facts.free_disk_mb(execute) - int(condor_cfg.get('reserved-disk', 0))
+  if condor_cfg.get('reserve-cvmfs-cache'):
+    disk -= cvmfs_cache
+  disk = max(1, disk)
+
+  lines = ['NUM_CPUS = '+str(cpus)+'\n',
+           'MEMORY = '+str(memory)+'\n',
+           'DISK = '+str(disk * 1024)+'\n']     # KB
+  if layout == 'static':
+    static = cpus
+  elif layout == 'partitionable':
+    static = 0
+  else:
+    # 'static-slots' single core slots (half of the CPUs by default), the rest partitionable
+    static = min(cpus - 1, int(condor_cfg.get('static-slots', cpus / 2)))
+
+  # CPU ids of the static slots and of the partitionable slots: one partitionable slot per NUMA node with
+  # 'cpu-affinity', otherwise one for all the CPUs left
+  pinned = None
+  if condor_cfg.get('cpu-affinity'):
+    pinned = numa_cpu_sets(cpus, int(condor_cfg.get('reserved-cpus', 0)))
+  if pinned:
+    flat = sum(pinned, [])
+    static_cpus = [[cpu] for cpu in flat[:static]]
+    chunks = [[cpu for cpu in node if cpu not in flat[:static]] for node in pinned]
+    chunks = [chunk for chunk in chunks if chunk]
+  else:
+    static_cpus = [None] * static
+    chunks = []
+    if cpus > static:
+      chunks = [[None] * (cpus - static)]
+
+  slots = [str(n) for n in range(1, static+1)]
+  if static:
+    # Memory, disk and swap of the static slots are shared out evenly unless some CPUs go to partitionable slots
+    if layout == 'static':
+      lines.append('SLOT_TYPE_1 = cpus=1\n')
+    else:
+      share = '1/'+str(cpus)
+      lines.append('SLOT_TYPE_1 = cpus=1, memory='+str(memory / cpus)+', disk='+share+', swap='+share+'\n')
+    lines.append('NUM_SLOTS_TYPE_1 = '+str(static)+'\n')
+
+  first_type = 1
+  if static:
+    first_type = 2
+  left = memory - static * (memory / cpus)
+  for index, chunk in enumerate(chunks):
+    # Partitionable slots, carved up into dynamic slots as jobs request them
+    slot_type = str(first_type + index)
+    if len(chunks) == 1 and not static:
+      lines.append('SLOT_TYPE_'+slot_type+' = 100%\n')
+    else:
+      chunk_memory = left
+      if index < len(chunks) - 1:
+        chunk_memory = len(chunk) * (memory / cpus)
+      left -= chunk_memory
+      share = str(len(chunk))+'/'+str(cpus)
+      lines.append('SLOT_TYPE_'+slot_type+' = cpus='+str(len(chunk))+', memory='+str(chunk_memory)+', disk='+share+', swap='+share+'\n')
+    lines.append('SLOT_TYPE_'+slot_type+'_PARTITIONABLE = True\n')
+    lines.append('NUM_SLOTS_TYPE_'+slot_type+' = 1\n')
+    slots.extend([str(static+index+1)+'_'+str(n) for n in range(1, len(chunk)+1)])
+
+  if pinned:
+    lines.append('ENFORCE_CPU_AFFINITY = True\n')
+    for n, cpu_set in enumerate(static_cpus + chunks):
+      lines.append('SLOT'+str(n+1)+'_CPU_AFFINITY = '+','.join([str(cpu) for cpu in cpu_set])+'\n')
+  if condor_cfg.get('cpu-affinity'):
+    lines.extend(memory_limits(condor_cfg))
+
+  print 'Condor slot layout: '+layout+' with '+str(cpus)+' CPUs, '+str(memory)+' MB of memory and '+str(disk)+' MB of disk'
+  return lines, slots
+
+def parse_collectors(hosts, port):
+  # 'condor-host' is a host or a list of hosts, each optionally with its own ':port'
+  if not isinstance(hosts, list):
+    hosts = [hosts]
+  collectors = []
+  for host in hosts:
+    host = str(host)
+    if ':' in host:
+      host, host_port = host.rsplit(':', 1)
+      collectors.append((host, int(host_port)))
+    else:
+      collectors.append((host, int(port)))
+  return collectors
+
+def probe_collector(collector, deadline):
+  # TCP connect latency and, once condor is installed, the time a collector query takes
+  host, port = collector
+  end = time.time() + deadline
+  with cern_trace.span('collector probe', 'probe', host=host, port=port) as s:
+    result = {'connect_ms': int(cern_util.connect_ms(host, port, deadline))}
+    s.set(**result)
+    if os.path.exists(CONDOR_STATUS_cmd):
+      start = time.time()
+      code, output = cern_trace.communicate([CONDOR_STATUS_cmd, '-pool', host+':'+str(port), '-collector', '-format', '%s\n', 'Name'],
+                                            timeout=max(0.1, end - time.time()), stderr=subprocess.PIPE)
+      if code == 0:
+        result['query_ms'] = int((time.time() - start) * 1000)
+      s.set(**result)
+  return result
+
+def rank_collectors(collectors, deadline):
+  # All the candidates are probed concurrently. Best first: those answering the collector query, then those
+  # accepting connections, by latency. The unreachable ones are kept last, as failover
+  with cern_trace.span('collector ranking', 'probe', deadline=deadline) as s:
+    results = cern_util.concurrently(lambda collector: probe_collector(collector, deadline), collectors, deadline)
+
+    def rank(collector):
+      result = results.get(collector)
+      if result is None:
+        return (2, 0, collectors.index(collector))
+      if 'query_ms' in result:
+        return (0, result['query_ms'], 0)
+      return (1, result['connect_ms'], 0)
+    ranked = sorted(collectors, key=rank)
+    s.set(ranking=[host+':'+str(port) for host, port in ranked])
+  print 'Condor central managers, best first: '+', '.join([host+':'+str(port) for host, port in ranked])
+  return ranked
 
-      if 'certificate-mapfile' in condor_cfg:
-        f.write("CERTIFICATE_MAPFILE = "+str(condor_cfg['certificate-mapfile'])+'\n')
+##############
+##############
 
-      if 'ccb-address' in condor_cfg:
-        f.write("CCB_ADDRESS = "+str(condor_cfg['ccb-address'])+'\n')
+def phases(cfg, log):
+  cern_fetch.configure(cfg)
+  condor_cc_cfg = cfg['condor']    
+  if 'master' in condor_cc_cfg and 'workernode' in condor_cc_cfg:
+    print 'You can not set condor master and condor workernode in the same machine.\n'
+    print 'Exiting condor configuration...'
+    return []
     
-      if 'execute' in condor_cfg:
-        f.write("EXECUTE = "+str(condor_cfg['execute'])+'\n')        
-
-      if 'starter-debug' in condor_cfg:
-        f.write("STARTER_DEBUG = "+str(condor_cfg['starter-debug'])+'\n')
-
-      if 'startd-debug' in condor_cfg:
-        f.write("STARTD_DEBUG = "+str(condor_cfg['startd-debug'])+'\n')
-
-      if 'sec-default-authentication' in condor_cfg:
-        f.write("SEC_DEFAULT_AUTHENTICATION = "+str(condor_cfg['sec-default-authentication'])+'\n')
-
-      if 'sec-default-authentication-methods' in condor_cfg:
-        f.write("SEC_DEFAULT_AUTHENTICATION_METHODS = "+str(condor_cfg['sec-default-authentication-methods'])+'\n')
-
-      if 'sec-daemon-authentication' in condor_cfg:
-        SecDaemonAuthentication = condor_cfg['sec-daemon-authentication']
-      f.write("SEC_DAEMON_AUTHENTICATION = "+str(SecDaemonAuthentication)+'\n')
-
-      if 'sec-password-file' in condor_cfg:
-        f.write("SEC_PASSWORD_FILE = "+str(condor_cfg['sec-password-file'])+'\n')
+  Installation = False
 
-      if 'update-collector-with-tcp' in condor_cfg:
-        f.write("UPDATE_COLLECTOR_WITH_TCP = "+str(condor_cfg['update-collector-with-tcp'])+'\n')
+  # If Install is False, this will assume that Condor is already installed in the destination.
+  # There is the possibilty of telling the module where to download Condor from, with 'rpm-url'
+  if 'install' in condor_cc_cfg:
+    Installation = condor_cc_cfg['install']
 
-      if 'max-job-retirement-time' in condor_cfg:
-        f.write("MAXJOBRETIREMENTTIME = "+str(condor_cfg['max-job-retirement-time'])+'\n')
+  # Shared between the phases
+  state = {'slot-users': [], 'start-cron': None}
 
-      if 'startd-cron-joblist' in condor_cfg:
-        f.write("STARTD_CRON_JOBLIST = "+str(condor_cfg['startd-cron-joblist'])+'\n')
+  def install():
+    install_condor(cfg)
 
-      if 'startd-cron-atlval-mode' in condor_cfg:
-        f.write("STARTD_CRON_ATLVAL_MODE = "+str(condor_cfg['startd-cron-atlval-mode'])+'\n')
+  def users():
+    # Dynamically writing the slots and their users. Accounts beyond the number of slots can be pre-created with 'slot-user-pool'
+    condor_cfg = condor_cc_cfg['workernode']
+    layout, slots = slot_layout(condor_cfg, cvmfs_cache_mb(cfg, condor_cfg.get('execute', DEFAULT_EXECUTE)))
+    state['slot-users'] = layout + provision_slot_users(slots, condor_cfg.get('slot-user-pool', 0))
 
-      if 'startd-cron-atlval-executable' in condor_cfg:
-        f.write("STARTD_CRON_ATLVAL_EXECUTABLE = "+str(condor_cfg['startd-cron-atlval-executable'])+'\n')
+  def config():
+    # The whole configuration file is built in memory and only installed if it differs from the current one
+    lines = []
 
-      if 'startd-cron-atlval-period' in condor_cfg:
-        f.write("STARTD_CRON_ATLVAL_PERIOD = "+str(condor_cfg['startd-cron-atlval-period'])+'\n')
-
-      if 'startd-cron-atlval-job-load' in condor_cfg:
-        f.write("STARTD_CRON_ATLVAL_JOB_LOAD = "+str(condor_cfg['startd-cron-atlval-job-load'])+'\n')
-
-      if 'hostallow-write' in condor_cfg:
-        HostAllowWrite = condor_cfg['hostallow-write']    
-      f.write("HOSTALLOW_WRITE = "+str(HostAllowWrite)+'\n')
-    
-      if 'hostallow-read' in condor_cfg:
-        HostAllowRead = condor_cfg['hostallow-read']    
-      f.write("HOSTALLOW_READ = "+str(HostAllowRead)+'\n')
-
-      if 'start' in condor_cfg:
-        Start = condor_cfg['start']
-      f.write("START = "+str(Start)+'\n')
-
-      if 'suspend' in condor_cfg:
-        Suspend = condor_cfg['suspend']
-      f.write("SUSPEND = "+str(Suspend)+'\n')
-
-      if 'preempt' in condor_cfg:
-        Preempt = condor_cfg['preempt']
-      f.write("PREEMPT = "+str(Preempt)+'\n')
-        
-      if 'kill' in condor_cfg:
-        Kill = condor_cfg['kill']
-      f.write("KILL = "+str(Kill)+'\n')
+    # Default CONDOR_HOST
+    Hostname = facts.get('fqdn')
 
+    # PARAMETERS LIST
+    if 'workernode' in condor_cc_cfg:
+      condor_cfg = condor_cc_cfg['workernode']
+      # No job should land here before the cvmfs repositories are mounted. Their check is only waited for when it
+      # is part of this run: when cvmfs comes later, START = False and the cron job are written right away
+      if 'cvmfs' in cfg and not cc_cvmfs.wait_ready(int(condor_cfg.get('cvmfs-wait', DEFAULT_CVMFS_WAIT))):
+        print 'ATTENTION: the cvmfs repositories are not usable. This workernode will not start jobs (START = False) until they are...'
+        state['start-cron'] = start_cron(cfg['cvmfs'].get('local', {}).get('repositories', ''),
+                                         condor_cfg.get('start', WORKERNODE_DEFAULTS['START']))
+        condor_cfg = dict(condor_cfg, start='False')
+      CollectorHostPORT = condor_cfg.get('collector-host-port', DEFAULT_COLLECTOR_PORT)
+      Collectors = [(Hostname, CollectorHostPORT)]
+      if 'condor-host' in condor_cfg:
+        # With several central managers the best one becomes CONDOR_HOST, the others are failover collectors
+        Collectors = parse_collectors(condor_cfg['condor-host'], CollectorHostPORT)
+        if len(Collectors) > 1:
+          Collectors = rank_collectors(Collectors, condor_cfg.get('condor-host-deadline', DEFAULT_PROBE_DEADLINE))
+        Hostname = Collectors[0][0]
+
+      lines.append("CONDOR_HOST = "+str(Hostname)+'\n')
+      lines.append("COLLECTOR_NAME = Personal Condor at "+str(Hostname)+'\n')
+      lines.append("COLLECTOR_HOST = "+', '.join([str(host)+':'+str(port) for host, port in Collectors])+'\n')
+
+      defaults = dict(WORKERNODE_DEFAULTS)
+      defaults['CONDOR_ADMIN'] = Hostname
+      defaults['UID_DOMAIN'] = Hostname
+      defaults['CONDOR_IDS'] = facts.get('condor_ids')
+      lines.extend(render_tuned(WORKERNODE_PARAMS, condor_cfg, defaults))
 
       # End of parameters
       ##############################################################################
-            
-      # Dynamically writing SLOT users
-      CPUs_aux1 = subprocess.Popen([CAT_cmd, "/proc/cpuinfo"], stdout=subprocess.PIPE)
-      CPUs_aux2 = subprocess.Popen([GREP_cmd, "processor"], stdin=CPUs_aux1.stdout, stdout=subprocess.PIPE)
-      CPUs_aux1.stdout.close()
-
-      CPUs, cpuerr = CPUs_aux2.communicate()
-	    	
-      cid1 = subprocess.Popen([CAT_cmd, "/etc/passwd"], stdout=subprocess.PIPE)
-      cid2 = subprocess.Popen([GREP_cmd, "condor:"],stdin=cid1.stdout, stdout=subprocess.PIPE)
-      cid3 = subprocess.Popen([AWK_cmd, "-F:",'{print $3"."$4}'], stdin=cid2.stdout, stdout=subprocess.PIPE)
-      cid1.stdout.close()
-      cid2.stdout.close()
-        
-      CondorIDs, Err = cid3.communicate()
-   
-      f.write("CONDOR_IDS = "+str(CondorIDs)+'\n')
-
-      for count in range(1,len(CPUs.splitlines())+1):
-        f.write("SLOT"+str(count)+"_USER = user"+str(count)+'\n')
-        os.system("/usr/sbin/useradd -m -s /sbin/nologin  user"+str(count)+" > /dev/null 2>&1\n")
-
-    Start = 'False'           
-    DaemonList = 'COLLECTOR, MASTER, NEGOTIATOR, SCHEDD'        
-    if 'master' in condor_cc_cfg:
-      condor_cfg = condor_cc_cfg['master']
-
-      f.write("CONDOR_HOST = "+str(Hostname)+'\n')
-
-      f.write("COLLECTOR_NAME = Personal Condor at "+Hostname+'\n')
-
-      if 'collector-host-port' in condor_cfg:
-        CollectorHostPORT = condor_cfg['collector-host-port']
-      f.write("COLLECTOR_HOST = "+str(Hostname)+':'+str(CollectorHostPORT)+'\n')
-            
-      if 'highport' in condor_cfg:
-        Highport = condor_cfg['highport']
-      f.write("HIGHPORT = "+str(Highport)+'\n')
-
-      if 'lowport' in condor_cfg:
-        Lowport = condor_cfg['lowport']
-      f.write("LOWPORT = "+str(Lowport)+'\n')
-
-      if 'start' in condor_cfg:
-        Start = condor_cfg['start']
-      f.write("START = "+str(Start)+'\n')
-
-      if 'suspend' in condor_cfg:
-        Suspend = condor_cfg['suspend']
-      f.write("SUSPEND = "+str(Suspend)+'\n')
-
-      if 'preempt' in condor_cfg:
-        Preempt = condor_cfg['preempt']
-      f.write("PREEMPT = "+str(Preempt)+'\n')
-
-      if 'kill' in condor_cfg:
-        Kill = condor_cfg['kill']
-      f.write("KILL = "+str(Kill)+'\n')
-
-      if 'hostallow-write' in condor_cfg:
-        HostAllowWrite = condor_cfg['hostallow-write']
-      f.write("HOSTALLOW_WRITE = "+str(HostAllowWrite)+'\n')
 
-      if 'hostallow-read' in condor_cfg:
-        HostAllowRead = condor_cfg['hostallow-read']
-      f.write("HOSTALLOW_READ = "+str(HostAllowRead)+'\n')
+      lines.extend(state['slot-users'])
 
-      if 'daemon-list' in condor_cfg:
-        DaemonList = condor_cfg['daemon-list']
-      f.write("DAEMON_LIST = "+DaemonList+'\n')
-
-      cid1 = subprocess.Popen([CAT_cmd, "/etc/passwd"], stdout=subprocess.PIPE)
-      cid2 = subprocess.Popen([GREP_cmd, "condor:"],stdin=cid1.stdout, stdout=subprocess.PIPE)
-      cid3 = subprocess.Popen([AWK_cmd, "-F:",'{print $3"."$4}'], stdin=cid2.stdout, stdout=subprocess.PIPE)
-      cid1.stdout.close()
-      cid2.stdout.close()
-
-      CondorIDs, Err = cid3.communicate()
-
-      f.write("CONDOR_IDS = "+str(CondorIDs)+'\n')
+    if 'master' in condor_cc_cfg:
+      condor_cfg = condor_cc_cfg['master']
+      CollectorHostPORT = condor_cfg.get('collector-host-port', DEFAULT_COLLECTOR_PORT)
+
+      lines.append("CONDOR_HOST = "+str(Hostname)+'\n')
+      lines.append("COLLECTOR_NAME = Personal Condor at "+str(Hostname)+'\n')
+      lines.append("COLLECTOR_HOST = "+str(Hostname)+':'+str(CollectorHostPORT)+'\n')
+
+      defaults = dict(MASTER_DEFAULTS)
+      defaults['CONDOR_IDS'] = facts.get('condor_ids')
+      lines.extend(render_tuned(MASTER_PARAMS, condor_cfg, defaults))
+
+    state['config'] = ''.join(lines)
+
+  def firewall():
+    cern_trace.check_call([IPTABLES_cmd, 'stop'])		# The iptables should be configured instead of being stopped 
+
+  def service():
+    if Installation and not os.path.lexists(CONDOR_CONFIG_LINK):
+      os.symlink(CONDOR_CONFIG_LOCAL, CONDOR_CONFIG_LINK)
+
+    # Install the new configuration and start, reconfigure or restart condor accordingly
+    Action = apply_config(CONDOR_CONFIG_LOCAL, state['config'])
+    print 'Condor configuration applied: '+Action
+    if state['start-cron']:
+      cern_util.write_atomic(START_CRON, state['start-cron'])
+    elif os.path.exists(START_CRON):
+      os.unlink(START_CRON)
+
+  condor_phases = []
+  if Installation == True:
+    condor_phases.append(cern_phases.Phase('condor.install', install, locks=(cern_phases.RPMDB, cern_phases.PASSWD)))
+  if 'workernode' in condor_cc_cfg:
+    condor_phases.append(cern_phases.Phase('condor.users', users, locks=(cern_phases.PASSWD,)))
+  # A workernode waits for the cvmfs check, whatever its outcome: config() finds out whether the repositories are usable
+  waits = ()
+  if 'workernode' in condor_cc_cfg:
+    waits = ('cvmfs.ready',)
+  condor_phases.extend([
+    cern_phases.Phase('condor.config', config, after=('condor.install', 'condor.users'), waits=waits),
+    cern_phases.Phase('condor.firewall', firewall, locks=(cern_phases.IPTABLES,)),
+    cern_phases.Phase('condor.service', service, after=('condor.config', 'condor.firewall')),
+  ])
+  return condor_phases
 
-      f.write("SEC_DAEMON_AUTHENTICATION = OPTIONAL\n")
-      f.write("SEC_DEFAULT_AUTHENTICATION = OPTIONAL\n")
+##############
+##############
 
-    f.close()
-    subprocess.check_call(['/etc/init.d/iptables', 'stop'])		# The iptables should be configured instead of being stopped 
-
-	
-    # Moving our config file to the right directory (erase the old config)        
-    subprocess.call([RM_cmd,'-f','/etc/condor/condor_config.local'])	# Just in case
-    subprocess.check_call([CP_cmd,ConfigFile,'/etc/condor/'])
-    subprocess.call([RM_cmd,'-f',ConfigFile])
-      
-    if Installation:
-      subprocess.call(["/bin/ln -s /etc/condor/condor_config.local /etc/condor/config.d/condor_config.local"], shell=True)
-
-    # Starting condor
-    subprocess.check_call([SERVICE_cmd,'condor','start'])
+def handle(_name, cfg, cloud, log, _args):
+  if 'condor' in cfg:
+    if not cern_phases.orchestrated(cfg, log):
+      cern_phases.run(phases(cfg, log), log=log)
 
     # END
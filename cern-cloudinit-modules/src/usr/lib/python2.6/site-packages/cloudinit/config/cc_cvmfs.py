@@ -9,10 +9,18 @@
 import subprocess
 import cloudinit.util as util
 import cloudinit.config as cc
-import platform
-import urllib
+import cloudinit.config.cern_facts as facts
+import cloudinit.config.cern_fetch as cern_fetch
+import cloudinit.config.cern_packages as cern_packages
+import cloudinit.config.cern_phases as cern_phases
+import cloudinit.config.cern_trace as cern_trace
+import cloudinit.config.cern_util as cern_util
+import json
 import sys
 import os
+import threading
+import time
+import urlparse
 
 # In case this runs to early during the boot, the PATH environment can still be unset. Let's define each necessary command's path
 # Using subprocess calls so it raises exceptions directly from the child process to the parent
@@ -21,54 +29,287 @@ YUM_cmd = '/usr/bin/yum'
 SERVICE_cmd = '/sbin/service'
 CHK_cmd = '/sbin/chkconfig'
 
+CVMFS_PACKAGES = ['cvmfs-keys','cvmfs','cvmfs-init-scripts']
 
-def install_cvmfs():
-  # Let's retrieve the current cvmfs release
-  ReleaseAux = subprocess.Popen([RPM_cmd, "-q", "--queryformat", "%{version}", "sl-release"], stdout=subprocess.PIPE)
-  Release, ReleaseErr = ReleaseAux.communicate()
+LocalFile = '/etc/cvmfs/default.local'
+DomainFile = '/etc/cvmfs/domain.d/cern.ch.local'
+CMS_LocalFile = '/etc/cvmfs/config.d/cms.cern.ch.local'
 
-  ReleaseMajor = Release[0]
-  arch = platform.machine()       # Platform info
+# Cache sizes written unless 'quota-limit', 'memcache-size' or 'nfiles' are given. 'auto' sizes them from the machine
+DEFAULT_CACHE_BASE = '/var/lib/cvmfs'
+DEFAULT_QUOTA_LIMIT = 8000
+DEFAULT_NFILES = 65535
+# With 'quota-limit: auto' the cache takes the free space of its file system, plus what it already uses,
+# but 'quota-headroom' MB, and never less than 'quota-floor' MB
+DEFAULT_QUOTA_HEADROOM = 2000
+DEFAULT_QUOTA_FLOOR = 1000
+# 'memcache-size: auto' gives the in-memory caches 1/MEMCACHE_RAM_SHARE of the RAM, within these bounds (MB)
+MEMCACHE_RAM_SHARE = 64
+MEMCACHE_MIN = 16
+MEMCACHE_MAX = 256
+# 'nfiles: auto' asks for this many, but never more than a fraction of what the system allows
+AUTO_NFILES = 262144
+NFILES_SYSTEM_SHARE = 2
 
-  # cvmfs package url
-  cvmfs_rpm_url = 'http://cvmrepo.web.cern.ch/cvmrepo/yum/cvmfs/EL/'+ReleaseMajor+'/'+arch+'/cvmfs-release-2-3.el'+ReleaseMajor+'.noarch.rpm'
-  # Downloading cvmfs .rpm file to /home path
-  urllib.urlretrieve(cvmfs_rpm_url, '/home/cvmfs.rpm')
-  if subprocess.check_call([RPM_cmd, "-Uvh", "/home/cvmfs.rpm"]): # If it returns 0 then it is fine
-    print ".rpm installation failed"
-    return
-  else:
-    print ".rpm installation successful."
+# Where the repositories are mounted, and the marker written once all of CVMFS_REPOSITORIES are usable.
+# Each repository gets 'mount-timeout' seconds
+CVMFS_MOUNT_ROOT = '/cvmfs'
+READY_FILE = '/var/run/cern-cloudinit-cvmfs.ready'
+DEFAULT_MOUNT_TIMEOUT = 30
 
-  # Install cvmfs packages
-  try:
-    subprocess.check_call([YUM_cmd,'-y','install','cvmfs-keys','cvmfs','cvmfs-init-scripts'])       # cvmfs-auto-setup can also be installed. Meant for Tier 3's
-    #cc.install_packages(("cvmfs-keys","cvmfs","cvmfs-init-scripts",))   # If this fails then yum clean all
-  except:
-    subprocess.call([YUM_cmd,'clean','all'])
+# The cache warming process of the 'prefetch' section, spending at most PREFETCH_BUDGET_SHARE of the cache quota
+# unless 'budget-mb' is given
+PREFETCH_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cern_prefetch.py')
+PREFETCH_LOG = '/var/log/cern-cloudinit-prefetch.log'
+PREFETCH_BUDGET_SHARE = 0.25
+
+# Set by the readiness step of this process: _checked once it is done, _ready if all the repositories are mounted.
+# _scheduled is set once this process is to run it: before that, there is nothing to wait for
+_scheduled = threading.Event()
+_checked = threading.Event()
+_ready = threading.Event()
+
+# Rankings of the proxies and stratum-1s measured at boot, reused for 'ranking-ttl' seconds
+RANKING_CACHE = '/var/lib/cloud/data/cern_cvmfs_ranking.json'
+DEFAULT_RANKING_TTL = 6 * 3600
+DEFAULT_PROBE_DEADLINE = 3
+DEFAULT_PROXY_PORT = 3128
+# Proxies within PROXY_GROUP_RATIO times the latency of the fastest one of a group (plus PROXY_GROUP_SLACK_MS)
+# share the load of that group
+PROXY_GROUP_RATIO = 1.5
+PROXY_GROUP_SLACK_MS = 2
+
+
+def release_major():
+  # Major version of the OS, from /etc or else from the sl-release package as it used to be found. None if unknown
+  major = facts.os_major()
+  if major is None:
+    code, version = cern_trace.communicate([RPM_cmd, '-q', '--queryformat', '%{version}', 'sl-release'], stderr=subprocess.PIPE)
+    if code == 0 and version[:1].isdigit():
+      major = version.split('.')[0]
+  return major
+
+def package_plan(params):
+  # Install the cvmfs release package (yum repository and keys) if needed and return the packages to install. Used by cern_packages
+  if cern_packages.missing(['cvmfs-release']):
+    # Let's retrieve the current cvmfs release
+    ReleaseMajor = release_major()
+    arch = facts.get('arch')       # Platform info
+    if ReleaseMajor is None:
+      print '\nATTENTION: the OS release is unknown, the cvmfs-release package is not installed. The cvmfs packages have to come from a configured repository...\n'
+      return CVMFS_PACKAGES
+
+    # cvmfs package url
+    cvmfs_rpm_url = 'http://cvmrepo.web.cern.ch/cvmrepo/yum/cvmfs/EL/'+ReleaseMajor+'/'+arch+'/cvmfs-release-2-3.el'+ReleaseMajor+'.noarch.rpm'
+    # Downloading cvmfs .rpm file, or reusing the cached one
+    cvmfs_rpm = cern_fetch.fetch(cvmfs_rpm_url, params.get('release-sha256'))
+    if cern_trace.call([RPM_cmd, "-Uvh", cvmfs_rpm]): # If it returns 0 then it is fine
+      print ".rpm installation failed"
+      return None
+    else:
+      print ".rpm installation successful."
+
+  return CVMFS_PACKAGES    # cvmfs-auto-setup can also be installed. Meant for Tier 3's
+
+def install_cvmfs(cfg):
+  # Install cvmfs packages, together with the other modules' packages
+  if not cern_packages.ensure(cfg).get('cvmfs'):
+    cern_trace.call([YUM_cmd,'clean','all'])
     try:
-      subprocess.check_call([YUM_cmd,'-y','install','cvmfs-keys','cvmfs','cvmfs-init-scripts'])
-                                #cc.install_packages(("cvmfs-keys","cvmfs","cvmfs-init-scripts",))
+      cern_trace.check_call([YUM_cmd,'-y','install']+CVMFS_PACKAGES)
     except:
       print "CVMFS installation from the yum repository has failed\n"
       print "Ignoring CVMFS setup..."
       return
 
   # Base setup
-  os.system("export PATH=${PATH}:/usr/bin:/sbin; cvmfs_config setup")
-  #subprocess.call(["/usr/bin/cvmfs_config setup"], shell=True)
+  cern_trace.system("export PATH=${PATH}:/usr/bin:/sbin; cvmfs_config setup")
+  #cern_trace.call(["/usr/bin/cvmfs_config setup"], shell=True)
 
   # Start autofs and make it starting automatically after reboot 
-  subprocess.check_call([SERVICE_cmd,'autofs','start'])
-  subprocess.check_call([CHK_cmd,'autofs','on'])
-  os.system("export PATH=${PATH}:/usr/bin:/sbin; cvmfs_config chksetup")
-                #subprocess.check_call(['cvmfs_config','chksetup'])
+  cern_trace.check_call([SERVICE_cmd,'autofs','start'])
+  cern_trace.check_call([CHK_cmd,'autofs','on'])
+  cern_trace.system("export PATH=${PATH}:/usr/bin:/sbin; cvmfs_config chksetup")
+                #cern_trace.check_call(['cvmfs_config','chksetup'])
 
 ########################
 ########################
 
+def quota_limit_mb(local_args):
+  # CVMFS_QUOTA_LIMIT in MB. Also used by cc_condor to keep the cache out of the condor scratch space
+  quota = local_args.get('quota-limit', DEFAULT_QUOTA_LIMIT)
+  if quota != 'auto':
+    return int(quota)
+  # The cache filled at earlier boots counts as available, or the quota would shrink by it at every boot
+  cache_base = local_args.get('cache-base', DEFAULT_CACHE_BASE)
+  free = facts.free_disk_mb(cache_base)
+  used = facts.used_disk_mb(cache_base)
+  headroom = int(local_args.get('quota-headroom', DEFAULT_QUOTA_HEADROOM))
+  floor = int(local_args.get('quota-floor', DEFAULT_QUOTA_FLOOR))
+  quota = max(floor, free + used - headroom)
+  print 'cvmfs quota-limit auto: '+str(quota)+' MB ('+str(free)+' MB free and '+str(used)+' MB used by '+cache_base+', '+str(headroom)+' MB headroom, '+str(floor)+' MB floor)'
+  return quota
+
+def memcache_size_mb(local_args):
+  # CVMFS_MEMCACHE_SIZE in MB, None to keep the cvmfs default
+  memcache = local_args.get('memcache-size')
+  if memcache != 'auto':
+    return memcache
+  memcache = max(MEMCACHE_MIN, min(MEMCACHE_MAX, facts.get('memory_mb') / MEMCACHE_RAM_SHARE))
+  print 'cvmfs memcache-size auto: '+str(memcache)+' MB ('+str(facts.get('memory_mb'))+' MB of RAM)'
+  return memcache
+
+def nfiles(local_args):
+  # CVMFS_NFILES. The default and 'auto' are capped so that the cvmfs process can actually raise its limit that high,
+  # a number given with 'nfiles' is written as it is
+  wanted = local_args.get('nfiles', DEFAULT_NFILES)
+  explicit = 'nfiles' in local_args and wanted != 'auto'
+  if wanted == 'auto':
+    wanted = AUTO_NFILES
+  wanted = int(wanted)
+  limit = facts.get('open_files_limit')
+  if limit is None or wanted <= limit / NFILES_SYSTEM_SHARE:
+    return wanted
+  if explicit:
+    print 'ATTENTION: cvmfs nfiles '+str(wanted)+' is more than 1/'+str(NFILES_SYSTEM_SHARE)+' of the '+str(limit)+' open files the system allows. Keeping it...'
+    return wanted
+  print 'cvmfs nfiles: '+str(limit / NFILES_SYSTEM_SHARE)+' instead of '+str(wanted)+' (the system allows '+str(limit)+' open files)'
+  return limit / NFILES_SYSTEM_SHARE
+
+def cached_ranking(key, ttl, rank):
+  # rank() returns (ranking, measured). Its ranking is saved under 'key' and reused for 'ttl' seconds,
+  # unless nothing could be measured (e.g. the network is not up yet)
+  try:
+    rankings = json.loads(cern_util.read_file(RANKING_CACHE, '{}'))
+  except ValueError:
+    rankings = {}
+  entry = rankings.get(key)
+  if entry is not None and 0 <= time.time() - entry['time'] < int(ttl):
+    print 'Reusing the ranking measured '+str(int(time.time() - entry['time']))+' seconds ago for '+key
+    return entry['ranking']
+
+  ranking, measured = rank()
+  if measured:
+    rankings[key] = {'time': time.time(), 'ranking': ranking}
+    try:
+      if not os.path.isdir(os.path.dirname(RANKING_CACHE)):
+        os.makedirs(os.path.dirname(RANKING_CACHE))
+      cern_util.write_atomic(RANKING_CACHE, json.dumps(rankings, sort_keys=True, indent=1)+'\n')
+    except (IOError, OSError):
+      pass      # Only saves probing at the next boot
+  return ranking
+
+def probe_proxy(proxy, probe_url, deadline):
+  # Connect latency of the proxy, or the time to fetch 'probe_url' through it.
+  # cvmfs also takes proxies without a scheme ('squid:3128'), which urlsplit would read as a scheme
+  url = proxy
+  if '://' not in url:
+    url = 'http://'+url
+  address = urlparse.urlsplit(url)
+  with cern_trace.span('proxy probe', 'probe', proxy=proxy) as s:
+    result = {'connect_ms': int(cern_util.connect_ms(address.hostname, address.port or DEFAULT_PROXY_PORT, deadline))}
+    s.set(**result)
+    if probe_url:
+      result['transfer_ms'] = int(cern_util.timed_get(probe_url, deadline, url)[0])
+      s.set(**result)
+  return result.get('transfer_ms', result['connect_ms'])
+
+def group_proxies(latencies):
+  # [(ms, proxy)] -> [[proxy, ...], ...], fastest group first
+  groups = []
+  for latency, proxy in sorted(latencies):
+    if groups and latency <= groups[-1][0] * PROXY_GROUP_RATIO + PROXY_GROUP_SLACK_MS:
+      groups[-1][1].append(proxy)
+    else:
+      groups.append((latency, [proxy]))
+  return [proxies for latency, proxies in groups]
+
+def rank_proxies(candidates, local_args):
+  # All the proxies are probed concurrently. Unreachable ones are kept as a last resort, DIRECT stays last
+  proxies = [proxy for proxy in candidates if proxy.upper() != 'DIRECT']
+  deadline = float(local_args.get('probe-deadline', DEFAULT_PROBE_DEADLINE))
+  probe_url = local_args.get('proxy-probe-url')
+  with cern_trace.span('proxy ranking', 'probe', deadline=deadline) as s:
+    latencies = cern_util.concurrently(lambda proxy: probe_proxy(proxy, probe_url, deadline), proxies, deadline)
+    groups = group_proxies([(latencies[proxy], proxy) for proxy in proxies if proxy in latencies])
+    unreachable = [proxy for proxy in proxies if proxy not in latencies]
+    if unreachable:
+      groups.append(unreachable)
+    if len(proxies) < len(candidates):
+      groups.append(['DIRECT'])
+    s.set(groups=groups)
+  return groups, len(latencies) > 0
+
+def http_proxy(value, local_args):
+  # CVMFS_HTTP_PROXY. A list of proxies is ranked: '|' balances the load within a group of equally
+  # close proxies, ';' fails over to the next group
+  if not isinstance(value, list):
+    return str(value)
+  candidates = [str(proxy) for proxy in value]
+  key = 'http-proxy '+' '.join(candidates+[local_args.get('proxy-probe-url', '')]).strip()
+  groups = cached_ranking(key, local_args.get('ranking-ttl', DEFAULT_RANKING_TTL), lambda: rank_proxies(candidates, local_args))
+  value = ';'.join(['|'.join(group) for group in groups])
+  print 'cvmfs http-proxy: '+value
+  return value
+
+def read_manifest(body):
+  # The fields of a .cvmfspublished before its signature, e.g. {'S': '4711', 'T': '1381234567', ...}
+  fields = {}
+  for line in body.splitlines():
+    if line.startswith('--'):
+      break
+    if line:
+      fields[line[0]] = line[1:]
+  return fields
+
+def probe_stratum1(url, repository, deadline):
+  # Time to fetch the manifest of 'repository' from the stratum-1 and the revision it publishes
+  manifest_url = url.replace('@fqrn@', repository).replace('@org@', repository.split('.')[0]).rstrip('/')+'/.cvmfspublished'
+  with cern_trace.span('stratum-1 probe', 'probe', url=manifest_url) as s:
+    elapsed, body = cern_util.timed_get(manifest_url, deadline)
+    revision = int(read_manifest(body).get('S', 0))
+    s.set(response_ms=int(elapsed), revision=revision)
+  return int(elapsed), revision
+
+def rank_stratum1s(urls, repository, local_args):
+  # All the stratum-1s are probed concurrently. Those publishing the newest revision come first, fastest first,
+  # then the ones lagging behind and at last the unreachable ones
+  deadline = float(local_args.get('probe-deadline', DEFAULT_PROBE_DEADLINE))
+  with cern_trace.span('stratum-1 ranking', 'probe', repository=repository, deadline=deadline) as s:
+    results = cern_util.concurrently(lambda url: probe_stratum1(url, repository, deadline), urls, deadline)
+    newest = max([revision for elapsed, revision in results.values()] + [0])
+
+    def rank(url):
+      if url not in results:
+        return (2, 0, urls.index(url))
+      elapsed, revision = results[url]
+      return (int(revision < newest), elapsed, 0)
+    ranked = sorted(urls, key=rank)
+    s.set(ranking=ranked)
+  return ranked, len(results) > 0
+
+def server_url(domain, value, params):
+  # CVMFS_SERVER_URL of a domain. A list of stratum-1s is ranked using one of the repositories of the domain
+  if not isinstance(value, list):
+    return str(value)
+  urls = [str(url) for url in value]
+  local_args = params.get('local', {})
+  repository = params.get('domains', {}).get(domain, {}).get('probe-repository')
+  if repository is None:
+    for name in local_args.get('repositories', '').split(','):
+      if name.strip().endswith('.'+domain):
+        repository = name.strip()
+        break
+  if repository is None:
+    print 'No repository of '+domain+' to rank its stratum-1s with, keeping their order'
+    return ';'.join(urls)
+  key = 'stratum-1 '+domain+' '+repository+' '+' '.join(urls)
+  ranked = cached_ranking(key, local_args.get('ranking-ttl', DEFAULT_RANKING_TTL), lambda: rank_stratum1s(urls, repository, local_args))
+  value = ';'.join(ranked)
+  print 'cvmfs stratum-1s of '+domain+': '+value
+  return value
+
 def config_cvmfs(lfile, dfile, cmsfile, params):
-  quota_aux_var = 1   # Aux varibale to check whether to write default quota-limit value or not   
   if 'local' in params:
     local_args = params['local']
     flocal = open(lfile, 'w')
@@ -80,20 +321,20 @@ def config_cvmfs(lfile, dfile, cmsfile, params):
       if prop_name == 'default-domain':
         flocal.write('CVMFS_DEFAULT_DOMAIN='+value+'\n')
       if prop_name == 'http-proxy':
-        flocal.write('CVMFS_HTTP_PROXY='+value+'\n')
-      if prop_name == 'quota-limit':
-        flocal.write('CVMFS_QUOTA_LIMIT='+str(value)+'\n')
-        quota_aux_var = 0
+        flocal.write('CVMFS_HTTP_PROXY='+http_proxy(value, local_args)+'\n')
       if prop_name == 'cms-local-site':
          cmslocal = open(cmsfile, 'w')
          cmslocal.write('export CMS_LOCAL_SITE='+str(value)+'\n')
          cmslocal.close()
 
+    # Cache sizes, the defaults or sized for this machine
+    flocal.write('CVMFS_QUOTA_LIMIT='+str(quota_limit_mb(local_args))+'\n')
+    MemcacheSize = memcache_size_mb(local_args)
+    if MemcacheSize is not None:
+      flocal.write('CVMFS_MEMCACHE_SIZE='+str(MemcacheSize)+'\n')
+
     # Write some default configurations
-    if quota_aux_var:
-      flocal.write('CVMFS_QUOTA_LIMIT=8000\nCVMFS_TIMEOUT=5\nCVMFS_TIMEOUT_DIRECT=10\nCVMFS_NFILES=65535\n')
-    else:
-      flocal.write('CVMFS_TIMEOUT=5\nCVMFS_TIMEOUT_DIRECT=10\nCVMFS_NFILES=65535\n')
+    flocal.write('CVMFS_TIMEOUT=5\nCVMFS_TIMEOUT_DIRECT=10\nCVMFS_NFILES='+str(nfiles(local_args))+'\n')
 
     # Close the file
     flocal.close()
@@ -102,36 +343,164 @@ def config_cvmfs(lfile, dfile, cmsfile, params):
     domain_args = params['domain']
     if 'server' in domain_args:
       fdomain = open(dfile, 'w')
-      fdomain.write('CVMFS_SERVER_URL='+domain_args['server']+'\n')
+      fdomain.write('CVMFS_SERVER_URL='+server_url('cern.ch', domain_args['server'], params)+'\n')
       fdomain.close()
 
+  # Stratum-1s of other domains, e.g. domains: {egi.eu: {server: [...]}}
+  for domain, domain_args in params.get('domains', {}).iteritems():
+    if 'server' in domain_args:
+      fdomain = open(os.path.join(os.path.dirname(dfile), domain+'.local'), 'w')
+      fdomain.write('CVMFS_SERVER_URL='+server_url(domain, domain_args['server'], params)+'\n')
+      fdomain.close()
+
+def mount_repository(repository):
+  # Listing the mount point makes autofs mount the repository. Returns the milliseconds it took
+  start = time.time()
+  os.listdir(os.path.join(CVMFS_MOUNT_ROOT, repository))
+  return int((time.time() - start) * 1000)
+
+def check_repositories(repositories, timeout):
+  # All the repositories are mounted concurrently.
+  # Returns {repository: {'ok': True/False, 'mount_ms': ms or None, 'error': None or why}}
+  errors = {}
+
+  def mount(repository):
+    with cern_trace.span('mount', 'probe', repository=repository):
+      try:
+        return mount_repository(repository)
+      except OSError, e:
+        errors[repository] = str(e)
+        raise
+
+  latencies = cern_util.concurrently(mount, repositories, timeout)
+  results = {}
+  for repository in repositories:
+    if repository in latencies:
+      results[repository] = {'ok': True, 'mount_ms': latencies[repository], 'error': None}
+    else:
+      results[repository] = {'ok': False, 'mount_ms': None, 'error': errors.get(repository, 'not mounted after '+str(timeout)+'s')}
+  return results
+
+def clear_ready():
+  # Done before anything is mounted, so that the marker of an earlier run can not vouch for this one
+  _checked.clear()
+  _ready.clear()
+  if os.path.exists(READY_FILE):
+    os.unlink(READY_FILE)
+
+def check_ready(params):
+  # Replaces 'cvmfs_config probe'. The marker and the event tell the other modules cvmfs is usable
+  clear_ready()
+  _scheduled.set()
+  try:
+    local_args = params.get('local', {})
+    repositories = [name.strip() for name in local_args.get('repositories', '').split(',') if name.strip()]
+    results = check_repositories(repositories, float(local_args.get('mount-timeout', DEFAULT_MOUNT_TIMEOUT)))
+    for repository in repositories:
+      result = results[repository]
+      if result['ok']:
+        print 'cvmfs '+repository+': mounted in '+str(result['mount_ms'])+' ms'
+      else:
+        print 'ATTENTION: cvmfs '+repository+' is not usable: '+result['error']
+    if [result for result in results.values() if not result['ok']]:
+      return results
+    cern_util.write_atomic(READY_FILE, json.dumps(results, sort_keys=True)+'\n')
+    _ready.set()
+    return results
+  finally:
+    _checked.set()
+
+def wait_ready(timeout):
+  # True once all the repositories are mounted, by this process or by an earlier cvmfs run of this boot.
+  # False after 'timeout' seconds, or as soon as this process found a repository that is not usable.
+  # When this process does not check the repositories (e.g. cvmfs is handled later, outside an orchestrated run),
+  # False right away
+  end = time.time() + timeout
+  while True:
+    if _ready.is_set() or os.path.exists(READY_FILE):
+      return True
+    remaining = end - time.time()
+    if _checked.is_set() or not _scheduled.is_set() or remaining <= 0:
+      return False
+    _checked.wait(min(1, remaining))
+
+def start_prefetch(params):
+  # Warm the cache in the background with the files of the 'prefetch' section
+  prefetch_args = params['prefetch']
+  config = {'paths': prefetch_args.get('paths', [])}
+  if 'manifest' in prefetch_args:
+    manifest = prefetch_args['manifest']
+    if manifest.startswith('http://') or manifest.startswith('https://'):
+      manifest = cern_fetch.fetch(manifest)
+    config['manifest'] = manifest
+  for key in ('threads', 'deadline'):
+    if key in prefetch_args:
+      config[key] = prefetch_args[key]
+  if 'budget-mb' in prefetch_args:
+    config['budget'] = int(prefetch_args['budget-mb']) * 1024 * 1024
+  else:
+    config['budget'] = int(quota_limit_mb(params.get('local', {})) * PREFETCH_BUDGET_SHARE) * 1024 * 1024
+  print 'Prefetching into the cvmfs cache in the background, see '+PREFETCH_LOG
+  cern_util.spawn_detached([sys.executable, PREFETCH_SCRIPT, '--root', CVMFS_MOUNT_ROOT, '--config', json.dumps(config)], PREFETCH_LOG)
+
 ########################
 ########################
 
-def handle(_name, cfg, cloud, log, _args):
-    
-  # If there isn't a cvmfs reference in the configuration don't do anything
-  if 'cvmfs' not in cfg:
-    print "cvmfs configuration was not found"
-    return
-    
+def phases(cfg, log):
   print "Ready to setup cvmfs."
+  cern_fetch.configure(cfg)
   cvmfs_cfg = cfg['cvmfs']
   print "Configuring cvmfs...(this may take a while)"
+  clear_ready()
+  _scheduled.set()
   Installation = False
   if 'install' in cvmfs_cfg:
     Installation = cvmfs_cfg['install']
-    if Installation == True:
-      install_cvmfs()	    
-
-  LocalFile = '/etc/cvmfs/default.local'
-  DomainFile = '/etc/cvmfs/domain.d/cern.ch.local'
-  CMS_LocalFile = '/etc/cvmfs/config.d/cms.cern.ch.local'
-  
-  config_cvmfs(LocalFile, DomainFile, CMS_LocalFile, cvmfs_cfg)
-	
-  print "START cvmfs"
-  # Start cvmfs
-  os.system("export PATH=${PATH}:/usr/bin:/sbin; cvmfs_config reload")
-  os.system("export PATH=${PATH}:/usr/bin:/sbin; cvmfs_config probe")
-	       
+
+  def install():
+    install_cvmfs(cfg)
+
+  def config():
+    config_cvmfs(LocalFile, DomainFile, CMS_LocalFile, cvmfs_cfg)
+
+  def start():
+    print "START cvmfs"
+    # Start cvmfs
+    cern_trace.system("export PATH=${PATH}:/usr/bin:/sbin; cvmfs_config reload")
+
+  def ready():
+    check_ready(cvmfs_cfg)
+
+  def prefetch():
+    # cvmfs.ready does not fail when a repository is not mounted: warm the cache only once they all are
+    if not _ready.is_set():
+      print 'ATTENTION: cvmfs is not ready, the cache is not prefetched'
+      return
+    start_prefetch(cvmfs_cfg)
+
+  cvmfs_phases = []
+  if Installation == True:
+    cvmfs_phases.append(cern_phases.Phase('cvmfs.install', install, locks=(cern_phases.RPMDB, cern_phases.PASSWD)))
+  cvmfs_phases.extend([
+    cern_phases.Phase('cvmfs.config', config, after=('cvmfs.install',)),
+    cern_phases.Phase('cvmfs.start', start, after=('cvmfs.config',)),
+    # Runs even if an earlier step failed: the repositories are then found not usable, which is what the
+    # workernodes waiting for them need to know
+    cern_phases.Phase('cvmfs.ready', ready, waits=('cvmfs.start',)),
+  ])
+  if 'prefetch' in cvmfs_cfg:
+    cvmfs_phases.append(cern_phases.Phase('cvmfs.prefetch', prefetch, after=('cvmfs.ready',)))
+  return cvmfs_phases
+
+########################
+########################
+
+def handle(_name, cfg, cloud, log, _args):
+    
+  # If there isn't a cvmfs reference in the configuration don't do anything
+  if 'cvmfs' not in cfg:
+    print "cvmfs configuration was not found"
+    return
+
+  if not cern_phases.orchestrated(cfg, log):
+    cern_phases.run(phases(cfg, log), log=log)
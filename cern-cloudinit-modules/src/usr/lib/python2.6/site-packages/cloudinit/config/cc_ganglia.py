@@ -8,192 +8,401 @@
 
 import subprocess
 import cloudinit.config as cc
-import urllib
-import socket
-import re
+import cloudinit.config.cc_cvmfs as cc_cvmfs
+import cloudinit.config.cern_facts as facts
+import cloudinit.config.cern_gmondconf as cern_gmondconf
+import cloudinit.config.cern_packages as cern_packages
+import cloudinit.config.cern_phases as cern_phases
+import cloudinit.config.cern_rrdsnapshot as cern_rrdsnapshot
+import cloudinit.config.cern_trace as cern_trace
+import cloudinit.config.cern_util as cern_util
+import hashlib
+import os
+import pwd
 import sys
 
 
 # In case this runs to early during the boot, the PATH environment can still be unset. Let's define each necessary command's path
 # Using subprocess calls so it raises exceptions directly from the child process to the parent
 YUM_cmd = '/usr/bin/yum'
-HOST_cmd = '/bin/hostname'
 SERVICE_cmd = '/sbin/service'
 GMOND_cmd = '/etc/init.d/gmond'
 SETSE_cmd = '/usr/sbin/setsebool'
 CHKCONFIG = '/sbin/chkconfig'
+MOUNT_cmd = '/bin/mount'
+RSYNC_cmd = '/usr/bin/rsync'
+SED_cmd = '/bin/sed'
 
+GMOND_CONF = '/etc/ganglia/gmond.conf'
+GMETAD_CONF = '/etc/ganglia/gmetad.conf'
+HTTPD_GANGLIA_CONF = '/etc/httpd/conf.d/ganglia.conf'
+GANGLIA_WEB_CONF = '/etc/ganglia/conf.php'
+GMOND_CONF_DIR = '/etc/ganglia/conf.d'
+MODPYTHON_CONF = '/etc/ganglia/conf.d/modpython.conf'
+GMETAD_SYSCONFIG = '/etc/sysconfig/gmetad'
+RRDCACHED_SYSCONFIG = '/etc/sysconfig/rrdcached'
+FSTAB = '/etc/fstab'
+PROC_MOUNTS = '/proc/mounts'
+RRD_CRON = '/etc/cron.d/cern-ganglia-rrds'
+RRD_EXPIRE_CRON = '/etc/cron.d/cern-ganglia-expire'
+RRD_EXPIRE_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cern_rrdexpire.py')
+RRD_EXPIRE_LOG = '/var/log/cern-cloudinit-rrdexpire.log'
+RRD_SNAPSHOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cern_rrdsnapshot.py')
+RRD_SNAPSHOT_LOG = '/var/log/cern-cloudinit-rrdsnapshot.log'
+GMOND_STARTUP_LOG = '/var/log/cern-cloudinit-gmond-startup.log'
 
-def conf_node(node_f, params, lines):
-  flocal_new = open(node_f, 'w')     # Open the gmond file, but let's overwrite it with the new variables
-  if 'globals' in params:
-    globals_cfg = params['globals']
-    for param, value in globals_cfg.iteritems():
-      if param == 'daemonize':
-        for i in range(0,len(lines)):
-          if 'daemonize' in lines[i]:
-            lines[i] = "  daemonize = "+str(value)+'\n'
-            break
-      if param == 'setuid':
-        for i in range(0,len(lines)):
-          if 'setuid' in lines[i]:
-            lines[i] = "  setuid = "+str(value)+'\n'
-            break
-      if param == 'user':
-        for i in range(0,len(lines)):
-          if 'user = ' in lines[i]:
-            lines[i] = "  user = "+str(value)+'\n'
-            break
-      if param == 'debug-level':
-        for i in range(0,len(lines)):
-          if 'debug_level' in lines[i]:
-            lines[i] = "  debug_level = "+str(value)+'\n'
-            break
-      if param == 'max-udp-msg-len':
-        for i in range(0,len(lines)):
-          if 'max_udp_msg_len' in lines[i]:
-            lines[i] = "  max_udp_msg_len = "+str(value)+'\n'
-            break
-      if param == 'mute':
-        for i in range(0,len(lines)):
-          if 'mute' in lines[i]:
-            lines[i] = "  mute = "+str(value)+'\n'
-            break
-      if param == 'deaf':
-        for i in range(0,len(lines)):
-          if 'deaf' in lines[i]:
-            lines[i] = "  deaf = "+str(value)+'\n'
-            break
-      if param == 'allow-extra-data':
-        for i in range(0,len(lines)):
-          if 'allow_extra_data' in lines[i]:
-            lines[i] = "  allow_extra_data = "+str(value)+'\n'
-            break
-      if param == 'host-dmax':
-        for i in range(0,len(lines)):
-          if 'host_dmax' in lines[i]:
-            lines[i] = "  host_dmax = "+str(value)+' /*secs */\n'
-            break
-      if param == 'cleanup-threshold':
-        for i in range(0,len(lines)):
-          if 'cleanup_threshold' in lines[i]:
-            lines[i] = "  cleanup_threshold = "+str(value)+' /*secs */\n'
-            break
-      if param == 'gexec':
-        for i in range(0,len(lines)):
-          if 'gexec = ' in lines[i]:
-            lines[i] = "  gexec = "+str(value)+'\n'
-            break
-      if param == 'send-metadata-interval':
-        for i in range(0,len(lines)):
-          if 'send_metadata_interval' in lines[i]:
-            lines[i] = "  send_metadata_interval = "+str(value)+' /*secs */\n'
-            break
-  # End of globals configuration
-  
-  if 'cluster' in params:
-    cluster_cfg = params['cluster']
-    for i in range(0,len(lines)):   # Optimization to find where cluster starts instead of reading file from top every time
-      if 'cluster {' in lines[i]:
-        indice = i
-        break
-    for param, value in cluster_cfg.iteritems():
-      if param == 'name':
-        for l in range(indice,len(lines)):
-          if 'name' in lines[l]:
-            lines[l] = "  name = "+str(value)+'\n'
-            break
-      if param == 'owner':
-        for l in range(indice,len(lines)):
-          if 'owner' in lines[l]:
-            lines[l] = "  owner = "+str(value)+'\n'
-            break
-      if param == 'latlong':
-        for l in range(indice,len(lines)):
-          if 'latlong' in lines[l]:
-            lines[l] = "  latlong = "+str(value)+'\n'
-            break
-      if param == 'url':
-        for l in range(indice,len(lines)):
-          if 'url' in lines[l]:
-            lines[l] = "  url = "+str(value)+'\n'
-            break
-
-  # End of cluster configuration
-
-  lines = [word.replace('mcast_join','host') for word in lines]               # Change to 'host' instead of 'mcast_join'. If it isn't passed in cloud-config, it will be changed anyway.
-
-  for i in range(0,len(lines)):
-    if 'udp_recv_channel {' in lines[i]:
-      indice_aux = i
-      break
-  for u in range(indice_aux, indice_aux+10):    # Erase the 'host' parameter in udp_recv_channel, because it causes parsing errors
-    if 'host' in lines[u]:
-      lines[u] = ''
+# gmetad writes its RRDs through rrdcached: the first socket is for gmetad, the second one only allows
+# ganglia-web to flush the files it is about to graph
+RRD_DIR = '/var/lib/ganglia/rrds'
+RRD_SNAPSHOT_DIR = '/var/lib/ganglia/rrds.snapshot'
+RRDCACHED_SOCKET = '/var/run/rrdcached/rrdcached.sock'
+RRDCACHED_WEB_SOCKET = '/var/run/rrdcached/rrdcached-web.sock'
+RRDCACHED_JOURNAL = '/var/lib/rrdcached/journal'
+
+# Seconds. Updates are written every write-timeout (+ up to write-jitter, so the files are not all written at once)
+# and the files without updates are flushed every flush-timeout
+DEFAULT_RRDCACHED = {'write-timeout': 1800, 'write-jitter': 1800, 'flush-timeout': 3600}
+
+# RRDs on tmpfs: a host has about METRICS_PER_HOST RRDs of RRD_FILE_KB each (the default gmetad RRAs)
+METRICS_PER_HOST = 40
+RRD_FILE_KB = 12
+RRD_TMPFS_HEADROOM = 1.5
+MIN_RRD_TMPFS_MB = 64
+DEFAULT_SNAPSHOT_MINUTES = 15
+
+# Headnode 'web': who is let in besides localhost, and the seconds that the browsers keep the graphs and the
+# JSON views (also the lifetime of ganglia-web's own metric cache) and the static files
+GANGLIA_WEB_ROOT = '/usr/share/ganglia'
+DEFAULT_WEB = {'allow': ['cern.ch'], 'cache-ttl': 30, 'static-ttl': 604800}
+WEB_DEFLATE_TYPES = ('text/html', 'text/plain', 'text/css', 'text/xml', 'text/javascript', 'application/javascript',
+                     'application/x-javascript', 'application/json')
+WEB_GRAPH_TYPES = ('image/png', 'application/json')
+WEB_STATIC_TYPES = ('text/css', 'text/javascript', 'application/javascript', 'application/x-javascript', 'image/gif',
+                    'image/jpeg')
+
+# Headnode 'rrd-retention': the RRDs of the hosts gone for 'expire-after' hours are archived into 'archive-dir',
+# or deleted without it, every hour
+DEFAULT_EXPIRE_HOURS = 24
+
+# gmetad answers the web frontend and other gmetads with server_threads (4 by default)
+HOSTS_PER_SERVER_THREAD = 250
+MAX_SERVER_THREADS = 32
+
+
+# cloud-config keys of the gmond.conf sections. In gmond.conf the dashes are underscores
+GMOND_GLOBALS = ('daemonize', 'setuid', 'user', 'debug-level', 'max-udp-msg-len', 'mute', 'deaf', 'allow-extra-data',
+                 'host-dmax', 'cleanup-threshold', 'gexec', 'send-metadata-interval')
+GMOND_CLUSTER = ('name', 'owner', 'latlong', 'url')
+# Channels: cloud-config section (a dict, or a list of dicts for several channels), gmond.conf block and keys
+GMOND_CHANNELS = (
+  ('udpSendChannel', 'udp_send_channel', ('host', 'port', 'ttl')),
+  ('udpRecvChannel', 'udp_recv_channel', ('port', 'bind')),
+  ('tcpAcceptChannel', 'tcp_accept_channel', ('port',)),
+)
+
+# Aggregation: 'aggregators' is a list of shards, each one an aggregator ('host' or 'host:port') or a list of them.
+# A node sends to every aggregator of one shard, and the headnode polls each shard as a data_source
+DEFAULT_GMOND_PORT = 8649
+
+# Node option 'ephemeral', for short lived hosts. A host that stops reporting is forgotten after host-dmax seconds,
+# looked for every cleanup-threshold. The metadata is sent every startup-metadata-interval seconds for the first
+# startup-window seconds, then every metadata-interval, so that a restarted aggregator learns it back
+DEFAULT_EPHEMERAL = {'host-dmax': 3600, 'cleanup-threshold': 120, 'startup-metadata-interval': 30, 'startup-window': 600,
+                     'metadata-interval': 600}
+
+# The gmond python modules of this (noarch) package. gmond only loads them from the directory given as the 'params'
+# of its python_module (modpython.conf), which depends on the architecture: they are linked into it
+PYTHON_MODULES_DIR = '/usr/share/cern-cloudinit-modules/ganglia/python_modules'
+GMOND_PYTHON_MODULES_LIB64 = '/usr/lib64/ganglia/python_modules'
+GMOND_PYTHON_MODULES_LIB = '/usr/lib/ganglia/python_modules'
+
+# gmond python module with the cvmfs statistics (python_modules/cern_cvmfs.py), enabled when the cloud-config has a
+# cvmfs section, unless 'cvmfs-metrics' is false. 'cvmfs-metrics' can also set collect-every, time-threshold and
+# sample-seconds. Value thresholds of its metrics. The steady ones are collected as often, as gmond may start before
+# cvmfs is ready, but only sent again every CVMFS_STEADY_TIME_THRESHOLD seconds when they do not change
+DEFAULT_CVMFS_METRICS = {'collect-every': 60, 'time-threshold': 600, 'sample-seconds': 30}
+CVMFS_METRIC_THRESHOLDS = (('hitrate', 5.0), ('cache_used', 500), ('cache_fill', 5.0), ('rx', 100.0), ('nioerr', 0.01),
+                           ('proxy_switches', 1), ('mount_ms', 1))
+CVMFS_STEADY_METRICS = ('mount_ms',)
+CVMFS_STEADY_TIME_THRESHOLD = 3600
+
+# gmond python module with the startd state (python_modules/cern_condor.py), enabled for a condor workernode unless
+# 'condor-metrics' is false. Same settings as 'cvmfs-metrics'. Its metrics and their value thresholds
+DEFAULT_CONDOR_METRICS = {'collect-every': 60, 'time-threshold': 600, 'sample-seconds': 30}
+CONDOR_START_LOG = '/var/log/condor/StartLog'
+CONDOR_METRIC_THRESHOLDS = (('condor_slots_owner', 1), ('condor_slots_unclaimed', 1), ('condor_slots_matched', 1),
+                            ('condor_slots_claimed', 1), ('condor_slots_preempting', 1), ('condor_slots_backfill', 1),
+                            ('condor_slots_drained', 1), ('condor_slots_busy', 1), ('condor_start_latency_le_1', 1),
+                            ('condor_start_latency_le_5', 1), ('condor_start_latency_le_30', 1),
+                            ('condor_start_latency_le_120', 1), ('condor_start_latency_gt_120', 1),
+                            ('condor_start_latency_max', 5.0), ('condor_first_claim_after_boot', 1))
+
+# cloud-config keys of a collection group and of its metrics, as in gmond.conf but with dashes
+COLLECTION_GROUP_KEYS = ('collect-once', 'collect-every', 'time-threshold')
+METRIC_KEYS = ('value-threshold', 'title')
+
+# Collection groups of the 'preset' option. The metrics of gmond.conf that the preset does not list are dropped.
+# A metric is a name, or a dict with the name and its metric keys
+HEARTBEAT_GROUP = {'collect-once': True, 'time-threshold': 20, 'metrics': ['heartbeat']}
+METRIC_PRESETS = {
+  # Liveness, what the host is, and whether it is busy
+  'minimal': [
+    HEARTBEAT_GROUP,
+    {'collect-once': True, 'time-threshold': 3600, 'metrics': ['cpu_num', 'mem_total', 'os_release', 'boottime']},
+    {'collect-every': 60, 'time-threshold': 600,
+     'metrics': [{'name': 'load_one', 'value-threshold': 1.0}, {'name': 'mem_free', 'value-threshold': 1048576.0},
+                 {'name': 'disk_free', 'value-threshold': 10.0}]},
+  ],
+  # What is looked at for batch workers: CPU efficiency, memory, network and scratch space, at a slower pace
+  'batch-worker': [
+    HEARTBEAT_GROUP,
+    {'collect-once': True, 'time-threshold': 3600,
+     'metrics': ['cpu_num', 'cpu_speed', 'mem_total', 'swap_total', 'boottime', 'machine_type', 'os_name', 'os_release']},
+    {'collect-every': 60, 'time-threshold': 300,
+     'metrics': [{'name': 'cpu_user', 'value-threshold': 5.0}, {'name': 'cpu_system', 'value-threshold': 5.0},
+                 {'name': 'cpu_idle', 'value-threshold': 10.0}, {'name': 'cpu_wio', 'value-threshold': 5.0},
+                 {'name': 'load_one', 'value-threshold': 1.0}]},
+    {'collect-every': 120, 'time-threshold': 600,
+     'metrics': [{'name': 'mem_free', 'value-threshold': 102400.0}, {'name': 'swap_free', 'value-threshold': 102400.0},
+                 {'name': 'bytes_in', 'value-threshold': 1048576}, {'name': 'bytes_out', 'value-threshold': 1048576}]},
+    {'collect-every': 300, 'time-threshold': 1800,
+     'metrics': [{'name': 'disk_free', 'value-threshold': 1.0}, {'name': 'part_max_used', 'value-threshold': 5.0}]},
+  ],
+}
+
+def conf_channels(root, block_name, channels, keys):
+  # One block per channel: the existing blocks are edited, extra channels get a copy of the last block
+  # and the blocks left over are removed
+  if not isinstance(channels, list):
+    channels = [channels]
+  blocks = root.blocks(block_name)
+  if not blocks:
+    blocks = [root.add_block(block_name)]
+  while len(blocks) < len(channels):
+    block = blocks[-1].copy()
+    root.insert(block, blocks[-1])
+    blocks.append(block)
+  for block in blocks[len(channels):]:
+    root.remove_block(block)
+  for block, channel in zip(blocks, channels):
+    for key in keys:
+      if key in channel:
+        block.set(key, channel[key])
+
+def aggregator_shards(aggregators):
+  # [['host', port], ...] for each shard
+  shards = []
+  for shard in aggregators:
+    if not isinstance(shard, list):
+      shard = [shard]
+    addresses = []
+    for address in shard:
+      host, port = str(address), DEFAULT_GMOND_PORT
+      if ':' in host:
+        host, port = host.rsplit(':', 1)
+      addresses.append([host, int(port)])
+    shards.append(addresses)
+  return shards
+
+def pick_shard(hostname, shards):
+  # Rendezvous hashing: every node takes the shard with the highest hash of its hostname and the shard.
+  # Adding or removing a shard only moves the nodes that pick, or picked, that shard
+  best_weight = best = None
+  for shard in shards:
+    weight = hashlib.md5(hostname+'|'+','.join(sorted([host for host, port in shard]))).hexdigest()
+    if best is None or weight > best_weight:
+      best_weight, best = weight, shard
+  return best
+
+def aggregation_channels(params, hostname):
+  # One udp_send_channel per aggregator of the shard of this node
+  shard = pick_shard(hostname, aggregator_shards(params['aggregators']))
+  print 'Ganglia: '+hostname+' sends to '+', '.join([host+':'+str(port) for host, port in shard])
+  return [{'host': host, 'port': port} for host, port in shard]
+
+def gmond_value(value):
+  if value is True:
+    return 'yes'
+  if value is False:
+    return 'no'
+  return str(value)
+
+def number(value):
+  # '"1.0"' -> 1.0, None if it is not a number
+  try:
+    return float(str(value).strip('"'))
+  except ValueError:
+    return None
+
+def metric_name(metric):
+  return (metric.get('name') or metric.get('name_match') or '').strip('"')
+
+def drop_metrics(root, names, keep=False):
+  # Removes the metrics called 'names' (or all the others, with keep) and the collection groups left empty
+  for group in root.blocks('collection_group'):
+    for metric in group.blocks('metric'):
+      if (metric_name(metric) in names) != keep:
+        group.remove_block(metric)
+    if not group.blocks('metric'):
+      root.remove_block(group)
+
+def conf_collection_group(root, group):
+  # A collection group of the cloud-config. Its metrics are taken out of the groups they are in now, keeping their
+  # other settings. A group holding nothing but these metrics is edited in place, otherwise a new one is added.
+  # With 'drop' the metrics are just removed
+  specs = []
+  for metric in group.get('metrics', []):
+    if not isinstance(metric, dict):
+      metric = {'name': metric}
+    specs.append(metric)
+  names = [spec['name'] for spec in specs]
+  if group.get('drop'):
+    drop_metrics(root, names)
+    return
+
+  groups = root.blocks('collection_group')
+  target = None
+  for block in groups:
+    metrics = [metric_name(metric) for metric in block.blocks('metric')]
+    if metrics and not [name for name in metrics if name not in names]:
+      target = block
       break
+  existing = {}
+  for block in groups:
+    for metric in block.blocks('metric'):
+      name = metric_name(metric)
+      if name not in names:
+        continue
+      if name in existing or block is not target:
+        block.remove_block(metric)
+      existing.setdefault(name, metric)
+    if block is not target and not block.blocks('metric'):
+      root.remove_block(block)
+  if target is None:
+    target = root.add_block('collection_group')
 
-  if 'udpSendChannel' in params:
-    udp_send_cfg = params['udpSendChannel']
-    for i in range(0,len(lines)):   # Same process as cluster
-      if 'udp_send_channel {' in lines[i]:
-        indice_udp = i
-        break
-    for param, value in udp_send_cfg.iteritems():
-      if param == 'host':
-        for a in range(indice_udp, len(lines)):
-          if 'host = ' in lines[a]:
-            lines[a] = "  host = "+str(value)+'\n'
-            break
-      if param == 'port':
-        for a in range(indice_udp, len(lines)):
-          if 'port' in lines[a]:
-            lines[a] = "  port = "+str(value)+'\n'
-            break
-      if param == 'ttl':
-        for a in range(indice_udp, len(lines)):
-          if 'ttl' in lines[a]:
-            lines[a] = "  ttl = "+str(value)+'\n'
-            break
-  # End of udp_send_channel configuration
-
-  if 'udpRecvChannel' in params:
-    udp_recv_cfg = params['udpRecvChannel']
-    for i in range(0,len(lines)):
-      if 'udp_recv_channel {' in lines[i]:
-        indice_udp_recv = i
-        break
-
-    for param, value in udp_recv_cfg.iteritems():
-      if param == 'port':
-        for u in range(indice_udp_recv, len(lines)):
-          if 'port' in lines[u]:
-            lines[u] = "  port = "+str(value)+'\n'
-            break
-      if param == 'bind':
-        for u in range(indice_udp_recv, len(lines)):
-          if 'bind' in lines[u]:
-            lines[u] = "  bind = "+str(value)+'\n'
-            break
-  # End of udp_recv_channel configuration
-
-  # Finally...
-  if 'tcpAcceptChannel' in params:
-    tcp_cfg = params['tcpAcceptChannel']
-    for i in range(0,len(lines)):
-      if 'tcp_accept_channel {' in lines[i]:
-        indice_tcp = i
-        break
-    for param, value in tcp_cfg.iteritems():
-      if param == 'port':
-        for t in range(indice_tcp, len(lines)):    # tcp_accept_channel is generally small. Five iterations just in case.
-          if 'port' in lines[t]:
-            lines[t] = "  port = "+str(value)+'\n'
-            break
-  # End of tcp_accept_channel configuration
-
-  flocal_new.writelines(lines)
-  flocal_new.close()
-  
+  for key in COLLECTION_GROUP_KEYS:
+    if key in group:
+      target.set(key.replace('-', '_'), gmond_value(group[key]))
+  if 'collect-every' in group:
+    target.remove('collect_once')
+  elif 'collect-once' in group:
+    target.remove('collect_every')
+
+  for spec in specs:
+    metric = existing.get(spec['name'])
+    if metric is None:
+      metric = target.add_block('metric')
+      metric.set('name', '"'+spec['name']+'"')
+    elif metric not in target.children:
+      target.insert(metric)
+    for key in METRIC_KEYS:
+      if key in spec:
+        if key == 'title':
+          metric.set(key, '"'+str(spec[key])+'"')
+        else:
+          metric.set(key.replace('-', '_'), gmond_value(spec[key]))
+
+def conf_collection_groups(root, params):
+  # The 'preset' first, then the 'collectionGroups' on top of it
+  preset = params.get('preset')
+  if preset is not None:
+    if preset in METRIC_PRESETS:
+      names = []
+      for group in METRIC_PRESETS[preset]:
+        for metric in group['metrics']:
+          if isinstance(metric, dict):
+            metric = metric['name']
+          names.append(metric)
+      drop_metrics(root, names, keep=True)
+      for group in METRIC_PRESETS[preset]:
+        conf_collection_group(root, group)
+    else:
+      print 'ATTENTION: unknown ganglia preset '+str(preset)+' (use one of '+', '.join(sorted(METRIC_PRESETS.keys()))+'). Keeping the metrics of gmond.conf...'
+  for group in params.get('collectionGroups', []):
+    conf_collection_group(root, group)
+
+def packet_rates(root):
+  # Packets per second that one host sends to each udp_send_channel: (fewest, most).
+  # gmond sends a whole collection group every time_threshold, and also after a collection (every collect_every)
+  # in which a metric moved by more than its value_threshold. Each metric is one packet, plus one metadata packet
+  # per metric every send_metadata_interval
+  fewest = most = 0.0
+  metrics = 0
+  for group in root.blocks('collection_group'):
+    count = len(group.blocks('metric'))
+    metrics += count
+    time_threshold = number(group.get('time_threshold'))
+    collect_every = number(group.get('collect_every'))
+    changes = [metric for metric in group.blocks('metric') if metric.get('value_threshold') is not None]
+    if time_threshold:
+      fewest += count / time_threshold
+    if collect_every and changes and group.get('collect_once') != 'yes':
+      most += count / collect_every
+    elif time_threshold:
+      most += count / time_threshold
+  globals_block = root.block('globals')
+  if globals_block is not None:
+    interval = number(globals_block.get('send_metadata_interval'))
+    if interval:
+      fewest += metrics / interval
+      most += metrics / interval
+  return fewest, most
+
+def report_rates(root, params):
+  # Printed so that the collector can be sized, per host and for 'expected-hosts' of them
+  fewest, most = packet_rates(root)
+  print 'Ganglia: gmond will send %.2f to %.2f packets/s to each udp_send_channel' % (fewest, most)
+  if 'expected-hosts' in params:
+    hosts = int(params['expected-hosts'])
+    print 'Ganglia: %d hosts will send %.0f to %.0f packets/s to the collector' % (hosts, hosts * fewest, hosts * most)
+
+def ephemeral_settings(params):
+  # The 'ephemeral' settings, None without the option
+  settings = option_dict(params.get('ephemeral'))
+  if settings is None:
+    return None
+  values = dict(DEFAULT_EPHEMERAL)
+  values.update(settings)
+  return values
+
+def metadata_switch(settings):
+  # The detached child that moves gmond to the steady metadata interval once the start-up window is over
+  script = 'sleep "$1" && "$2" -i -e "s/^\\( *send_metadata_interval *= *\\)[0-9]*/\\1$3/" "$4" && "$5" restart'
+  return [cern_util.SH_cmd, '-c', script, 'sh', str(int(settings['startup-window'])), SED_cmd,
+          str(int(settings['metadata-interval'])), GMOND_CONF, GMOND_cmd]
+
+def edit_node(root, params):
+  # Apply the node parameters to the parsed gmond.conf
+  edits = {'globals': {}, 'cluster': {}}
+  ephemeral = ephemeral_settings(params)
+  if ephemeral is not None:
+    edits['globals'] = {'host_dmax': ephemeral['host-dmax'], 'cleanup_threshold': ephemeral['cleanup-threshold'],
+                        'send_metadata_interval': ephemeral['startup-metadata-interval']}
+  for key in GMOND_GLOBALS:
+    if key in params.get('globals', {}):
+      edits['globals'][key.replace('-', '_')] = params['globals'][key]
+  for key in GMOND_CLUSTER:
+    if key in params.get('cluster', {}):
+      edits['cluster'][key] = params['cluster'][key]
+  # Unicast: 'host' instead of 'mcast_join', and no host at all in udp_recv_channel, where it causes parsing errors
+  edits['udp_recv_channel'] = {'mcast_join': None, 'host': None}
+  cern_gmondconf.apply(root, edits)
+  for block in root.blocks('udp_send_channel'):
+    block.rename('mcast_join', 'host')
+
+  for section, block_name, keys in GMOND_CHANNELS:
+    if block_name == 'udp_send_channel' and params.get('aggregators'):
+      conf_channels(root, block_name, aggregation_channels(params, facts.get('fqdn')), keys)
+    elif section in params:
+      conf_channels(root, block_name, params[section], keys)
+  conf_collection_groups(root, params)
+
+def conf_node(node_f, params, lines):
+  root = cern_gmondconf.parse(''.join(lines))
+  edit_node(root, params)
+  cern_util.write_atomic(node_f, cern_gmondconf.render(root))
+  report_rates(root, params)
   print "End of gmond.conf configuration. Initiating gmond..."
 
 ######################
@@ -210,115 +419,430 @@ def conf_head(hfile, nfile, param, h_lines, n_lines):
     if word in param:
       keys[word] = param[word]  
 
-  for h in range(0,len(h_lines)):
-    if '#' not in h_lines[h]:
-      if 'data_source' in h_lines[h]:
-        h_lines[h] = 'data_source '+keys['source']+' '+str(keys['polling'])+' '+keys['address']+':'+str(keys['port'])+'\n'
-        break
+  head = cern_gmondconf.parse(''.join(h_lines))
+  if param.get('aggregators'):
+    # One data_source per shard, named after its first aggregator. gmetad fails over between the aggregators of a shard
+    head.remove('data_source')
+    for shard in aggregator_shards(param['aggregators']):
+      name = '"'+keys['source'].strip('"')+' '+shard[0][0].split('.')[0]+'"'
+      head.add('data_source', name+' '+str(keys['polling'])+' '+' '.join([host+':'+str(port) for host, port in shard]), separator=' ')
+  else:
+    head.set('data_source', keys['source']+' '+str(keys['polling'])+' '+keys['address']+':'+str(keys['port']), separator=' ')
+  threads = server_threads(param)
+  if threads is not None:
+    head.set('server_threads', threads, separator=' ')
+  cern_util.write_atomic(hfile, cern_gmondconf.render(head))
 
   # Sometimes, due to some DNS issue it can happen that the full hostname is not resolved, so let's fix hostname as localhost.
-  #aux_host = subprocess.Popen(['%s -f' % HOST_cmd], shell=True, stdout=subprocess.PIPE)
-  #full_hostname, hosterr = aux_host.communicate()
-  #full_hostname = re.sub('\n','',full_hostname)
-
-  for l in range(0,len(n_lines)):
-    if 'name = "unspecified"' in n_lines[l]:
-      n_lines[l] = '  name = '+keys['source']+'\n'
-    if 'mcast_join' in n_lines[l]:
-      n_lines[l] = '  host = localhost\n'
-    if 'bind = ' in n_lines[l]:
-      n_lines[l] = '  #'+str(n_lines[l])+'\n'
-    if 'port = ' in n_lines[l]:
-      n_lines[l] = '  port = '+str(keys['port'])+'\n'
-    if 'ttl = ' in n_lines[l]:
-      n_lines[l] = '  #'+str(n_lines[l])+'\n'
-
-  hconf_new = open(hfile, 'w')     # Open the same file, but let's overwrite it with the new variables
-  hconf_new.writelines(h_lines)
-  hconf_new.close()
-
-  conf_node(nfile,param,n_lines)
+  node = cern_gmondconf.parse(''.join(n_lines))
+  cluster = node.block('cluster')
+  if cluster is not None and cluster.get('name') == '"unspecified"':
+    cluster.set('name', keys['source'])
+  for section, block_name, channel_keys in GMOND_CHANNELS:
+    for block in node.blocks(block_name):
+      if block.entries('mcast_join'):
+        block.rename('mcast_join', 'host')
+        block.set('host', 'localhost')
+      block.disable('bind')
+      block.disable('ttl')
+      if block.entries('port'):
+        block.set('port', keys['port'])
+
+  edit_node(node, param)
+  cern_util.write_atomic(nfile, cern_gmondconf.render(node))
+  report_rates(node, param)
+  print "End of gmond.conf configuration. Initiating gmond..."
 
 ######################
 ######################
 
-def handle(_name, cfg, cloud, log, _args):
-  # Always check first if ganglia is referenced in the user-data	
-  if 'ganglia' in cfg:
-    print "Starting Ganglia setup..."
-    # If it reaches this is because ganglia is referenced in user-data
-        
-    ganglia_cfg = cfg['ganglia']
-    print "Installing and configuring Ganglia:"
-        
-    # Aux variables to know if we are dealing with headnode or node config
-    headnode_bool = 0
-    node_bool = 0        
+def gmond_python_modules():
+  # The directory gmond loads the python modules from: modpython.conf, or the default of the architecture
+  root = cern_gmondconf.parse(cern_util.read_file(MODPYTHON_CONF) or '')
+  for modules in root.blocks('modules'):
+    for module in modules.blocks('module'):
+      if module.get('name') == '"python_module"' and module.get('params'):
+        return module.get('params').strip('"')
+  if facts.get('arch') == 'x86_64':
+    return GMOND_PYTHON_MODULES_LIB64
+  return GMOND_PYTHON_MODULES_LIB
 
-    if 'nodes' in ganglia_cfg and 'headnode' in ganglia_cfg:
-      print "ATTENTION: you can not configure a ganglia node and a ganlgia head node on the same machine!\nSkipping ganglia configuration..."
-      return
-        
-    Installation = False
-    if 'install' in ganglia_cfg:
-      Installation = ganglia_cfg['install']
-      if Installation == True:
-        subprocess.check_call([YUM_cmd,'-y','install','ganglia','ganglia-gmond'])
-        
-  # If ganglia-gmetad and ganglia-web are required they should be installed the same way as ganglia and ganglia-gmond
-  if 'headnode' in ganglia_cfg:
+def link_python_module(module):
+  # Make gmond find python_modules/'module'.py of this package
+  source = os.path.join(PYTHON_MODULES_DIR, module+'.py')
+  directory = gmond_python_modules()
+  target = os.path.join(directory, module+'.py')
+  if os.path.islink(target) and os.readlink(target) == source:
+    return target
+  if not os.path.isdir(directory):
+    os.makedirs(directory)
+  if os.path.lexists(target):
+    os.remove(target)
+  os.symlink(source, target)
+  return target
+
+def python_module_conf(module, params, groups):
+  # A gmond conf.d file loading a python module: 'params' are its param blocks and 'groups' its collection groups,
+  # given as ({group key: value}, [(metric name, value_threshold or None)])
+  root = cern_gmondconf.parse('')
+  block = root.add_block('modules').add_block('module')
+  block.add('name', '"'+module+'"')
+  block.add('language', '"python"')
+  for name in sorted(params.keys()):
+    block.add_block('param '+name).add('value', '"'+str(params[name])+'"')
+  for settings, metrics in groups:
+    group = root.add_block('collection_group')
+    for key in sorted(settings.keys()):
+      group.add(key, gmond_value(settings[key]))
+    for name, threshold in metrics:
+      metric = group.add_block('metric')
+      metric.add('name', '"'+name+'"')
+      if threshold is not None:
+        metric.add('value_threshold', threshold)
+  return cern_gmondconf.render(root)
+
+def cvmfs_metrics_conf(cvmfs_cfg, settings):
+  # conf.d/cern_cvmfs.pyconf. The metric names are those of cern_cvmfs.metric_prefix()
+  local_args = cvmfs_cfg.get('local', {})
+  repositories = [name.strip() for name in local_args.get('repositories', '').split(',') if name.strip()]
+  values = dict(DEFAULT_CVMFS_METRICS)
+  values.update(settings)
+  params = {'repositories': ','.join(repositories),
+            'cache_base': local_args.get('cache-base', cc_cvmfs.DEFAULT_CACHE_BASE),
+            'quota_limit': cc_cvmfs.quota_limit_mb(local_args),
+            'sample_seconds': values['sample-seconds']}
+  counters = []
+  steady = []
+  for repository in repositories:
+    prefix = 'cvmfs_'+repository.replace('.', '_').replace('-', '_')+'_'
+    for suffix, threshold in CVMFS_METRIC_THRESHOLDS:
+      if suffix in CVMFS_STEADY_METRICS:
+        steady.append((prefix+suffix, threshold))
+      else:
+        counters.append((prefix+suffix, threshold))
+  return python_module_conf('cern_cvmfs', params, [
+    ({'collect_every': values['collect-every'], 'time_threshold': values['time-threshold']}, counters),
+    ({'collect_every': values['collect-every'], 'time_threshold': CVMFS_STEADY_TIME_THRESHOLD}, steady)])
+
+def condor_metrics_conf(settings):
+  # conf.d/cern_condor.pyconf
+  values = dict(DEFAULT_CONDOR_METRICS)
+  values.update(settings)
+  return python_module_conf('cern_condor', {'log': CONDOR_START_LOG, 'sample_seconds': values['sample-seconds']}, [
+    ({'collect_every': values['collect-every'], 'time_threshold': values['time-threshold']}, list(CONDOR_METRIC_THRESHOLDS))])
+
+def option_dict(value):
+  # Options that are either 'true' (the defaults) or a dict of settings. None when disabled
+  if isinstance(value, dict):
+    return value
+  if value:
+    return {}
+  return None
+
+def server_threads(param):
+  # 'server-threads', or one per HOSTS_PER_SERVER_THREAD of the 'expected-hosts'. None keeps the gmetad default
+  if 'server-threads' in param:
+    return int(param['server-threads'])
+  if 'expected-hosts' in param:
+    return min(MAX_SERVER_THREADS, max(4, int(param['expected-hosts']) / HOSTS_PER_SERVER_THREAD))
+  return None
+
+def shell_vars(content, values, export=False):
+  # Set the variables of a sysconfig file, keeping the rest of it
+  lines = []
+  for line in (content or '').splitlines(True):
+    name = line.strip().replace('export ', '', 1).split('=', 1)[0]
+    if '=' not in line or name not in values:
+      lines.append(line)
+  if lines and not lines[-1].endswith('\n'):
+    lines[-1] += '\n'
+  prefix = ''
+  if export:
+    prefix = 'export '
+  for name in sorted(values.keys()):
+    lines.append(prefix+name+'="'+str(values[name])+'"\n')
+  return ''.join(lines)
+
+def rrdcached_options(settings, cpus):
+  # The rrdcached command line options. gmetad's socket is only usable by the ganglia group
+  options = dict(DEFAULT_RRDCACHED)
+  options.update(settings)
+  threads = int(options.get('write-threads', max(4, cpus)))
+  return ' '.join(['-s ganglia -m 0660 -l unix:'+RRDCACHED_SOCKET,
+                   '-m 0666 -P FLUSH,STATS,HELP -l unix:'+RRDCACHED_WEB_SOCKET,
+                   '-b '+RRD_DIR+' -B -j '+RRDCACHED_JOURNAL,
+                   '-w %d -z %d -f %d -t %d' % (int(options['write-timeout']), int(options['write-jitter']),
+                                                int(options['flush-timeout']), threads)])
+
+def ganglia_web_conf(content, settings):
+  # Set the $conf[...] 'settings' (PHP literals) of ganglia-web's conf.php, keeping the rest of it
+  lines = []
+  for line in (content or '<?php\n?>\n').splitlines(True):
+    if not [name for name in settings if "$conf['"+name+"']" in line]:
+      lines.append(line)
+  added = ["$conf['"+name+"'] = "+settings[name]+";\n" for name in sorted(settings.keys())]
+  for i in range(len(lines) - 1, -1, -1):
+    if lines[i].strip() == '?>':
+      return ''.join(lines[:i]+added+lines[i:])
+  return ''.join(lines+added)
+
+def web_settings(param):
+  # The headnode 'web' settings
+  settings = dict(DEFAULT_WEB)
+  settings.update(param.get('web', {}))
+  if not isinstance(settings['allow'], list):
+    settings['allow'] = [settings['allow']]
+  return settings
+
+def web_expiry(settings):
+  # Seconds the browsers may keep each content type: the graphs and JSON views for cache-ttl,
+  # the style sheets, scripts and icons for static-ttl
+  expiry = {}
+  for content_type in WEB_GRAPH_TYPES:
+    expiry[content_type] = int(settings['cache-ttl'])
+  for content_type in WEB_STATIC_TYPES:
+    expiry[content_type] = int(settings['static-ttl'])
+  return expiry
+
+def ganglia_httpd_conf(param):
+  # The whole of ganglia.conf: access, compression of the text responses, and expiry headers
+  settings = web_settings(param)
+  expiry = web_expiry(settings)
+  lines = ['#\n', '# Ganglia monitoring system php web frontend. Written by cloud-init (ganglia)\n', '#\n', '\n',
+           'Alias /ganglia '+GANGLIA_WEB_ROOT+'\n', '\n',
+           '<Location /ganglia>\n', '  Order deny,allow\n', '  Deny from all\n', '  Allow from 127.0.0.1\n', '  Allow from ::1\n']
+  lines += ['  Allow from '+str(allowed)+'\n' for allowed in settings['allow']]
+  lines += ['</Location>\n', '\n',
+            '<Directory '+GANGLIA_WEB_ROOT+'>\n',
+            '  <IfModule mod_deflate.c>\n',
+            '    AddOutputFilterByType DEFLATE '+' '.join(WEB_DEFLATE_TYPES)+'\n',
+            '  </IfModule>\n',
+            '  <IfModule mod_expires.c>\n',
+            '    ExpiresActive On\n']
+  lines += ['    ExpiresByType '+content_type+' "access plus '+str(expiry[content_type])+' seconds"\n'
+            for content_type in sorted(expiry.keys())]
+  lines += ['  </IfModule>\n', '</Directory>\n']
+  return ''.join(lines)
+
+def rrd_tmpfs_mb(settings, param, memory_mb):
+  # The size of the RRD tmpfs: 'size' in MB, or from the 'expected-hosts'. At most half of the memory
+  size = settings.get('size', 'auto')
+  if size == 'auto':
+    hosts = int(param.get('expected-hosts', 0))
+    size = int(hosts * METRICS_PER_HOST * RRD_FILE_KB * RRD_TMPFS_HEADROOM / 1024)
+  size = max(MIN_RRD_TMPFS_MB, int(size))
+  if memory_mb and size > memory_mb / 2:
+    print 'ATTENTION: the RRDs need '+str(size)+' MB of tmpfs, more than half of the memory. Using '+str(memory_mb / 2)+' MB...'
+    size = memory_mb / 2
+  return size
+
+def rrd_tmpfs_options(size):
+  options = 'size='+str(size)+'m,mode=0755'
+  try:
+    ganglia = pwd.getpwnam('ganglia')
+    options += ',uid='+str(ganglia.pw_uid)+',gid='+str(ganglia.pw_gid)
+  except KeyError:
+    pass
+  return options
+
+def rrd_cron(minutes, rrdcached_socket=None):
+  # Snapshots of the RRD tmpfs, restored when the machine boots. The snapshots wait for the restore
+  # to be over, and for rrdcached to write its pending updates
+  command = sys.executable+' '+RRD_SNAPSHOT_SCRIPT+' --root '+RRD_DIR+' --target '+RRD_SNAPSHOT_DIR
+  snapshot = command+' --snapshot'
+  if rrdcached_socket:
+    snapshot += ' --socket '+rrdcached_socket
+  return ('# Written by cloud-init (ganglia): snapshots of the RRDs kept on tmpfs\n'
+          '*/'+str(minutes)+' * * * * root '+snapshot+' >> '+RRD_SNAPSHOT_LOG+' 2>&1\n'
+          '@reboot root '+command+' --restore >> '+RRD_SNAPSHOT_LOG+' 2>&1 && '+SERVICE_cmd+' gmetad condrestart\n')
+
+def rrd_expire_seconds(param):
+  # With rrdcached, the files of a live host can be written only every write-timeout + write-jitter seconds
+  settings = option_dict(param.get('rrd-retention'))
+  age = int(float(settings.get('expire-after', DEFAULT_EXPIRE_HOURS)) * 3600)
+  rrdcached = option_dict(param.get('rrdcached'))
+  if rrdcached is not None:
+    options = dict(DEFAULT_RRDCACHED)
+    options.update(rrdcached)
+    lag = int(options['write-timeout']) + int(options['write-jitter']) + int(options['flush-timeout'])
+    if age <= lag:
+      print 'ATTENTION: rrd-retention expire-after is shorter than the rrdcached write delays. Expiring after '+str(2 * lag)+'s...'
+      age = 2 * lag
+  return age
+
+def rrd_expire_cron(param):
+  settings = option_dict(param.get('rrd-retention'))
+  command = sys.executable+' '+RRD_EXPIRE_SCRIPT+' --root '+RRD_DIR+' --max-age '+str(rrd_expire_seconds(param))
+  if settings.get('archive-dir'):
+    command += ' --archive '+settings['archive-dir']
+  return ('# Written by cloud-init (ganglia): expiry of the RRDs of the hosts that are gone\n'
+          '17 * * * * root '+command+' >> '+RRD_EXPIRE_LOG+' 2>&1\n')
+
+def rrd_tmpfs_mounted():
+  for line in (cern_util.read_file(PROC_MOUNTS) or '').splitlines():
+    fields = line.split()
+    if len(fields) > 2 and fields[1] == RRD_DIR and fields[2] == 'tmpfs':
+      return True
+  return False
+
+######################
+######################
+
+def package_plan(params):
+  # Packages to install. Used by cern_packages
+  # The python modules (cvmfs and condor metrics) need ganglia-gmond-python
+  packages = ['ganglia','ganglia-gmond','ganglia-gmond-python']
+  if 'headnode' in params:
     # Apache and PHP are required for the ganglia headnode
-    if Installation == True:
-      subprocess.check_call([YUM_cmd,'-y','install','httpd','php','ganglia-gmetad','ganglia-web'])
-    gmetad_conf_file = '/etc/ganglia/gmetad.conf'
-    hconf = open(gmetad_conf_file, 'r')
-    hlines = hconf.readlines()
-    hconf.close()
-    ganglia_param_cfg = ganglia_cfg['headnode']
-    headnode_bool = 1
-  else:
-    ganglia_param_cfg = ganglia_cfg['nodes']
-    node_bool = 1       
+    packages += ['httpd','php','ganglia-gmetad','ganglia-web']
+    if option_dict(params['headnode'].get('rrdcached')) is not None:
+      packages.append('rrdtool')
+    if option_dict(params['headnode'].get('rrd-tmpfs')) is not None:
+      packages.append('rsync')
+  return packages
+
+######################
+######################
 
-  gmond_conf_file = '/etc/ganglia/gmond.conf'
-  flocal = open(gmond_conf_file, 'r')     # Open to read all the file and then close it
-  node_lines = flocal.readlines()
-  flocal.close()
+def phases(cfg, log):
+  print "Starting Ganglia setup..."
+  # If it reaches this is because ganglia is referenced in user-data
         
-  # Let start by changing the configuration on the collector server, in case headnode is referenced
-  if headnode_bool:
-    conf_head(gmetad_conf_file, gmond_conf_file, ganglia_param_cfg, hlines, node_lines)
-    
-  if node_bool:
-    conf_node(gmond_conf_file, ganglia_param_cfg, node_lines)
+  ganglia_cfg = cfg['ganglia']
+  print "Installing and configuring Ganglia:"
+
+  if 'nodes' in ganglia_cfg and 'headnode' in ganglia_cfg:
+    print "ATTENTION: you can not configure a ganglia node and a ganlgia head node on the same machine!\nSkipping ganglia configuration..."
+    return []
         
+  Installation = False
+  if 'install' in ganglia_cfg:
+    Installation = ganglia_cfg['install']
+
+  # Aux variable to know if we are dealing with headnode or node config
+  headnode_bool = 'headnode' in ganglia_cfg
+
+  def install():
+    # Installed together with the other modules' packages. If that failed, try once more on our own so the error is raised here
+    if not cern_packages.ensure(cfg).get('ganglia'):
+      cern_trace.check_call([YUM_cmd,'-y','install']+package_plan(ganglia_cfg))
+
+  def config():
+    flocal = open(GMOND_CONF, 'r')     # Open to read all the file and then close it
+    node_lines = flocal.readlines()
+    flocal.close()
+
+    # Let start by changing the configuration on the collector server, in case headnode is referenced
+    if headnode_bool:
+      hconf = open(GMETAD_CONF, 'r')
+      hlines = hconf.readlines()
+      hconf.close()
+      conf_head(GMETAD_CONF, GMOND_CONF, ganglia_cfg['headnode'], hlines, node_lines)
+    else:
+      conf_node(GMOND_CONF, ganglia_cfg['nodes'], node_lines)
+
+    if headnode_bool:
+      params = ganglia_cfg['headnode']
+    else:
+      params = ganglia_cfg['nodes']
+    cvmfs_metrics = option_dict(params.get('cvmfs-metrics', True))
+    if isinstance(cfg.get('cvmfs'), dict) and cvmfs_metrics is not None:
+      link_python_module('cern_cvmfs')
+      cern_util.write_atomic(os.path.join(GMOND_CONF_DIR, 'cern_cvmfs.pyconf'), cvmfs_metrics_conf(cfg['cvmfs'], cvmfs_metrics))
+    condor_metrics = option_dict(params.get('condor-metrics', True))
+    if isinstance(cfg.get('condor'), dict) and 'workernode' in cfg['condor'] and condor_metrics is not None:
+      link_python_module('cern_condor')
+      cern_util.write_atomic(os.path.join(GMOND_CONF_DIR, 'cern_condor.pyconf'), condor_metrics_conf(condor_metrics))
+
+  def firewall():
+    # Stop iptables to solve connectivity issues. Configuring iptables would be a better solution
+    cern_trace.check_call([SERVICE_cmd,'iptables','stop'])
+    cern_trace.call([SETSE_cmd,'httpd_can_network_connect','1'])
 
-  # Stop iptables to solve connectivity issues. Configuring iptables would be a better solution
-  subprocess.check_call([SERVICE_cmd,'iptables','stop'])
-    
-  subprocess.call([SETSE_cmd,'httpd_can_network_connect','1'])
-           
-  subprocess.check_call([GMOND_cmd,'restart'])        
+  def gmond():
+    cern_trace.check_call([GMOND_cmd,'restart'])        
+    cern_trace.call([CHKCONFIG,'gmond','on'])
+    if headnode_bool:
+      params = ganglia_cfg['headnode']
+    else:
+      params = ganglia_cfg['nodes']
+    ephemeral = ephemeral_settings(params)
+    if ephemeral is not None and 'send-metadata-interval' not in params.get('globals', {}):
+      print 'gmond sends its metadata every '+str(ephemeral['startup-metadata-interval'])+'s for '+str(ephemeral['startup-window'])+'s, see '+GMOND_STARTUP_LOG
+      cern_util.spawn_detached(metadata_switch(ephemeral), GMOND_STARTUP_LOG)
 
-  subprocess.call([CHKCONFIG,'gmond','on'])
+  def rrds():
+    # The RRDs on tmpfs: what is on disk already is kept as the first snapshot
+    settings = option_dict(ganglia_cfg['headnode'].get('rrd-tmpfs'))
+    options = rrd_tmpfs_options(rrd_tmpfs_mb(settings, ganglia_cfg['headnode'], facts.get('memory_mb')))
+    for directory in (RRD_DIR, RRD_SNAPSHOT_DIR):
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if not rrd_tmpfs_mounted():
+      if os.listdir(RRD_DIR) and not os.listdir(RRD_SNAPSHOT_DIR):
+        cern_trace.check_call([RSYNC_cmd,'-a',RRD_DIR+'/',RRD_SNAPSHOT_DIR+'/'])
+      cern_trace.check_call([MOUNT_cmd,'-t','tmpfs','-o',options,'tmpfs',RRD_DIR])
+      cern_trace.check_call([RSYNC_cmd,'-a',RRD_SNAPSHOT_DIR+'/',RRD_DIR+'/'])
+      cern_util.write_atomic(os.path.join(RRD_DIR, cern_rrdsnapshot.RESTORED), '')
+    fstab = [line for line in (cern_util.read_file(FSTAB) or '').splitlines(True) if line.split()[1:2] != [RRD_DIR]]
+    fstab.append('tmpfs '+RRD_DIR+' tmpfs '+options+' 0 0\n')
+    cern_util.write_atomic(FSTAB, ''.join(fstab))
+    rrdcached_socket = None
+    if option_dict(ganglia_cfg['headnode'].get('rrdcached')) is not None:
+      rrdcached_socket = RRDCACHED_SOCKET
+    cern_util.write_atomic(RRD_CRON, rrd_cron(int(settings.get('snapshot-every', DEFAULT_SNAPSHOT_MINUTES)), rrdcached_socket))
 
+  def retention():
+    cern_util.write_atomic(RRD_EXPIRE_CRON, rrd_expire_cron(ganglia_cfg['headnode']))
+
+  def rrdcached():
+    settings = option_dict(ganglia_cfg['headnode'].get('rrdcached'))
+    for directory in (os.path.dirname(RRDCACHED_SOCKET), RRDCACHED_JOURNAL):
+      if not os.path.isdir(directory):
+        os.makedirs(directory)
+    options = rrdcached_options(settings, facts.get('cpu_count'))
+    cern_util.write_atomic(RRDCACHED_SYSCONFIG, shell_vars(cern_util.read_file(RRDCACHED_SYSCONFIG), {'OPTIONS': options, 'RRDC_USER': 'ganglia'}))
+    cern_util.write_atomic(GMETAD_SYSCONFIG, shell_vars(cern_util.read_file(GMETAD_SYSCONFIG), {'RRDCACHED_ADDRESS': 'unix:'+RRDCACHED_SOCKET}, export=True))
+    cern_util.write_atomic(GANGLIA_WEB_CONF, ganglia_web_conf(cern_util.read_file(GANGLIA_WEB_CONF),
+                                                             {'rrdcached_socket': '"unix:'+RRDCACHED_WEB_SOCKET+'"'}))
+    cern_trace.check_call([SERVICE_cmd,'rrdcached','restart'])
+    cern_trace.call([CHKCONFIG,'rrdcached','on'])
+
+  def web():
+    # Starting and configuring Apache, and ganglia-web's own metric cache
+    cern_util.write_atomic(HTTPD_GANGLIA_CONF, ganglia_httpd_conf(ganglia_cfg['headnode']))
+    ttl = web_settings(ganglia_cfg['headnode'])['cache-ttl']
+    cern_util.write_atomic(GANGLIA_WEB_CONF, ganglia_web_conf(cern_util.read_file(GANGLIA_WEB_CONF),
+                                                             {'cachedata': '1', 'cachetime': "'"+str(int(ttl))+"'"}))
+    cern_trace.check_call([SERVICE_cmd,'httpd','restart'])
+    cern_trace.check_call([SERVICE_cmd,'gmetad','restart'])
+
+  ganglia_phases = []
+  if Installation == True:
+    ganglia_phases.append(cern_phases.Phase('ganglia.install', install, locks=(cern_phases.RPMDB, cern_phases.PASSWD)))
+  ganglia_phases.extend([
+    cern_phases.Phase('ganglia.config', config, after=('ganglia.install',)),
+    cern_phases.Phase('ganglia.firewall', firewall, locks=(cern_phases.IPTABLES,)),
+    cern_phases.Phase('ganglia.gmond', gmond, after=('ganglia.config', 'ganglia.firewall')),
+  ])
   if headnode_bool:
-    # Starting and configuring Apache
-           
-    NewLine = '    Allow from cern.ch\n  </Location>\n'
-    httpdf = open('/etc/httpd/conf.d/ganglia.conf','r')
-    oldlines = httpdf.readlines()
-    for l in range(0,len(oldlines)):
-      if '</Location>' in oldlines[l]:
-        oldlines[l] = NewLine
-
-    httpdf.close()
-    httpdf_write = open('etc/httpd/conf.d/ganglia.conf','w')
-    httpdf_write.writelines(oldlines)
-    httpdf_write.close()      
-        
-    subprocess.check_call([SERVICE_cmd,'httpd','restart'])
-    subprocess.check_call([SERVICE_cmd,'gmetad','restart'])
+    if option_dict(ganglia_cfg['headnode'].get('rrd-tmpfs')) is not None:
+      ganglia_phases.append(cern_phases.Phase('ganglia.rrds', rrds, after=('ganglia.install',)))
+    if option_dict(ganglia_cfg['headnode'].get('rrdcached')) is not None:
+      ganglia_phases.append(cern_phases.Phase('ganglia.rrdcached', rrdcached, after=('ganglia.install', 'ganglia.rrds')))
+    if option_dict(ganglia_cfg['headnode'].get('rrd-retention')) is not None:
+      ganglia_phases.append(cern_phases.Phase('ganglia.retention', retention, after=('ganglia.install',)))
+    ganglia_phases.append(cern_phases.Phase('ganglia.web', web, after=('ganglia.config', 'ganglia.firewall', 'ganglia.rrdcached', 'ganglia.rrds')))
+  return ganglia_phases
+
+######################
+######################
+
+def handle(_name, cfg, cloud, log, _args):
+  # Always check first if ganglia is referenced in the user-data	
+  if 'ganglia' in cfg:
+    if not cern_phases.orchestrated(cfg, log):
+      cern_phases.run(phases(cfg, log), log=log)
 
 
 ##### END #####
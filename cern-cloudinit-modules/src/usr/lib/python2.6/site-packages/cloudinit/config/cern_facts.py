@@ -0,0 +1,231 @@
+#################################################################################
+# Host facts shared by the CERN cloud config modules. Every fact is read	#
+# directly from /proc, /sys, /etc and the passwd database (no forks),	#
+# computed lazily and cached in a file for the rest of the boot.		#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import cloudinit.config.cern_util as cern_util
+import json
+import os
+import pwd
+import re
+import socket
+import threading
+
+# Roots of the pseudo file systems, so that the facts can be read from a sandbox
+PROC = '/proc'
+SYS = '/sys'
+ETC = '/etc'
+
+# Facts of the current boot. The file is discarded when the boot id changes
+CACHE_FILE = '/var/lib/cloud/data/cern_facts.json'
+
+_lock = threading.RLock()
+_facts = None
+
+
+def _read(path):
+  f = open(path, 'r')
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+def _boot_id():
+  try:
+    return _read(PROC+'/sys/kernel/random/boot_id').strip()
+  except IOError:
+    return None
+
+def _meminfo(field):
+  for line in _read(PROC+'/meminfo').splitlines():
+    if line.startswith(field+':'):
+      return int(line.split()[1]) / 1024    # kB -> MB
+  return None
+
+def _hostname():
+  return socket.gethostname()
+
+def _fqdn():
+  # Same as 'hostname -f'
+  return socket.getfqdn()
+
+def _cpu_count():
+  CPUs = 0
+  for line in _read(PROC+'/cpuinfo').splitlines():
+    if line.startswith('processor'):
+      CPUs += 1
+  return CPUs
+
+def _memory_mb():
+  return _meminfo('MemTotal')
+
+def _swap_mb():
+  return _meminfo('SwapTotal')
+
+def _arch():
+  return os.uname()[4]
+
+def _os_release():
+  # e.g. 'Scientific Linux CERN SLC release 6.4 (Carbon)' -> '6.4'
+  for name in ('sl-release', 'redhat-release', 'system-release'):
+    try:
+      match = re.search(r'release\s+([0-9][0-9.]*)', _read(ETC+'/'+name))
+    except IOError:
+      continue
+    if match:
+      return match.group(1)
+  return None
+
+def _cpulist(text):
+  # '0-3,8,10-11' -> [0, 1, 2, 3, 8, 10, 11]
+  cpus = []
+  for item in text.strip().split(','):
+    if '-' in item:
+      first, last = item.split('-')
+      cpus.extend(range(int(first), int(last)+1))
+    elif item:
+      cpus.append(int(item))
+  return cpus
+
+def _numa_nodes():
+  # The online CPUs of each NUMA node, SMT siblings next to each other, e.g. [[0, 8, 1, 9], [2, 10, 3, 11]].
+  # Empty if the kernel does not expose the topology
+  nodes = []
+  try:
+    names = os.listdir(SYS+'/devices/system/node')
+  except OSError:
+    return []
+  names = [name for name in names if re.match(r'node[0-9]+$', name)]
+  names.sort(key=lambda name: int(name[4:]))
+  for name in names:
+    cpus = _cpulist(_read(SYS+'/devices/system/node/'+name+'/cpulist'))
+    ordered = []
+    for cpu in cpus:
+      if cpu in ordered:
+        continue
+      try:
+        siblings = _cpulist(_read(SYS+'/devices/system/cpu/cpu'+str(cpu)+'/topology/thread_siblings_list'))
+      except IOError:
+        siblings = [cpu]
+      ordered.extend([sibling for sibling in siblings if sibling in cpus and sibling not in ordered])
+    if ordered:
+      nodes.append(ordered)
+  return nodes
+
+def _cgroup_controllers():
+  # Enabled cgroup controllers, e.g. ['cpuset', 'cpu', 'memory']
+  controllers = []
+  try:
+    lines = _read(PROC+'/cgroups').splitlines()
+  except IOError:
+    return []
+  for line in lines:
+    fields = line.split()
+    if len(fields) == 4 and not line.startswith('#') and fields[3] == '1':
+      controllers.append(fields[0])
+  return controllers
+
+def _open_files_limit():
+  # Most files a process can have open: a root process can raise its limit up to fs.nr_open,
+  # and fs.file-max is shared by the whole system
+  limits = []
+  for name in ('nr_open', 'file-max'):
+    try:
+      limits.append(int(_read(PROC+'/sys/fs/'+name).split()[0]))
+    except (IOError, ValueError, IndexError):
+      pass
+  if not limits:
+    return None
+  return min(limits)
+
+def _condor_ids():
+  try:
+    condor = pwd.getpwnam('condor')
+  except KeyError:
+    return None     # Not installed (yet), so this is not cached
+  return str(condor.pw_uid)+'.'+str(condor.pw_gid)
+
+FACTS = {
+  'hostname': _hostname,
+  'fqdn': _fqdn,
+  'cpu_count': _cpu_count,
+  'memory_mb': _memory_mb,
+  'swap_mb': _swap_mb,
+  'arch': _arch,
+  'os_release': _os_release,
+  'numa_nodes': _numa_nodes,
+  'cgroup_controllers': _cgroup_controllers,
+  'open_files_limit': _open_files_limit,
+  'condor_ids': _condor_ids,
+}
+
+
+def _load():
+  global _facts
+  if _facts is None:
+    boot_id = _boot_id()
+    try:
+      _facts = json.loads(_read(CACHE_FILE))
+    except (IOError, ValueError):
+      _facts = {}
+    if _facts.get('boot_id') != boot_id:
+      _facts = {'boot_id': boot_id}
+  return _facts
+
+def _save():
+  try:
+    if not os.path.isdir(os.path.dirname(CACHE_FILE)):
+      os.makedirs(os.path.dirname(CACHE_FILE))
+    cern_util.write_atomic(CACHE_FILE, json.dumps(_facts, sort_keys=True, indent=1)+'\n')
+  except (IOError, OSError):
+    pass      # The cache is only an optimization
+
+def _cached(name, compute):
+  _lock.acquire()
+  try:
+    facts = _load()
+    if name not in facts:
+      value = compute()
+      if value is None:
+        return None
+      facts[name] = value
+      _save()
+    return facts[name]
+  finally:
+    _lock.release()
+
+def get(name):
+  return _cached(name, FACTS[name])
+
+def os_major():
+  release = get('os_release')
+  if release:
+    return release.split('.')[0]
+  return None
+
+def free_disk_mb(path):
+  # Free space available to unprivileged users on the file system holding 'path'.
+  # The path does not need to exist yet (e.g. a cache directory that is only created later)
+  def compute():
+    target = path
+    while not os.path.exists(target):
+      target = os.path.dirname(target)
+    st = os.statvfs(target)
+    return st.f_bavail * st.f_frsize / (1024 * 1024)
+  return _cached('free_disk_mb:'+path, compute)
+
+def used_disk_mb(path):
+  # Space taken by the files below 'path' (like 'du -s'), 0 if it does not exist yet
+  def compute():
+    blocks = 0
+    for directory, subdirs, files in os.walk(path):
+      for name in files:
+        try:
+          blocks += os.lstat(os.path.join(directory, name)).st_blocks
+        except OSError:
+          pass      # Removed meanwhile
+    return blocks * 512 / (1024 * 1024)
+  return _cached('used_disk_mb:'+path, compute)
@@ -0,0 +1,165 @@
+#################################################################################
+# Download cache shared by the CERN cloud config modules. Artifacts are	#
+# stored by their sha256 in <dir>/blobs and indexed by URL in <dir>/index.json.	#
+# They are handed out as <dir>/files/<sha256>/<URL basename>, a hard link to	#
+# the blob, so that tools going by the file name (yum and .rpm) accept them.	#
+# A cache can be seeded at image build time by copying files named after their	#
+# sha256 into <dir>/blobs. Configured by the top level cloud-config section:	#
+#   artifact-cache:								#
+#     dir: /var/cache/cern-cloudinit						#
+#     offline: true    # never touch the network for cached artifacts		#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import cloudinit.config.cern_trace as cern_trace
+import cloudinit.config.cern_util as cern_util
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import urllib2
+import urlparse
+
+CACHE_DIR = '/var/cache/cern-cloudinit'
+OFFLINE = False
+TIMEOUT = 60
+
+_lock = threading.Lock()
+
+
+def configure(cfg):
+  global CACHE_DIR, OFFLINE
+  params = cfg.get('artifact-cache')
+  if isinstance(params, dict):
+    CACHE_DIR = params.get('dir', CACHE_DIR)
+    OFFLINE = params.get('offline', OFFLINE) == True
+
+def _blob(digest):
+  return os.path.join(CACHE_DIR, 'blobs', digest)
+
+def _named(digest, url):
+  # The blob under the basename of its URL, linked (or copied across file systems) on first use
+  name = os.path.basename(urlparse.urlparse(url).path) or 'artifact'
+  path = os.path.join(CACHE_DIR, 'files', digest, name)
+  if os.path.exists(path):
+    return path
+  if not os.path.isdir(os.path.dirname(path)):
+    try:
+      os.makedirs(os.path.dirname(path))
+    except OSError:
+      if not os.path.isdir(os.path.dirname(path)):
+        raise
+  tmp_path = '%s.%d-%d' % (path, os.getpid(), threading.currentThread().ident)
+  try:
+    try:
+      os.link(_blob(digest), tmp_path)
+    except OSError:
+      shutil.copy2(_blob(digest), tmp_path)
+    os.rename(tmp_path, path)
+  except:
+    if os.path.exists(tmp_path):
+      os.unlink(tmp_path)
+    raise
+  return path
+
+def _index_file():
+  return os.path.join(CACHE_DIR, 'index.json')
+
+def _load_index():
+  try:
+    return json.loads(cern_util.read_file(_index_file(), '{}'))
+  except ValueError:
+    return {}
+
+def _update_index(url, entry):
+  _lock.acquire()
+  try:
+    index = _load_index()
+    index[url] = entry
+    cern_util.write_atomic(_index_file(), json.dumps(index, sort_keys=True, indent=1)+'\n')
+  finally:
+    _lock.release()
+
+def _download(response, sha256):
+  # Stream into the blob directory while hashing, then move it into place under its digest
+  blobs = os.path.join(CACHE_DIR, 'blobs')
+  if not os.path.isdir(blobs):
+    os.makedirs(blobs)
+  fd, tmp_path = tempfile.mkstemp(dir=blobs, prefix='.download')
+  try:
+    f = os.fdopen(fd, 'wb')
+    digest = hashlib.sha256()
+    while True:
+      chunk = response.read(65536)
+      if not chunk:
+        break
+      digest.update(chunk)
+      f.write(chunk)
+    f.close()
+    digest = digest.hexdigest()
+    if sha256 and digest != sha256.lower():
+      raise IOError('checksum mismatch for '+response.geturl()+': expected '+sha256+', got '+digest)
+    os.chmod(tmp_path, 0644)
+    os.rename(tmp_path, _blob(digest))
+  except:
+    if os.path.exists(tmp_path):
+      os.unlink(tmp_path)
+    raise
+  return digest
+
+def fetch(url, sha256=None):
+  # Returns the path of the cached copy of url (ending with its basename), downloading or revalidating it if needed.
+  # With an expected checksum, a cached artifact is used as is: its content can not have changed
+  with cern_trace.span('download', url=url) as s:
+    path = _fetch(url, sha256, s)
+  return path
+
+def _fetch(url, sha256, s):
+  entry = _load_index().get(url, {})
+  digest = sha256 or entry.get('sha256')
+  cached = digest and os.path.exists(_blob(digest))
+  if cached and (sha256 or OFFLINE):
+    s.set(source='cache')
+    return _named(digest, url)
+  if OFFLINE:
+    raise IOError(url+' is not in the artifact cache '+CACHE_DIR+' (offline mode)')
+
+  request = urllib2.Request(url)
+  if cached:
+    # Conditional revalidation of what we already have
+    if entry.get('etag'):
+      request.add_header('If-None-Match', entry['etag'])
+    if entry.get('last-modified'):
+      request.add_header('If-Modified-Since', entry['last-modified'])
+  try:
+    response = urllib2.urlopen(request, timeout=TIMEOUT)
+  except urllib2.HTTPError, e:
+    if e.code == 304 and cached:
+      s.set(source='revalidated')
+      return _named(digest, url)
+    raise
+  except urllib2.URLError, e:
+    if cached:
+      print 'Could not revalidate '+url+' ('+str(e.reason)+'), using the cached copy'
+      s.set(source='stale')
+      return _named(digest, url)
+    raise
+
+  try:
+    digest = _download(response, sha256)
+    entry = {'sha256': digest}
+    for header in ('etag', 'last-modified'):
+      if response.info().getheader(header):
+        entry[header] = response.info().getheader(header)
+  finally:
+    response.close()
+  _update_index(url, entry)
+  s.set(source='network', bytes=os.path.getsize(_blob(digest)))
+  return _named(digest, url)
+
+def fetch_to(url, dest, sha256=None):
+  # Install a cached artifact at dest (e.g. a yum .repo file)
+  cern_util.write_atomic(dest, cern_util.read_file(fetch(url, sha256)))
@@ -0,0 +1,223 @@
+#################################################################################
+# Parser for the gmond.conf / gmetad.conf syntax, used by cc_ganglia.		#
+# The file is read once into blocks ('name {' ... '}') and entries		#
+# ('key = value' in gmond.conf, 'key value' in gmetad.conf). Every line keeps	#
+# its original text, so comments and layout survive; only the edited entries	#
+# are rewritten.								#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import re
+
+INDENT = '  '
+
+# Value of apply() edits that comments an entry out
+DISABLE = object()
+
+# A line without its trailing comment: 'name {', '}', 'key = value' or 'key value'
+_LINE = re.compile(r'^(\s*)(?:([A-Za-z_][A-Za-z0-9_]*)\s*\{|(\})|([A-Za-z_][A-Za-z0-9_]*)(\s*=\s*|\s+)(.*?))\s*$')
+_COMMENT_OR_QUOTE = re.compile(r'["\'#]|/[*/]')
+
+
+def _split_comment(line):
+  # 'port = 8649 /* secs */' -> ('port = 8649', ' /* secs */'). Comment markers within quotes are part of the value
+  quote = None
+  for match in _COMMENT_OR_QUOTE.finditer(line):
+    token = match.group()
+    if token in '"\'':
+      if quote is None:
+        quote = token
+      elif quote == token:
+        quote = None
+    elif quote is None:
+      code = line[:match.start()].rstrip()
+      return code, line[len(code):]
+  return line, ''
+
+
+class Text(object):
+  # Blank lines, comments and anything that is not understood, written back as they were
+  __slots__ = ('text',)
+
+  def __init__(self, text):
+    self.text = text
+
+  def render(self):
+    return self.text
+
+
+class Entry(object):
+  __slots__ = ('indent', 'key', 'separator', 'value', 'comment')
+
+  def __init__(self, indent, key, separator, value, comment):
+    self.indent = indent
+    self.key = key
+    self.separator = separator
+    self.value = value
+    self.comment = comment      # Trailing comment, kept when the value changes
+
+  def render(self):
+    return self.indent+self.key+self.separator+self.value+self.comment+'\n'
+
+
+class Block(object):
+  def __init__(self, name, header='', footer='', depth=0):
+    self.name = name
+    self.header = header
+    self.footer = footer
+    self.depth = depth
+    self.children = []
+
+  def blocks(self, name):
+    return [child for child in self.children if isinstance(child, Block) and child.name == name]
+
+  def block(self, name):
+    # The first block called 'name', None if there is none
+    blocks = self.blocks(name)
+    if blocks:
+      return blocks[0]
+    return None
+
+  def entries(self, key):
+    return [child for child in self.children if isinstance(child, Entry) and child.key == key]
+
+  def get(self, key, default=None):
+    entries = self.entries(key)
+    if entries:
+      return entries[0].value
+    return default
+
+  def set(self, key, value, separator=' = '):
+    # Change the first 'key' of the block, or add it at its end
+    entries = self.entries(key)
+    if entries:
+      entries[0].value = str(value)
+      return entries[0]
+    return self.add(key, value, separator)
+
+  def add(self, key, value, separator=' = '):
+    entry = Entry(INDENT * self.depth, key, separator, str(value), '')
+    self.children.append(entry)
+    return entry
+
+  def remove(self, key):
+    self.children = [child for child in self.children if not (isinstance(child, Entry) and child.key == key)]
+
+  def rename(self, key, new_key):
+    for entry in self.entries(key):
+      entry.key = new_key
+
+  def disable(self, key):
+    # Comment the entries out rather than removing them
+    for i in range(len(self.children)):
+      child = self.children[i]
+      if isinstance(child, Entry) and child.key == key:
+        self.children[i] = Text(child.indent+'#'+child.render().lstrip())
+
+  def add_block(self, name, after=None):
+    # A new, empty 'name' block at the end, or right after the block 'after'
+    block = Block(name, INDENT * self.depth+name+' {\n', INDENT * self.depth+'}\n', self.depth+1)
+    if after is None:
+      self.children.append(block)
+    else:
+      self.children.insert(self.children.index(after)+1, block)
+    return block
+
+  def remove_block(self, block):
+    self.children.remove(block)
+
+  def copy(self):
+    # A deep copy, to be inserted with insert()
+    block = Block(self.name, self.header, self.footer, self.depth)
+    for child in self.children:
+      if isinstance(child, Block):
+        block.children.append(child.copy())
+      elif isinstance(child, Entry):
+        block.children.append(Entry(child.indent, child.key, child.separator, child.value, child.comment))
+      else:
+        block.children.append(Text(child.text))
+    return block
+
+  def insert(self, block, after=None):
+    # A block of the same depth (copied or taken from a sibling) at the end, or right after the block 'after'
+    if after is None:
+      self.children.append(block)
+    else:
+      self.children.insert(self.children.index(after)+1, block)
+
+  def render(self):
+    return self.header+''.join([child.render() for child in self.children])+self.footer
+
+
+def parse(text):
+  # Returns the top level Block (without a name) of a gmond.conf or gmetad.conf
+  root = Block(None)
+  stack = [root]
+  children = root.children
+  in_comment = False
+  match_line = _LINE.match
+  search_comment = _COMMENT_OR_QUOTE.search
+  for line in text.splitlines(True):
+    if in_comment:
+      children.append(Text(line))
+      if '*/' in line:
+        in_comment = False
+      continue
+
+    code, comment = line.rstrip('\r\n'), ''
+    if search_comment(code):
+      code, comment = _split_comment(code)
+      in_comment = comment.startswith('/*') and '*/' not in comment
+    match = match_line(code)
+    if match is None or not code.strip():
+      children.append(Text(line))
+      continue
+    indent, name, close, key, separator, value = match.groups()
+    if name:
+      block = Block(name, line, '', len(stack))
+      children.append(block)
+      stack.append(block)
+      children = block.children
+    elif close:
+      if len(stack) > 1:
+        stack.pop().footer = line
+        children = stack[-1].children
+      else:
+        children.append(Text(line))
+    else:
+      children.append(Entry(indent, key, separator, value, comment))
+  return root
+
+
+def apply(root, edits):
+  # Edit every block in a single walk of the tree. 'edits' is {block name: {key: value}}, '' being the top level.
+  # A value goes to the first entry of the key, repeated entries are left as they are. None removes all the entries
+  # of the key, DISABLE comments them out. Keys the block does not have yet are added at its end
+  def walk(block):
+    wanted = edits.get(block.name or '')
+    children = []
+    done = set()
+    for child in block.children:
+      if isinstance(child, Block):
+        walk(child)
+      elif wanted is not None and isinstance(child, Entry) and child.key in wanted:
+        value = wanted[child.key]
+        if value is None:
+          continue
+        if value is DISABLE:
+          done.add(child.key)
+          child = Text(child.indent+'#'+child.render().lstrip())
+        elif child.key not in done:
+          done.add(child.key)
+          child.value = str(value)
+      children.append(child)
+    block.children = children
+    if wanted is not None:
+      for key in sorted(wanted.keys()):
+        if key not in done and wanted[key] is not None and wanted[key] is not DISABLE:
+          block.add(key, wanted[key])
+  walk(root)
+
+def render(root):
+  return root.render()
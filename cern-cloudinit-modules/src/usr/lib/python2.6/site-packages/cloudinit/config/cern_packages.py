@@ -0,0 +1,94 @@
+#################################################################################
+# Package plan shared by the CERN cloud config modules. The packages of every	#
+# enabled module (condor, cvmfs, ganglia) are installed by a single yum		#
+# transaction, so the repository metadata is only loaded once per boot.		#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import cloudinit.config.cern_trace as cern_trace
+import subprocess
+import sys
+
+YUM_cmd = '/usr/bin/yum'
+RPM_cmd = '/bin/rpm'
+
+# Modules taking part in the plan. Each of them provides package_plan(params), which prepares the
+# module's repositories and returns the packages (names or local .rpm files) to install, or None if it can not be installed
+MODULES = ('cvmfs', 'condor', 'ganglia')
+
+# Outcome of the plan for this cloud-init run: {module: True/False}
+_results = None
+
+
+def _module(name):
+  # Imported on demand, the modules import this one
+  fullname = 'cloudinit.config.cc_'+name
+  __import__(fullname)
+  return sys.modules[fullname]
+
+def plan(cfg):
+  packages = {}
+  for name in MODULES:
+    params = cfg.get(name)
+    if not isinstance(params, dict) or params.get('install') != True:
+      continue
+    packages[name] = _module(name).package_plan(params)
+  return packages
+
+def missing(packages):
+  # Query all the packages with a single rpm call. Local .rpm files are left to yum's exit code
+  names = [p for p in packages if not p.endswith('.rpm')]
+  if not names:
+    return []
+  code, output = cern_trace.communicate([RPM_cmd, '-q']+names, stderr=subprocess.STDOUT)
+  absent = []
+  for line in output.splitlines():
+    if line.startswith('package ') and line.endswith(' is not installed'):
+      absent.append(line[len('package '):-len(' is not installed')])
+  return absent
+
+def install(packages):
+  # Returns whether all the packages are installed afterwards
+  todo = missing(packages) + [p for p in packages if p.endswith('.rpm')]
+  if not todo:
+    return True
+  with cern_trace.span('package install', packages=todo) as s:
+    if cern_trace.call([YUM_cmd, '-y', 'install']+todo) != 0:
+      s.set(ok=False)
+      return False
+    s.set(ok=not missing(todo))
+  return s.args['ok']
+
+def ensure(cfg):
+  # Run the plan once per cloud-init run, whichever module asks first.
+  # Only the modules whose packages did not make it in the common transaction are retried on their own.
+  global _results
+  if _results is not None:
+    return _results
+
+  results = {}
+  packages = plan(cfg)
+  for name in packages.keys():
+    if packages[name] is None:
+      results[name] = False
+      del packages[name]
+
+  everything = []
+  for name in MODULES:
+    for package in packages.get(name, []):
+      if package not in everything:
+        everything.append(package)
+
+  print 'Installing packages for: '+', '.join([name for name in MODULES if name in packages])
+  if install(everything):
+    for name in packages:
+      results[name] = True
+  else:
+    for name in MODULES:
+      if name in packages:
+        print 'Retrying the installation of the '+name+' packages on their own'
+        results[name] = install(packages[name])
+
+  _results = results
+  return _results
@@ -0,0 +1,129 @@
+#################################################################################
+# Phase runner for the CERN cloud config modules. Each module splits its work	#
+# into named phases with dependencies and resource locks (e.g. the rpm		#
+# database or iptables). Independent phases run concurrently on a bounded pool	#
+# of worker threads. With the top level cloud-config section			#
+#   contextualization:								#
+#     workers: 4								#
+# the first of the condor, cvmfs and ganglia handlers runs the phases of all	#
+# three modules together and the following handlers have nothing left to do.	#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import cloudinit.config.cern_trace as cern_trace
+import sys
+import threading
+
+# Modules taking part in the orchestration. Each of them provides phases(cfg, log)
+MODULES = ('cvmfs', 'condor', 'ganglia')
+
+# Shared resources
+RPMDB = 'rpmdb'
+PASSWD = 'passwd'
+IPTABLES = 'iptables'
+
+_orchestrated = False
+
+
+class Phase(object):
+  # 'after' are the phases that have to succeed first, 'waits' those that only have to be over (succeeded,
+  # failed or skipped): the phase finds out itself whether what they provide is there
+  def __init__(self, name, run, after=(), locks=(), waits=()):
+    self.name = name
+    self.run = run
+    self.after = tuple(after)
+    self.locks = tuple(locks)
+    self.waits = tuple(waits)
+
+
+def run(phases, workers=1, log=None):
+  # Run the phases once their dependencies succeeded (or, for 'waits', are over) and none of their locks is held.
+  # Dependencies on phases that are not part of the run are ignored. When a phase fails, the phases
+  # depending on it are skipped, the others carry on, and the first error is raised at the end.
+  # Every phase is traced, the trace is written and summarized through log at the end.
+  names = set([phase.name for phase in phases])
+  pending = list(phases)
+  succeeded = {}
+  held = set()
+  errors = []
+  running = [0]
+  cond = threading.Condition()
+
+  def worker(phase):
+    cern_trace.set_module(phase.name.split('.')[0])
+    try:
+      with cern_trace.span(phase.name, 'phase'):
+        phase.run()
+      ok = True
+    except Exception:
+      errors.append(sys.exc_info())
+      print 'Phase '+phase.name+' failed: '+str(sys.exc_info()[1])
+      ok = False
+    cond.acquire()
+    try:
+      succeeded[phase.name] = ok
+      for lock in phase.locks:
+        held.discard(lock)
+      running[0] -= 1
+      cond.notify()
+    finally:
+      cond.release()
+
+  cond.acquire()
+  try:
+    while pending or running[0]:
+      progressed = False
+      for phase in list(pending):
+        deps = [dep for dep in phase.after if dep in names]
+        if [dep for dep in deps if succeeded.get(dep) is False]:
+          print 'Skipping phase '+phase.name+': a phase it depends on failed'
+          succeeded[phase.name] = False
+          pending.remove(phase)
+          progressed = True
+          continue
+        if running[0] >= workers:
+          continue
+        waits = [dep for dep in phase.waits if dep in names]
+        if [dep for dep in deps+waits if dep not in succeeded] or [lock for lock in phase.locks if lock in held]:
+          continue
+        pending.remove(phase)
+        held.update(phase.locks)
+        running[0] += 1
+        progressed = True
+        threading.Thread(target=worker, args=(phase,), name=phase.name).start()
+      if running[0]:
+        cond.wait()
+      elif pending and not progressed:
+        raise RuntimeError('Circular phase dependencies: '+', '.join([phase.name for phase in pending]))
+  finally:
+    cond.release()
+    cern_trace.flush(log)
+
+  if errors:
+    raise errors[0][0], errors[0][1], errors[0][2]
+
+def _module(name):
+  # Imported on demand, the modules import this one
+  fullname = 'cloudinit.config.cc_'+name
+  __import__(fullname)
+  return sys.modules[fullname]
+
+def orchestrated(cfg, log):
+  # Returns True when the module handler has nothing left to do, because the phases of all the
+  # modules are (or were) run together
+  global _orchestrated
+  params = cfg.get('contextualization')
+  if not isinstance(params, dict) or not params.get('workers'):
+    return False
+  if _orchestrated:
+    return True
+  _orchestrated = True
+
+  phases = []
+  for name in MODULES:
+    if name in cfg:
+      phases.extend(_module(name).phases(cfg, log))
+  print 'Running '+str(len(phases))+' contextualization phases on '+str(params['workers'])+' workers'
+  run(phases, int(params['workers']), log)
+  return True
@@ -0,0 +1,167 @@
+#################################################################################
+# Warms the cvmfs cache after the repositories are mounted: reads the files	#
+# listed in the cvmfs 'prefetch' section with a few threads, until they are	#
+# all read, the byte budget is spent or the deadline passes. Started by	#
+# cc_cvmfs as a detached process, so it never holds up contextualization:	#
+#   python cern_prefetch.py --config '{"paths": [...], ...}' [--root DIR]	#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import json
+import optparse
+import os
+import Queue
+import threading
+import time
+
+CVMFS_MOUNT_ROOT = '/cvmfs'
+REPORT_FILE = '/var/log/cern-cloudinit-prefetch.json'
+
+DEFAULT_THREADS = 8
+DEFAULT_DEADLINE = 900
+CHUNK_SIZE = 1024 * 1024
+
+
+def read_manifest(path):
+  # One repository path per line, '#' starts a comment
+  paths = []
+  f = open(path, 'r')
+  try:
+    for line in f:
+      line = line.split('#', 1)[0].strip()
+      if line:
+        paths.append(line)
+  finally:
+    f.close()
+  return paths
+
+def files_below(root, paths):
+  # The files of 'paths' (relative to the mount root), directories being walked lazily
+  for path in paths:
+    full = os.path.join(root, path.lstrip('/'))
+    if os.path.isdir(full):
+      for directory, dirnames, filenames in os.walk(full):
+        dirnames.sort()
+        for name in sorted(filenames):
+          yield os.path.join(directory, name)
+    else:
+      yield full
+
+def prefetch(root, paths, threads=DEFAULT_THREADS, budget=None, deadline=DEFAULT_DEADLINE):
+  # Returns the report: files and bytes read, seconds, errors and why it stopped early (None, 'budget' or 'deadline')
+  start = time.time()
+  end = start + deadline
+  report = {'files': 0, 'bytes': 0, 'errors': 0, 'stopped': None}
+  lock = threading.Lock()
+  stop = threading.Event()
+  queue = Queue.Queue(threads * 4)
+
+  def stopped(reason):
+    lock.acquire()
+    try:
+      if report['stopped'] is None:
+        report['stopped'] = reason
+    finally:
+      lock.release()
+    stop.set()
+
+  def read(path):
+    f = open(path, 'rb')
+    try:
+      while not stop.is_set():
+        data = f.read(CHUNK_SIZE)
+        if not data:
+          return True
+        lock.acquire()
+        try:
+          report['bytes'] += len(data)
+          spent = budget is not None and report['bytes'] >= budget
+        finally:
+          lock.release()
+        if spent:
+          stopped('budget')
+        elif time.time() > end:
+          stopped('deadline')
+    finally:
+      f.close()
+    return False
+
+  def worker():
+    while True:
+      path = queue.get()
+      if path is None:
+        return
+      if stop.is_set():
+        continue
+      try:
+        done = read(path)
+      except (IOError, OSError):
+        lock.acquire()
+        report['errors'] += 1
+        lock.release()
+        continue
+      if done:
+        lock.acquire()
+        report['files'] += 1
+        lock.release()
+
+  workers = []
+  for n in range(threads):
+    thread = threading.Thread(target=worker)
+    thread.setDaemon(True)
+    thread.start()
+    workers.append(thread)
+
+  for path in files_below(root, paths):
+    while not stop.is_set():
+      if time.time() > end:
+        stopped('deadline')
+        break
+      try:
+        queue.put(path, True, 1)
+        break
+      except Queue.Full:
+        pass
+    if stop.is_set():
+      break
+
+  for thread in workers:
+    while True:
+      try:
+        queue.put(None, True, 1)
+        break
+      except Queue.Full:
+        if time.time() > end:
+          stopped('deadline')
+  for thread in workers:
+    thread.join(max(0, end - time.time()))
+
+  lock.acquire()
+  try:
+    report['seconds'] = round(time.time() - start, 2)
+    return dict(report)
+  finally:
+    lock.release()
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option('--config', help='JSON with paths, manifest, threads, budget (bytes) and deadline (seconds)')
+  parser.add_option('--root', default=CVMFS_MOUNT_ROOT, help='where the repositories are mounted')
+  parser.add_option('--report', default=REPORT_FILE)
+  options, args = parser.parse_args()
+
+  config = json.loads(options.config)
+  paths = list(config.get('paths', []))
+  if config.get('manifest'):
+    paths.extend(read_manifest(config['manifest']))
+  report = prefetch(options.root, paths, int(config.get('threads', DEFAULT_THREADS)), config.get('budget'),
+                    float(config.get('deadline', DEFAULT_DEADLINE)))
+  print 'cvmfs prefetch: %d files, %d MB in %.2fs (%d errors, stopped: %s)' % (
+    report['files'], report['bytes'] / (1024 * 1024), report['seconds'], report['errors'], report['stopped'])
+  f = open(options.report, 'w')
+  f.write(json.dumps(report, sort_keys=True)+'\n')
+  f.close()
+
+if __name__ == '__main__':
+  main()
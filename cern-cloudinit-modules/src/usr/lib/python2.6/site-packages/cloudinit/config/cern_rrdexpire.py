@@ -0,0 +1,94 @@
+#################################################################################
+# Expires the RRDs of ganglia hosts that are gone: a host directory		#
+# (<rrd root>/<cluster>/<host>) none of whose files was updated for		#
+# --max-age seconds is archived as a tar.gz, or deleted without --archive.	#
+# Run from cron on the ganglia headnode, see cc_ganglia:			#
+#   python cern_rrdexpire.py --max-age SECONDS [--root DIR] [--archive DIR]	#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import optparse
+import os
+import shutil
+import tarfile
+import time
+
+RRD_DIR = '/var/lib/ganglia/rrds'
+
+# Summary RRDs of a cluster or grid, never expired
+SUMMARY_DIR = '__SummaryInfo__'
+
+
+def last_update(directory):
+  # Newest modification time of the files of a host directory, None if it has none
+  newest = None
+  for name in os.listdir(directory):
+    try:
+      mtime = os.stat(os.path.join(directory, name)).st_mtime
+    except OSError:
+      continue      # Removed meanwhile
+    if newest is None or mtime > newest:
+      newest = mtime
+  return newest
+
+def expired_hosts(root, max_age, now=None):
+  # [(cluster, host), ...] of the hosts not updated for max_age seconds
+  if now is None:
+    now = time.time()
+  expired = []
+  for cluster in sorted(os.listdir(root)):
+    if cluster == SUMMARY_DIR or not os.path.isdir(os.path.join(root, cluster)):
+      continue
+    for host in sorted(os.listdir(os.path.join(root, cluster))):
+      directory = os.path.join(root, cluster, host)
+      if host == SUMMARY_DIR or not os.path.isdir(directory):
+        continue
+      updated = last_update(directory)
+      if updated is None or now - updated > max_age:
+        expired.append((cluster, host))
+  return expired
+
+def archive(root, cluster, host, archive_dir, now):
+  target = os.path.join(archive_dir, cluster)
+  if not os.path.isdir(target):
+    os.makedirs(target)
+  tar = tarfile.open(os.path.join(target, host+time.strftime('-%Y%m%d%H%M.tar.gz', time.localtime(now))), 'w:gz')
+  try:
+    tar.add(os.path.join(root, cluster, host), host)
+  finally:
+    tar.close()
+
+def expire(root, max_age, archive_dir=None, now=None):
+  # Returns the report: hosts expired, bytes freed and errors
+  if now is None:
+    now = time.time()
+  report = {'hosts': 0, 'bytes': 0, 'errors': 0}
+  for cluster, host in expired_hosts(root, max_age, now):
+    directory = os.path.join(root, cluster, host)
+    try:
+      size = sum([os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)])
+      if archive_dir:
+        archive(root, cluster, host, archive_dir, now)
+      shutil.rmtree(directory)
+    except (IOError, OSError, tarfile.TarError):
+      report['errors'] += 1
+      continue
+    report['hosts'] += 1
+    report['bytes'] += size
+  return report
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option('--max-age', type='int', help='seconds since the last update of a host')
+  parser.add_option('--root', default=RRD_DIR, help='where gmetad keeps the RRDs')
+  parser.add_option('--archive', help='keep the expired hosts as tar.gz files in this directory')
+  options, args = parser.parse_args()
+  if not options.max_age:
+    parser.error('--max-age is required')
+
+  report = expire(options.root, options.max_age, options.archive)
+  print 'ganglia RRD expiry: %d hosts, %d MB (%d errors)' % (report['hosts'], report['bytes'] / (1024 * 1024), report['errors'])
+
+if __name__ == '__main__':
+  main()
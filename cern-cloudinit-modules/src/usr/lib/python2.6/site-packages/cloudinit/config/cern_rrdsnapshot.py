@@ -0,0 +1,106 @@
+#################################################################################
+# Snapshots of the ganglia RRDs kept on tmpfs. --restore copies the snapshot	#
+# back into the (fresh) tmpfs and then marks it as restored; --snapshot	#
+# copies the tmpfs over the snapshot, only once it is marked as restored so	#
+# an empty tmpfs never wipes the history, and after asking rrdcached to write	#
+# its pending updates (--socket). Run from cron on the ganglia headnode, see	#
+# cc_ganglia:									#
+#   python cern_rrdsnapshot.py --snapshot|--restore [--socket PATH]		#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import optparse
+import os
+import socket
+import subprocess
+import time
+
+RSYNC_cmd = '/usr/bin/rsync'
+
+RRD_DIR = '/var/lib/ganglia/rrds'
+SNAPSHOT_DIR = '/var/lib/ganglia/rrds.snapshot'
+
+# Written into the tmpfs once the snapshot is back in it. Never copied, so it goes with the tmpfs at reboot
+RESTORED = '.restored'
+
+# Seconds to wait for rrdcached to write its queue after FLUSHALL
+FLUSH_TIMEOUT = 300
+FLUSH_POLL = 1
+
+
+def rrdcached(path, command):
+  # Send a command to rrdcached and return the lines of its answer. The first line is
+  # '<count> <message>', followed by count lines; a negative count is an error
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.settimeout(FLUSH_TIMEOUT)
+    sock.connect(path)
+    sock.sendall(command+'\n')
+    answer = sock.makefile('r')
+    status = answer.readline()
+    if not status:
+      raise IOError('rrdcached closed the connection on '+command)
+    count = int(status.split(' ', 1)[0])
+    if count < 0:
+      raise IOError('rrdcached refused '+command+': '+status.strip())
+    return [status.strip()]+[answer.readline().strip() for i in range(count)]
+  finally:
+    sock.close()
+
+def queue_length(path):
+  for line in rrdcached(path, 'STATS')[1:]:
+    name, _, value = line.partition(':')
+    if name == 'QueueLength':
+      return int(value)
+  return 0
+
+def flush_all(path, timeout=FLUSH_TIMEOUT):
+  # FLUSHALL only queues the writes: wait until the queue is empty. True if it was, in time
+  rrdcached(path, 'FLUSHALL')
+  deadline = time.time() + timeout
+  while queue_length(path):
+    if time.time() > deadline:
+      return False
+    time.sleep(FLUSH_POLL)
+  return True
+
+def restored(root):
+  return os.path.exists(os.path.join(root, RESTORED))
+
+def snapshot(root, target, rrdcached_socket=None):
+  # True if the snapshot was taken
+  if not restored(root):
+    print 'ganglia RRD snapshot: '+root+' is not restored yet, skipping'
+    return False
+  if rrdcached_socket:
+    try:
+      if not flush_all(rrdcached_socket):
+        print 'ATTENTION: rrdcached did not write its queue in '+str(FLUSH_TIMEOUT)+'s, the snapshot may miss some updates'
+    except (IOError, socket.error, ValueError), e:
+      print 'ATTENTION: could not flush rrdcached ('+str(e)+'), the snapshot may miss some updates'
+  subprocess.check_call([RSYNC_cmd,'-a','--delete','--exclude','/'+RESTORED,root+'/',target+'/'])
+  return True
+
+def restore(root, target):
+  subprocess.check_call([RSYNC_cmd,'-a',target+'/',root+'/'])
+  open(os.path.join(root, RESTORED), 'w').close()
+
+def main():
+  parser = optparse.OptionParser()
+  parser.add_option('--snapshot', action='store_true', help='copy the RRDs to the snapshot')
+  parser.add_option('--restore', action='store_true', help='copy the snapshot back to the RRDs')
+  parser.add_option('--root', default=RRD_DIR, help='where gmetad keeps the RRDs')
+  parser.add_option('--target', default=SNAPSHOT_DIR, help='where the snapshot is kept')
+  parser.add_option('--socket', help='rrdcached socket accepting FLUSHALL')
+  options, args = parser.parse_args()
+  if options.snapshot == options.restore:
+    parser.error('one of --snapshot and --restore is required')
+
+  if options.restore:
+    restore(options.root, options.target)
+  else:
+    snapshot(options.root, options.target, options.socket)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,176 @@
+#################################################################################
+# Timing spans for the CERN cloud config modules. Every span records its wall	#
+# and CPU time and is appended to TRACE_FILE as a Chrome trace event, one per	#
+# line, in a JSON array that is left open for the next run. chrome://tracing	#
+# and ui.perfetto.dev load such a file as it is, load() reads it back.		#
+# CPU time is process wide (including waited-for children), so concurrent	#
+# spans share it.								#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import json
+import os
+import subprocess
+import threading
+import time
+
+TRACE_FILE = '/var/log/cern-cloudinit-trace.json'
+
+_lock = threading.Lock()
+_events = []
+_local = threading.local()
+
+
+def set_module(name):
+  # Spans opened by this thread are attributed to module 'name'
+  _local.module = name
+
+def get_module():
+  return getattr(_local, 'module', None)
+
+def _cpu():
+  t = os.times()
+  return t[0] + t[1] + t[2] + t[3]
+
+
+class span(object):
+  # with cern_trace.span('download', url=url) as s:
+  #   ...
+  #   s.set(cached=True)
+  def __init__(self, name, kind='step', **args):
+    self.name = name
+    self.kind = kind
+    self.args = args
+
+  def set(self, **args):
+    self.args.update(args)
+
+  def __enter__(self):
+    self.start = time.time()
+    self.cpu = _cpu()
+    return self
+
+  def __exit__(self, exc_type, exc_value, tb):
+    wall = time.time() - self.start
+    self.args['cpu_ms'] = int((_cpu() - self.cpu) * 1000)
+    if exc_type is not None:
+      self.args['error'] = str(exc_value)
+    event = {
+      'name': self.name,
+      'cat': getattr(_local, 'module', 'cern'),
+      'ph': 'X',
+      'ts': int(self.start * 1000000),
+      'dur': int(wall * 1000000),
+      'pid': os.getpid(),
+      'tid': threading.current_thread().ident,
+      'args': dict(self.args, kind=self.kind),
+    }
+    _lock.acquire()
+    try:
+      _events.append(event)
+    finally:
+      _lock.release()
+    return False
+
+
+# Traced replacements of the subprocess/os calls used by the modules
+
+def call(argv, **kwargs):
+  with span(os.path.basename(argv[0]), 'command', argv=list(argv)) as s:
+    code = subprocess.call(argv, **kwargs)
+    s.set(exit_code=code)
+  return code
+
+def check_call(argv, **kwargs):
+  code = call(argv, **kwargs)
+  if code:
+    raise subprocess.CalledProcessError(code, argv)
+  return 0
+
+def system(command):
+  with span(command.split(';')[-1].split()[0], 'command', argv=[command]) as s:
+    code = os.system(command)
+    s.set(exit_code=code >> 8)
+  return code
+
+def communicate(argv, input=None, timeout=None, **kwargs):
+  # Popen + communicate, returns (exit code, stdout). After 'timeout' seconds the command is killed
+  if input is not None:
+    kwargs['stdin'] = subprocess.PIPE
+  kwargs.setdefault('stdout', subprocess.PIPE)
+  with span(os.path.basename(argv[0]), 'command', argv=list(argv)) as s:
+    process = subprocess.Popen(argv, **kwargs)
+    timer = None
+    if timeout is not None:
+      timer = threading.Timer(timeout, _kill, (process,))
+      timer.start()
+    try:
+      output, err = process.communicate(input)
+    finally:
+      if timer is not None:
+        timer.cancel()
+    s.set(exit_code=process.returncode)
+    if timer is not None and process.returncode < 0:
+      s.set(timed_out=True)
+  return process.returncode, output
+
+def _kill(process):
+  try:
+    process.kill()
+  except OSError:
+    pass      # Already gone
+
+
+def summary(events):
+  # {module: {'wall': s, 'cpu': s, 'commands': n, 'command_wall': s}} from the phase and command spans
+  modules = {}
+  for event in events:
+    totals = modules.setdefault(event['cat'], {'wall': 0.0, 'cpu': 0.0, 'commands': 0, 'command_wall': 0.0})
+    if event['args']['kind'] == 'phase':
+      totals['wall'] += event['dur'] / 1000000.0
+      totals['cpu'] += event['args']['cpu_ms'] / 1000.0
+    elif event['args']['kind'] == 'command':
+      totals['commands'] += 1
+      totals['command_wall'] += event['dur'] / 1000000.0
+  return modules
+
+def load(path=None):
+  # The events of a trace file written by flush(), TRACE_FILE by default
+  f = open(path or TRACE_FILE, 'r')
+  try:
+    text = f.read().strip()
+  finally:
+    f.close()
+  if not text:
+    return []
+  return json.loads(text.rstrip(',')+'\n]')
+
+def flush(log=None):
+  # Append the spans recorded so far to the trace file and log a per module summary
+  global _events
+  _lock.acquire()
+  try:
+    events = _events
+    _events = []
+  finally:
+    _lock.release()
+  if not events:
+    return
+
+  try:
+    f = open(TRACE_FILE, 'a')
+    if f.tell() == 0:
+      f.write('[\n')
+    for event in events:
+      f.write(json.dumps(event, sort_keys=True)+',\n')
+    f.close()
+  except IOError, e:
+    print 'Could not write the trace to '+TRACE_FILE+': '+str(e)
+
+  if log is not None:
+    modules = summary(events)
+    for name in sorted(modules.keys()):
+      totals = modules[name]
+      log.info('%s: %.2fs wall, %.2fs cpu in phases, %d commands taking %.2fs' %
+               (name, totals['wall'], totals['cpu'], totals['commands'], totals['command_wall']))
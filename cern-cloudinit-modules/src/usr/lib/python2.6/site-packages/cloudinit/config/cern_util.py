@@ -0,0 +1,114 @@
+#################################################################################
+# Helpers shared by the CERN cloud config modules (condor, cvmfs and ganglia).	#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import cloudinit.config.cern_trace as cern_trace
+import os
+import socket
+import subprocess
+import tempfile
+import threading
+import time
+import urllib2
+
+# Used to start detached processes
+SH_cmd = '/bin/sh'
+
+
+def write_atomic(path, content, mode=0644):
+  # Write next to the destination and rename over it, so readers never see a half written file
+  with cern_trace.span('write', path=path, bytes=len(content)):
+    _write_atomic(path, content, mode)
+
+def _write_atomic(path, content, mode):
+  fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.'+os.path.basename(path))
+  try:
+    f = os.fdopen(fd, 'w')
+    f.write(content)
+    f.flush()
+    os.fsync(f.fileno())
+    f.close()
+    os.chmod(tmp_path, mode)
+    os.rename(tmp_path, path)
+  except:
+    os.unlink(tmp_path)
+    raise
+
+def read_file(path, default=None):
+  try:
+    f = open(path, 'r')
+  except IOError:
+    return default
+  try:
+    return f.read()
+  finally:
+    f.close()
+
+def concurrently(function, items, deadline):
+  # Call function(item) for every item in its own thread and wait at most 'deadline' seconds for all of them.
+  # Returns {item: result} without the items that raised or did not finish in time. The threads are
+  # daemons, so a straggler does not hold up the boot
+  results = {}
+  lock = threading.Lock()
+  module = cern_trace.get_module()
+
+  def worker(item):
+    cern_trace.set_module(module)
+    try:
+      result = function(item)
+    except Exception:
+      return
+    lock.acquire()
+    try:
+      results[item] = result
+    finally:
+      lock.release()
+
+  threads = []
+  for item in items:
+    thread = threading.Thread(target=worker, args=(item,))
+    thread.setDaemon(True)
+    thread.start()
+    threads.append(thread)
+  end = time.time() + deadline
+  for thread in threads:
+    thread.join(max(0, end - time.time()))
+  lock.acquire()
+  try:
+    return dict(results)
+  finally:
+    lock.release()
+
+def connect_ms(host, port, timeout):
+  # Time to open a TCP connection, in milliseconds. Raises socket.error if the port can not be reached
+  start = time.time()
+  connection = socket.create_connection((host, int(port)), timeout)
+  elapsed = (time.time() - start) * 1000
+  connection.close()
+  return elapsed
+
+def timed_get(url, timeout, proxy=None):
+  # GET url, through 'proxy' or directly. Returns the milliseconds it took and the body
+  if proxy:
+    opener = urllib2.build_opener(urllib2.ProxyHandler({'http': proxy}))
+  else:
+    opener = urllib2.build_opener(urllib2.ProxyHandler({}))
+  start = time.time()
+  response = opener.open(url, timeout=timeout)
+  try:
+    body = response.read()
+  finally:
+    response.close()
+  return (time.time() - start) * 1000, body
+
+def spawn_detached(argv, output):
+  # Start argv in a session of its own, reparented to init, with its output appended to 'output'.
+  # Returns as soon as it is started: the process outlives the module that spawned it
+  out = open(output, 'a')
+  try:
+    return cern_trace.call([SH_cmd, '-c', '"$@" </dev/null &', 'sh'] + list(argv),
+                           stdout=out, stderr=subprocess.STDOUT, preexec_fn=os.setsid, close_fds=True)
+  finally:
+    out.close()
@@ -0,0 +1,233 @@
+#################################################################################
+# gmond python module with the condor startd state of a worker node: slots	#
+# per state, busy slots, seconds from boot to the first claimed slot and a	#
+# histogram of the job start latency (claimed -> busy). Written for the CERN	#
+# cloud-init modules: cc_ganglia enables it (conf.d/cern_condor.pyconf) when	#
+# a condor workernode is configured. Nothing is forked and the collector is	#
+# never queried: the startd's StartLog is tailed from where the last sample	#
+# stopped, following its rotation to StartLog.old.				#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import os
+import re
+import threading
+import time
+
+START_LOG = '/var/log/condor/StartLog'
+PROC_STAT = '/proc/stat'
+
+DEFAULT_SAMPLE_SECONDS = 20
+
+STATES = ('owner', 'unclaimed', 'matched', 'claimed', 'preempting', 'backfill', 'drained')
+# Upper bounds (seconds) of the start latency buckets, the last one taking the rest
+LATENCY_BUCKETS = (1, 5, 30, 120)
+
+# '10/17/26 06:44:37 slot1_1: Changing state and activity: Claimed/Idle -> Claimed/Busy'
+_TRANSITION = re.compile(r'^(\d+/\d+/\d+ \d+:\d+:\d+)\s+(?:\(.*?\)\s+)?(slot[0-9_]+): '
+                         r'Changing (state and activity|state|activity): (\w+)(?:/(\w+))? -> (\w+)(?:/(\w+))?')
+
+_lock = threading.Lock()
+_params = {}
+_slots = {}           # {slot: [state, activity]}
+_claimed_at = {}      # {slot: time the slot was claimed and idle}
+_latencies = []       # Start latencies since the last sample
+_sample = {}
+_log = {'inode': None, 'offset': 0, 'partial': ''}
+_first_claim = None
+_sampled = 0
+_booted = None        # The StartLog lines from before the boot are about an earlier one and are skipped
+_started = 0          # Start latencies from before the module started are history, not new jobs
+
+
+def boot_time():
+  f = open(PROC_STAT, 'r')
+  try:
+    for line in f:
+      if line.startswith('btime '):
+        return int(line.split()[1])
+  finally:
+    f.close()
+  return None
+
+def parse_time(text):
+  # '10/17/26 06:44:37' in local time. Condor's DEBUG_TIME_FORMAT default
+  return time.mktime(time.strptime(text, '%m/%d/%y %H:%M:%S'))
+
+def transition(line):
+  # Apply one StartLog line to the slot states
+  global _first_claim
+  match = _TRANSITION.match(line)
+  if match is None:
+    return
+  stamp, slot, what, old_first, old_second, new_first, new_second = match.groups()
+  when = parse_time(stamp)
+  if _booted is not None and when < _booted:
+    return
+  current = _slots.setdefault(slot, [None, None])
+  if what == 'state and activity':
+    current[0], current[1] = new_first, new_second
+  elif what == 'state':
+    current[0] = new_first
+  else:
+    current[1] = new_first
+  if current[0] == 'Delete':
+    del _slots[slot]
+    _claimed_at.pop(slot, None)
+    return
+
+  if current[0] == 'Claimed' and current[1] == 'Idle':
+    _claimed_at[slot] = when
+    if _first_claim is None:
+      _first_claim = when
+  elif current[0] == 'Claimed' and current[1] == 'Busy' and slot in _claimed_at:
+    claimed = _claimed_at.pop(slot)
+    if when >= _started:
+      _latencies.append(when - claimed)
+
+def tail():
+  # Feed the new StartLog lines to transition(). After a rotation, the rest of the old file is read first
+  path = _params.get('log', START_LOG)
+  try:
+    st = os.stat(path)
+  except OSError:
+    return
+  if _log['inode'] is not None and _log['inode'] != st.st_ino:
+    try:
+      if os.stat(path+'.old').st_ino == _log['inode']:
+        f = open(path+'.old', 'r')
+        try:
+          f.seek(_log['offset'])
+          data = _log['partial'] + f.read()
+        finally:
+          f.close()
+        for line in data.splitlines():
+          transition(line)
+    except (IOError, OSError):
+      pass
+    _log['offset'] = 0
+    _log['partial'] = ''
+  elif st.st_size < _log['offset']:
+    _log['offset'] = 0      # Truncated
+    _log['partial'] = ''
+  _log['inode'] = st.st_ino
+
+  f = open(path, 'r')
+  try:
+    f.seek(_log['offset'])
+    data = f.read()
+  finally:
+    f.close()
+  _log['offset'] += len(data)
+  data = _log['partial'] + data
+  end = data.rfind('\n') + 1
+  _log['partial'] = data[end:]
+  for line in data[:end].splitlines():
+    transition(line)
+
+def sample():
+  # Reused by the callbacks until it is 'sample_seconds' old
+  global _sampled, _latencies
+  now = time.time()
+  if now - _sampled < float(_params.get('sample_seconds', DEFAULT_SAMPLE_SECONDS)):
+    return
+  _sampled = now
+  try:
+    tail()
+  except (IOError, OSError):
+    pass
+
+  values = {}
+  for state in STATES:
+    values['condor_slots_'+state] = 0
+  values['condor_slots_busy'] = 0
+  for state, activity in _slots.values():
+    if state and 'condor_slots_'+state.lower() in values:
+      values['condor_slots_'+state.lower()] += 1
+    if state == 'Claimed' and activity == 'Busy':
+      values['condor_slots_busy'] += 1
+
+  bounds = list(LATENCY_BUCKETS) + [None]
+  for bound in bounds:
+    values[bucket_name(bound)] = 0
+  for latency in _latencies:
+    for bound in bounds:
+      if bound is None or latency <= bound:
+        values[bucket_name(bound)] += 1
+        break
+  values['condor_start_latency_max'] = max([0] + _latencies)
+  _latencies = []
+
+  values['condor_first_claim_after_boot'] = 0
+  if _first_claim is not None and _booted is not None:
+    values['condor_first_claim_after_boot'] = max(0, int(_first_claim - _booted))
+  _sample.clear()
+  _sample.update(values)
+
+def bucket_name(bound):
+  # 'condor_start_latency_le_5', or 'condor_start_latency_gt_120' for the last bucket
+  if bound is None:
+    return 'condor_start_latency_gt_'+str(LATENCY_BUCKETS[-1])
+  return 'condor_start_latency_le_'+str(bound)
+
+def metric_handler(name):
+  _lock.acquire()
+  try:
+    sample()
+    return _sample.get(name, 0)
+  finally:
+    _lock.release()
+
+def metric_names():
+  # (name, units, value type, format, description)
+  names = [('condor_slots_'+state, 'slots', 'uint', '%u', 'Slots in the '+state.capitalize()+' state') for state in STATES]
+  names.append(('condor_slots_busy', 'slots', 'uint', '%u', 'Claimed slots running a job'))
+  for bound in list(LATENCY_BUCKETS) + [None]:
+    if bound is None:
+      description = 'Jobs started more than %ds after the claim, since the last sample' % LATENCY_BUCKETS[-1]
+    else:
+      description = 'Jobs started at most %ds after the claim, since the last sample' % bound
+    names.append((bucket_name(bound), 'jobs', 'uint', '%u', description))
+  names.append(('condor_start_latency_max', 's', 'float', '%.1f', 'Longest start latency since the last sample'))
+  names.append(('condor_first_claim_after_boot', 's', 'uint', '%u', 'Seconds from boot to the first claimed slot'))
+  return names
+
+def metric_init(params):
+  # params: log (the StartLog) and sample_seconds, from the pyconf
+  global _booted, _started
+  _params.clear()
+  _params.update(params)
+  try:
+    _booted = boot_time()
+  except IOError:
+    _booted = None
+  _started = time.time()
+  descriptors = []
+  for name, units, value_type, format, description in metric_names():
+    descriptors.append({'name': name,
+                        'call_back': metric_handler,
+                        'time_max': 90,
+                        'value_type': value_type,
+                        'units': units,
+                        'slope': 'both',
+                        'format': format,
+                        'description': description,
+                        'groups': 'condor'})
+  return descriptors
+
+def metric_cleanup():
+  pass
+
+if __name__ == '__main__':
+  # Prints the metrics like gmond would collect them: python cern_condor.py [StartLog]
+  import sys
+  params = {'sample_seconds': 0}
+  if len(sys.argv) > 1:
+    params['log'] = sys.argv[1]
+  descriptors = metric_init(params)
+  while True:
+    for descriptor in descriptors:
+      print '%s = %s %s' % (descriptor['name'], descriptor['format'] % descriptor['call_back'](descriptor['name']), descriptor['units'])
+    print
+    time.sleep(5)
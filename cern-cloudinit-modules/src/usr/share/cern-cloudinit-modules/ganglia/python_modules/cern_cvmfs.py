@@ -0,0 +1,212 @@
+#################################################################################
+# gmond python module with the cvmfs statistics of every mounted repository:	#
+# cache hit rate, cache use, download rate, I/O errors, proxy switches and the	#
+# mount time at contextualization. Written for the CERN cloud-init modules:	#
+# cc_ganglia enables it (conf.d/cern_cvmfs.pyconf) when cvmfs is configured.	#
+# Nothing is forked: the counters are extended attributes of the mount point	#
+# and the cache size comes from the cvmfs_io socket of the repository. The	#
+# repositories are sampled together, at most once every 'sample_seconds'.	#
+# Documentation in:								#
+# https://twiki.cern.ch/twiki/bin/view/LCG/CloudInit				#
+#################################################################################
+
+import ctypes
+import errno
+import json
+import os
+import socket
+import threading
+import time
+
+CVMFS_MOUNT_ROOT = '/cvmfs'
+PROC_MOUNTS = '/proc/mounts'
+READY_FILE = '/var/run/cern-cloudinit-cvmfs.ready'
+
+DEFAULT_CACHE_BASE = '/var/lib/cvmfs'
+DEFAULT_SAMPLE_SECONDS = 20
+SOCKET_TIMEOUT = 2
+
+# Metrics of each repository: name suffix, units, value type, format and description
+METRICS = (
+  ('hitrate', '%', 'float', '%.1f', 'Files opened from the cache, since the last sample'),
+  ('cache_used', 'MB', 'uint', '%u', 'Size of the cache'),
+  ('cache_fill', '%', 'float', '%.1f', 'Size of the cache, of CVMFS_QUOTA_LIMIT'),
+  ('rx', 'KB/s', 'float', '%.1f', 'Downloaded from the proxies or servers'),
+  ('nioerr', 'errors/s', 'float', '%.3f', 'I/O errors'),
+  ('proxy_switches', 'switches', 'uint', '%u', 'Changes of proxy since the module started'),
+  ('mount_ms', 'ms', 'uint', '%u', 'Time to mount the repository at contextualization'),
+)
+
+_lock = threading.Lock()
+_params = {}
+_samples = {}     # {repository: {metric: value}}
+_counters = {}    # {repository: (time, nopen, ndownload, rx, nioerr, proxy)}
+_switches = {}
+_sampled = 0
+_libc = None
+
+
+def metric_prefix(repository):
+  # 'atlas.cern.ch' -> 'cvmfs_atlas_cern_ch_'
+  return 'cvmfs_'+repository.replace('.', '_').replace('-', '_')+'_'
+
+def getxattr(path, name):
+  # The attribute as a string, None if it is not there. ctypes because python 2.6 has no os.getxattr
+  global _libc
+  if _libc is None:
+    _libc = ctypes.CDLL('libc.so.6', use_errno=True)
+  buf = ctypes.create_string_buffer(4096)
+  size = _libc.getxattr(path, name, buf, len(buf))
+  if size < 0:
+    if ctypes.get_errno() in (errno.ENODATA, errno.ENOTSUP, errno.ENOENT):
+      return None
+    raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+  return buf.raw[:size].strip('\0')
+
+def mounted():
+  # The cvmfs repositories that are mounted. Reading the mount point of the others would mount them through autofs
+  repositories = set()
+  f = open(PROC_MOUNTS, 'r')
+  try:
+    for line in f:
+      fields = line.split()
+      if len(fields) > 2 and fields[2] == 'fuse' and fields[1].startswith(CVMFS_MOUNT_ROOT+'/'):
+        repositories.add(fields[1][len(CVMFS_MOUNT_ROOT)+1:])
+  finally:
+    f.close()
+  return repositories
+
+def talk(repository, command):
+  # Same as 'cvmfs_talk -i repository command', without the fork
+  cache_base = _params.get('cache_base', DEFAULT_CACHE_BASE)
+  for path in (os.path.join(cache_base, 'shared', 'cvmfs_io.'+repository),
+               os.path.join(cache_base, repository, 'cvmfs_io.'+repository)):
+    if not os.path.exists(path):
+      continue
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(SOCKET_TIMEOUT)
+    try:
+      sock.connect(path)
+      sock.sendall(command)
+      chunks = []
+      while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+          break
+        chunks.append(chunk)
+      return ''.join(chunks)
+    finally:
+      sock.close()
+  return None
+
+def cache_used_mb(repository):
+  # 'Current cache size is 1234MB (1294073856 Bytes), pinned: ...'
+  answer = talk(repository, 'cache size')
+  if answer and '(' in answer:
+    return int(answer.split('(', 1)[1].split()[0]) / (1024 * 1024)
+  return None
+
+def mount_times():
+  try:
+    f = open(READY_FILE, 'r')
+    try:
+      results = json.loads(f.read())
+    finally:
+      f.close()
+  except (IOError, ValueError):
+    return {}
+  return dict([(repository, result.get('mount_ms')) for repository, result in results.items()])
+
+def sample_repository(repository, now, mount_ms):
+  root = os.path.join(CVMFS_MOUNT_ROOT, repository)
+  nopen = int(getxattr(root, 'user.nopen') or 0)
+  ndownload = int(getxattr(root, 'user.ndownload') or 0)
+  rx = int(getxattr(root, 'user.rx') or 0)
+  nioerr = int(getxattr(root, 'user.nioerr') or 0)
+  proxy = getxattr(root, 'user.proxy')
+
+  sample = {'hitrate': 100.0, 'rx': 0.0, 'nioerr': 0.0}
+  previous = _counters.get(repository)
+  if previous is not None and now > previous[0]:
+    seconds = now - previous[0]
+    opened = nopen - previous[1]
+    if opened > 0:
+      sample['hitrate'] = max(0.0, 100.0 * (opened - (ndownload - previous[2])) / opened)
+    sample['rx'] = max(0, rx - previous[3]) / seconds
+    sample['nioerr'] = max(0, nioerr - previous[4]) / seconds
+    if proxy != previous[5]:
+      _switches[repository] = _switches.get(repository, 0) + 1
+  _counters[repository] = (now, nopen, ndownload, rx, nioerr, proxy)
+  sample['proxy_switches'] = _switches.get(repository, 0)
+
+  used = cache_used_mb(repository)
+  if used is not None:
+    sample['cache_used'] = used
+    quota = int(_params.get('quota_limit', 0))
+    if quota:
+      sample['cache_fill'] = 100.0 * used / quota
+  if mount_ms.get(repository) is not None:
+    sample['mount_ms'] = mount_ms[repository]
+  return sample
+
+def sample():
+  # All the repositories at once, reused by the callbacks until it is 'sample_seconds' old
+  global _sampled
+  now = time.time()
+  if now - _sampled < float(_params.get('sample_seconds', DEFAULT_SAMPLE_SECONDS)):
+    return
+  _sampled = now
+  active = mounted()
+  mount_ms = mount_times()
+  for repository in _params['repositories']:
+    if repository not in active:
+      _samples[repository] = {}
+      continue
+    try:
+      _samples[repository] = sample_repository(repository, now, mount_ms)
+    except (IOError, OSError, socket.error, ValueError):
+      _samples[repository] = {}
+
+def metric_handler(name):
+  _lock.acquire()
+  try:
+    sample()
+    for repository in _params['repositories']:
+      prefix = metric_prefix(repository)
+      if name.startswith(prefix):
+        return _samples.get(repository, {}).get(name[len(prefix):], 0)
+    return 0
+  finally:
+    _lock.release()
+
+def metric_init(params):
+  # params: repositories (comma separated), cache_base, quota_limit (MB) and sample_seconds, from the pyconf
+  _params.clear()
+  _params.update(params)
+  _params['repositories'] = [name.strip() for name in params.get('repositories', '').split(',') if name.strip()]
+  descriptors = []
+  for repository in _params['repositories']:
+    for suffix, units, value_type, format, description in METRICS:
+      descriptors.append({'name': metric_prefix(repository)+suffix,
+                          'call_back': metric_handler,
+                          'time_max': 90,
+                          'value_type': value_type,
+                          'units': units,
+                          'slope': 'both',
+                          'format': format,
+                          'description': repository+': '+description,
+                          'groups': 'cvmfs'})
+  return descriptors
+
+def metric_cleanup():
+  pass
+
+if __name__ == '__main__':
+  # Prints the metrics like gmond would collect them: python cern_cvmfs.py atlas.cern.ch,cms.cern.ch
+  import sys
+  descriptors = metric_init({'repositories': sys.argv[1], 'sample_seconds': 0})
+  while True:
+    for descriptor in descriptors:
+      print '%s = %s %s' % (descriptor['name'], descriptor['format'] % descriptor['call_back'](descriptor['name']), descriptor['units'])
+    print
+    time.sleep(5)
@@ -0,0 +1,154 @@
+#################################################################################
+# Shared setup of the unit tests of the CERN cloud-init modules: the modules	#
+# are imported through the same cloudinit shim as the benchmark, and every	#
+# test gets its own sandbox root. Not part of the package. Run with		#
+#   cd cern-cloudinit-modules && python -m unittest discover -s tests		#
+#################################################################################
+
+import BaseHTTPServer
+import SocketServer
+import atexit
+import hashlib
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.path.join(os.path.dirname(TESTS_DIR), 'bench')
+
+sys.path.insert(0, BENCH_DIR)
+import bench_handlers
+
+_shim_root = tempfile.mkdtemp(prefix='test-cloudinit-')
+atexit.register(shutil.rmtree, _shim_root, True)
+sys.path.insert(0, bench_handlers.make_shim(_shim_root))
+
+
+class SandboxTestCase(unittest.TestCase):
+  # self.root is an empty directory; patch() changes a module attribute until the end of the test
+
+  def setUp(self):
+    self.root = tempfile.mkdtemp(prefix='test-cloudinit-')
+    self._patches = []
+    self._closers = []
+    self._servers = []
+    self.requests = []
+
+  def tearDown(self):
+    self.stop_serving()
+    for close in reversed(self._closers):
+      close()
+    for module, name, value in reversed(self._patches):
+      setattr(module, name, value)
+    shutil.rmtree(self.root, True)
+
+  def listen(self):
+    # Port of a local TCP listener. Connections complete in the backlog, nothing is ever accepted
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(16)
+    self._closers.append(sock.close)
+    return sock.getsockname()[1]
+
+  def closed_port(self):
+    # A local port nothing listens on
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+  def serve(self, files, delay=0):
+    # Base URL of a local HTTP server answering GET path with files[path] after 'delay' seconds, 404 otherwise.
+    # The answers carry an ETag (of the content) and a Last-Modified, and conditional requests are answered
+    # with 304. self.requests lists the (path, status, request headers) served
+    last_modified = 'Sat, 17 Oct 2026 06:00:00 GMT'
+    requests = self.requests
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+      def do_GET(self):
+        time.sleep(delay)
+        if self.path not in files:
+          requests.append((self.path, 404, self.headers))
+          self.send_error(404)
+          return
+        etag = '"'+hashlib.md5(files[self.path]).hexdigest()+'"'
+        if self.headers.getheader('If-None-Match') is not None:
+          modified = etag not in [tag.strip() for tag in self.headers.getheader('If-None-Match').split(',')]
+        else:
+          modified = self.headers.getheader('If-Modified-Since') != last_modified
+        requests.append((self.path, modified and 200 or 304, self.headers))
+        if not modified:
+          self.send_response(304)
+          self.send_header('ETag', etag)
+          self.end_headers()
+          return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(files[self.path])))
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', last_modified)
+        self.end_headers()
+        self.wfile.write(files[self.path])
+
+      def log_message(self, *args):
+        pass
+
+    class Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+      daemon_threads = True
+
+    server = Server(('127.0.0.1', 0), Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.setDaemon(True)
+    thread.start()
+    self._servers.append(server)
+    return 'http://127.0.0.1:'+str(server.server_address[1])
+
+  def stop_serving(self):
+    # Take the servers of serve() down: their ports refuse connections
+    while self._servers:
+      server = self._servers.pop()
+      server.shutdown()
+      server.server_close()
+
+  def patch(self, module, name, value):
+    self._patches.append((module, name, getattr(module, name)))
+    setattr(module, name, value)
+
+  def path(self, path):
+    return self.root+path
+
+  def write(self, path, content):
+    bench_handlers.write(self.path(path), content)
+    return self.path(path)
+
+  def read(self, path):
+    f = open(self.path(path), 'r')
+    try:
+      return f.read()
+    finally:
+      f.close()
+
+  def make_host(self, cores, memory_mb, numa_nodes=1):
+    # A synthetic /proc, /sys and /etc for cern_facts, with an empty facts cache
+    import cloudinit.config.cern_facts as facts
+    bench_handlers.make_proc(self.root, cores, memory_mb, numa_nodes)
+    for name in ('PROC', 'SYS', 'ETC', 'CACHE_FILE'):
+      self.patch(facts, name, self.path(getattr(facts, name)))
+    self.patch(facts, '_facts', None)
+
+  def stub(self, module, name):
+    # Replace the tool module.name by a stub that logs its command lines into self.commands()
+    path = self.path('/stubs/'+os.path.basename(getattr(module, name)))
+    bench_handlers.make_stub(path, self.path('/commands.log'))
+    self.patch(module, name, path)
+    return path
+
+  def commands(self):
+    if not os.path.exists(self.path('/commands.log')):
+      return []
+    return [line.split() for line in self.read('/commands.log').splitlines()]
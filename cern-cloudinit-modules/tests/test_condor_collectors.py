@@ -0,0 +1,38 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cc_condor as cc_condor
+
+
+class CollectorRankingTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cc_condor, 'CONDOR_STATUS_cmd', self.path('/usr/bin/condor_status'))
+
+  def test_parse(self):
+    self.assertEqual(cc_condor.parse_collectors('cm1', 20001), [('cm1', 20001)])
+    self.assertEqual(cc_condor.parse_collectors(['cm1', 'cm2:9618'], '20001'), [('cm1', 20001), ('cm2', 9618)])
+
+  def test_unreachable_last(self):
+    closed = [('127.0.0.1', self.closed_port()), ('127.0.0.1', self.closed_port())]
+    listening = [('127.0.0.1', self.listen()), ('127.0.0.1', self.listen())]
+    ranked = cc_condor.rank_collectors([closed[0], listening[0], closed[1], listening[1]], 2)
+    self.assertEqual(sorted(ranked[:2]), sorted(listening))
+    # The unreachable ones keep their order, as failover
+    self.assertEqual(ranked[2:], closed)
+
+  def test_answering_collector_first(self):
+    # condor_status only gets an answer from the collector on port 'good'
+    good = self.listen()
+    self.write('/usr/bin/condor_status', '#!/bin/sh\ncase "$2" in *:%d) echo collector ;; *) exit 1 ;; esac\n' % good)
+    os.chmod(self.path('/usr/bin/condor_status'), 0755)
+    closed = ('127.0.0.1', self.closed_port())
+    listening = ('127.0.0.1', self.listen())
+    ranked = cc_condor.rank_collectors([closed, listening, ('127.0.0.1', good)], 2)
+    self.assertEqual(ranked, [('127.0.0.1', good), listening, closed])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,65 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cc_condor as cc_condor
+
+CONFIG = '''# Written by cloud-init
+DAEMON_LIST = MASTER, STARTD
+CONDOR_HOST = cm.cern.ch
+UPDATE_INTERVAL = 300
+'''
+
+
+class ChangedKnobsTest(unittest.TestCase):
+
+  def test_changed(self):
+    new = CONFIG.replace('300', '600').replace('# Written', '#  Written') + 'START = False\n'
+    self.assertEqual(cc_condor.changed_knobs(CONFIG, new), ['START', 'UPDATE_INTERVAL'])
+    self.assertEqual(cc_condor.changed_knobs(CONFIG, CONFIG.replace(' = ', '=')), [])
+    self.assertEqual(cc_condor.changed_knobs(CONFIG, 'CONDOR_HOST = cm.cern.ch\n'), ['DAEMON_LIST', 'UPDATE_INTERVAL'])
+
+
+class ApplyConfigTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.stub(cc_condor, 'SERVICE_cmd')
+    self.stub(cc_condor, 'CONDOR_RECONFIG_cmd')
+    self.config = self.write('/etc/condor/config.d/10_cern.config', CONFIG)
+
+  def apply(self, content):
+    action = cc_condor.apply_config(self.config, content)
+    self.assertEqual(self.read('/etc/condor/config.d/10_cern.config'), content)
+    return action, [[os.path.basename(command[0])]+command[1:] for command in self.commands()]
+
+  def test_unchanged(self):
+    self.assertEqual(self.apply(CONFIG), ('unchanged', [['service', 'condor', 'status']]))
+
+  def test_reconfig(self):
+    self.assertEqual(self.apply(CONFIG.replace('300', '600')),
+                     ('reconfig', [['service', 'condor', 'status'], ['condor_reconfig']]))
+
+  def test_restart(self):
+    for content in (CONFIG.replace('MASTER, STARTD', 'MASTER, STARTD, SHARED_PORT'),
+                    CONFIG + 'COLLECTOR_PORT = 9619\n', CONFIG + 'NUM_SLOTS_TYPE_1 = 1\n',
+                    CONFIG + 'SLOT1_CPU_AFFINITY = 0,1\n', CONFIG + 'MEMORY = 2048\n'):
+      self.write('/etc/condor/config.d/10_cern.config', CONFIG)
+      self.write('/commands.log', '')
+      self.assertEqual(self.apply(content), ('restart', [['service', 'condor', 'status'],
+                                                         ['service', 'condor', 'restart']]))
+
+  def test_new_file(self):
+    os.unlink(self.config)
+    self.assertEqual(self.apply(CONFIG)[0], 'restart')
+
+  def test_start_when_stopped(self):
+    # 'service condor status' fails while condor is stopped: the new configuration is read when it starts
+    self.write('/stubs/service', '#!/bin/sh\necho "$0 $*" >> "%s"\n[ "$2" != status ]\n' % self.path('/commands.log'))
+    for content in (CONFIG, CONFIG.replace('300', '600'), CONFIG + 'MEMORY = 2048\n'):
+      self.write('/commands.log', '')
+      self.assertEqual(self.apply(content), ('start', [['service', 'condor', 'status'], ['service', 'condor', 'start']]))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,134 @@
+import os
+import support
+import threading
+import time
+import unittest
+
+import cloudinit.config.cc_condor as cc_condor
+import cloudinit.config.cc_cvmfs as cc_cvmfs
+import cloudinit.config.cern_phases as cern_phases
+
+
+def phase(phases, name):
+  return [p for p in phases if p.name == name][0]
+
+
+class CvmfsDependencyTest(unittest.TestCase):
+
+  def test_only_workernodes_wait(self):
+    config = phase(cc_condor.phases({'condor': {'workernode': {}}, 'cvmfs': {}}, None), 'condor.config')
+    self.assertEqual(config.waits, ('cvmfs.ready',))
+    self.assertTrue('cvmfs.ready' not in config.after)
+    config = phase(cc_condor.phases({'condor': {'master': {}}, 'cvmfs': {}}, None), 'condor.config')
+    self.assertEqual(config.waits, ())
+    self.assertTrue('cvmfs.ready' not in config.after)
+
+  def test_waits_survive_failures(self):
+    ran = []
+
+    def fail():
+      ran.append('start')
+      raise RuntimeError('cvmfs_config reload failed')
+    phases = [cern_phases.Phase('cvmfs.start', fail),
+              cern_phases.Phase('cvmfs.ready', lambda: ran.append('ready'), waits=('cvmfs.start',)),
+              cern_phases.Phase('cvmfs.prefetch', lambda: ran.append('prefetch'), after=('cvmfs.start',)),
+              cern_phases.Phase('condor.config', lambda: ran.append('config'), waits=('cvmfs.ready',))]
+    self.assertRaises(RuntimeError, cern_phases.run, phases, 2)
+    self.assertEqual(ran, ['start', 'ready', 'config'])
+
+
+class StartAgainTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cc_cvmfs, 'CVMFS_MOUNT_ROOT', self.path('/cvmfs'))
+    self.patch(cc_cvmfs, 'READY_FILE', self.path('/var/run/cern-cloudinit-cvmfs.ready'))
+    self.patch(cc_condor, 'CONDOR_CONFIG_LOCAL', self.path('/etc/condor/condor_config.local'))
+    self.patch(cc_condor, 'START_CRON', self.path('/etc/cron.d/cern-cloudinit-condor-start'))
+    self.stub(cc_condor, 'SERVICE_cmd')
+    self.stub(cc_condor, 'CONDOR_RECONFIG_cmd')
+    self.addCleanup(cc_cvmfs.clear_ready)
+    self.write('/var/run/.keep', '')
+
+  def test_stale_marker_is_removed(self):
+    self.write('/var/run/cern-cloudinit-cvmfs.ready', '{}\n')
+    self.assertTrue(cc_cvmfs.wait_ready(0))
+    cc_cvmfs.phases({'cvmfs': {}}, None)
+    self.assertFalse(os.path.exists(cc_cvmfs.READY_FILE))
+    self.assertFalse(cc_cvmfs.wait_ready(0))
+
+  def test_cron(self):
+    cron = cc_condor.start_cron('atlas.cern.ch', 'TARGET.Memory > 100%')
+    self.assertTrue(cron.splitlines()[1].startswith('* * * * * root '))
+    self.assertTrue("start_when_ready('atlas.cern.ch', 'TARGET.Memory > 100\\%')" in cron)
+
+  def test_start_when_ready(self):
+    self.write('/etc/condor/condor_config.local', 'CONDOR_HOST = cm\nSTART = False\nSUSPEND = False\n')
+    self.write('/etc/cron.d/cern-cloudinit-condor-start', cc_condor.start_cron('atlas.cern.ch', 'True'))
+
+    self.assertFalse(cc_condor.start_when_ready('atlas.cern.ch', 'True'))
+    self.assertEqual(self.read('/etc/condor/condor_config.local'), 'CONDOR_HOST = cm\nSTART = False\nSUSPEND = False\n')
+    self.assertTrue(os.path.exists(cc_condor.START_CRON))
+
+    os.makedirs(self.path('/cvmfs/atlas.cern.ch'))
+    self.assertTrue(cc_condor.start_when_ready('atlas.cern.ch', 'True'))
+    self.assertEqual(self.read('/etc/condor/condor_config.local'), 'CONDOR_HOST = cm\nSTART = True\nSUSPEND = False\n')
+    self.assertFalse(os.path.exists(cc_condor.START_CRON))
+    self.assertEqual(self.commands()[-1], [cc_condor.CONDOR_RECONFIG_cmd])
+
+
+class WaitTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.make_host(4, 8192)
+    for name in ('_scheduled', '_checked', '_ready'):
+      self.patch(cc_cvmfs, name, threading.Event())
+    self.patch(cc_cvmfs, 'CVMFS_MOUNT_ROOT', self.path('/cvmfs'))
+    self.patch(cc_cvmfs, 'READY_FILE', self.path('/var/run/cern-cloudinit-cvmfs.ready'))
+    self.patch(cc_condor, 'CONDOR_CONFIG_LOCAL', self.path('/etc/condor/condor_config.local'))
+    self.patch(cc_condor, 'START_CRON', self.path('/etc/cron.d/cern-cloudinit-condor-start'))
+    self.stub(cc_condor, 'SERVICE_cmd')
+    self.stub(cc_condor, 'CONDOR_RECONFIG_cmd')
+    self.write('/var/run/.keep', '')
+    self.write('/etc/cron.d/.keep', '')
+    self.write('/etc/condor/.keep', '')
+    self.cfg = {'condor': {'workernode': {'condor-host': 'cm.cern.ch'}},
+                'cvmfs': {'local': {'repositories': 'atlas.cern.ch'}}}
+
+  def configure(self):
+    # Seconds condor.config took, and the START of the configuration installed by condor.service
+    phases = cc_condor.phases(self.cfg, None)
+    started = time.time()
+    phase(phases, 'condor.config').run()
+    seconds = time.time() - started
+    phase(phases, 'condor.service').run()
+    return seconds, cc_condor.read_knobs(self.read('/etc/condor/condor_config.local'))['START']
+
+  def test_cvmfs_later(self):
+    # cc_condor runs before cc_cvmfs: nothing to wait for
+    seconds, start = self.configure()
+    self.assertTrue(seconds < 5)
+    self.assertEqual(start, 'False')
+    self.assertTrue('atlas.cern.ch' in self.read('/etc/cron.d/cern-cloudinit-condor-start'))
+
+  def test_cvmfs_earlier(self):
+    os.makedirs(self.path('/cvmfs/atlas.cern.ch'))
+    cc_cvmfs.check_ready(self.cfg['cvmfs'])
+    self.assertEqual(self.configure()[1], 'True')
+    self.assertFalse(os.path.exists(cc_condor.START_CRON))
+
+  def test_same_run(self):
+    # The check of the same run is waited for
+    cc_cvmfs.phases(self.cfg, None)
+    os.makedirs(self.path('/cvmfs/atlas.cern.ch'))
+    timer = threading.Timer(0.5, cc_cvmfs.check_ready, (self.cfg['cvmfs'],))
+    timer.start()
+    self.addCleanup(timer.join)
+    seconds, start = self.configure()
+    self.assertTrue(seconds >= 0.4)
+    self.assertEqual(start, 'True')
+
+
+if __name__ == '__main__':
+  unittest.main()
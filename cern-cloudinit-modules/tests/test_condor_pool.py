@@ -0,0 +1,64 @@
+import support
+import unittest
+
+import cloudinit.config.cc_condor as cc_condor
+
+
+def render(table, condor_cfg):
+  if table is cc_condor.MASTER_PARAMS:
+    defaults = cc_condor.MASTER_DEFAULTS
+  else:
+    defaults = cc_condor.WORKERNODE_DEFAULTS
+  return cc_condor.read_knobs(''.join(cc_condor.render_tuned(table, condor_cfg, defaults)))
+
+def daemons(knobs):
+  return [daemon.strip() for daemon in knobs['DAEMON_LIST'].split(',')]
+
+
+class PoolSizeTest(unittest.TestCase):
+
+  def test_master_tiers(self):
+    for size, slots in cc_condor.POOL_SIZES:
+      knobs = render(cc_condor.MASTER_PARAMS, {'pool-size': size})
+      for knob, value in cc_condor.POOL_MASTER_KNOBS[size].items():
+        self.assertEqual(knobs[knob], str(value))
+      interval = cc_condor.POOL_WORKER_KNOBS[size]['UPDATE_INTERVAL']
+      self.assertEqual(knobs['CLASSAD_LIFETIME'], str(3 * interval))
+      self.assertEqual(knobs['MAX_JOBS_RUNNING'], str(slots))
+      self.assertEqual(knobs['MAX_FILE_DESCRIPTORS'], str(max(cc_condor.MIN_FILE_DESCRIPTORS, 2 * slots)))
+      self.assertEqual(knobs['COLLECTOR_MAX_FILE_DESCRIPTORS'], knobs['MAX_FILE_DESCRIPTORS'])
+      self.assertEqual('SHARED_PORT' in daemons(knobs), 'USE_SHARED_PORT' in knobs)
+
+  def test_workernode_tiers(self):
+    for size, slots in cc_condor.POOL_SIZES:
+      knobs = render(cc_condor.WORKERNODE_PARAMS, {'pool-size': size})
+      for knob, value in cc_condor.POOL_WORKER_KNOBS[size].items():
+        self.assertEqual(knobs[knob], str(value))
+      self.assertTrue('MAX_JOBS_RUNNING' not in knobs)
+      self.assertEqual('SHARED_PORT' in daemons(knobs), 'USE_SHARED_PORT' in knobs)
+
+  def test_expected_slots(self):
+    self.assertEqual(cc_condor.pool_size({'expected-slots': 1000}), ('small', 1000))
+    self.assertEqual(cc_condor.pool_size({'expected-slots': 1001}), ('medium', 1001))
+    self.assertEqual(cc_condor.pool_size({'expected-slots': 500000}), ('xlarge', 500000))
+    self.assertEqual(render(cc_condor.MASTER_PARAMS, {'expected-slots': 12000})['MAX_JOBS_RUNNING'], '12000')
+
+  def test_no_tier(self):
+    self.assertEqual(render(cc_condor.MASTER_PARAMS, {})['DAEMON_LIST'], cc_condor.MASTER_DEFAULTS['DAEMON_LIST'])
+    self.assertEqual(cc_condor.pool_knobs(cc_condor.MASTER_PARAMS, {'pool-size': 'huge'}), {})
+
+  def test_explicit_knobs_win(self):
+    knobs = render(cc_condor.WORKERNODE_PARAMS, {'pool-size': 'large', 'update-collector-with-tcp': 'False'})
+    self.assertEqual(knobs['UPDATE_COLLECTOR_WITH_TCP'], 'False')
+
+  def test_shared_port_with_own_daemon_list(self):
+    knobs = render(cc_condor.WORKERNODE_PARAMS, {'pool-size': 'large', 'daemon-list': 'MASTER, STARTD, STARTD_CRON'})
+    self.assertEqual(daemons(knobs), ['MASTER', 'STARTD', 'STARTD_CRON', 'SHARED_PORT'])
+    knobs = render(cc_condor.MASTER_PARAMS, {'pool-size': 'xlarge', 'daemon-list': 'MASTER SHARED_PORT COLLECTOR'})
+    self.assertEqual(knobs['DAEMON_LIST'], 'MASTER SHARED_PORT COLLECTOR')
+    knobs = render(cc_condor.MASTER_PARAMS, {'pool-size': 'small', 'daemon-list': 'MASTER, COLLECTOR'})
+    self.assertEqual(knobs['DAEMON_LIST'], 'MASTER, COLLECTOR')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,106 @@
+import support
+import unittest
+
+import cloudinit.config.cc_condor as cc_condor
+import cloudinit.config.cern_facts as facts
+
+
+def knobs(lines):
+  return cc_condor.read_knobs(''.join(lines))
+
+def slot_types(knobs):
+  # {type: {'cpus': ..., 'memory': ...}} of the SLOT_TYPE_n knobs that are not '100%'
+  types = {}
+  for knob, value in knobs.items():
+    if knob.startswith('SLOT_TYPE_') and knob[len('SLOT_TYPE_'):].isdigit() and '=' in value:
+      types[int(knob[len('SLOT_TYPE_'):])] = dict([item.strip().split('=') for item in value.split(',')])
+  return types
+
+
+class SlotLayoutTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(facts, 'free_disk_mb', lambda path: 100000)
+
+  def layout(self, condor_cfg, cores=8, memory_mb=16384, numa_nodes=1):
+    self.make_host(cores, memory_mb, numa_nodes)
+    lines, slots = cc_condor.slot_layout(condor_cfg)
+    return knobs(lines), slots
+
+  def test_default(self):
+    result, slots = self.layout({})
+    self.assertEqual(result, {})
+    self.assertEqual(slots, [str(n) for n in range(1, 9)])
+
+  def test_static(self):
+    result, slots = self.layout({'slot-layout': 'static', 'reserved-cpus': 2, 'reserved-memory': 2048, 'reserved-disk': 1000})
+    self.assertEqual(result['NUM_CPUS'], '6')
+    self.assertEqual(result['MEMORY'], '14336')
+    self.assertEqual(result['DISK'], str(99000 * 1024))
+    self.assertEqual(result['SLOT_TYPE_1'], 'cpus=1')
+    self.assertEqual(result['NUM_SLOTS_TYPE_1'], '6')
+    self.assertEqual(slots, ['1', '2', '3', '4', '5', '6'])
+
+  def test_partitionable(self):
+    result, slots = self.layout({'slot-layout': 'partitionable', 'reserved-cpus': 1})
+    self.assertEqual(result['NUM_CPUS'], '7')
+    self.assertEqual(result['SLOT_TYPE_1'], '100%')
+    self.assertEqual(result['SLOT_TYPE_1_PARTITIONABLE'], 'True')
+    self.assertEqual(result['NUM_SLOTS_TYPE_1'], '1')
+    self.assertEqual(slots, ['1_'+str(n) for n in range(1, 8)])
+
+  def test_mixed_memory_adds_up(self):
+    result, slots = self.layout({'slot-layout': 'mixed', 'reserved-cpus': 1, 'reserved-memory': 1000, 'static-slots': 3})
+    types = slot_types(result)
+    self.assertEqual(result['NUM_SLOTS_TYPE_1'], '3')
+    self.assertEqual(result['SLOT_TYPE_2_PARTITIONABLE'], 'True')
+    self.assertEqual(int(types[1]['cpus']) * 3 + int(types[2]['cpus']), 7)
+    self.assertEqual(int(types[1]['memory']) * 3 + int(types[2]['memory']), int(result['MEMORY']))
+    self.assertEqual(slots, ['1', '2', '3', '4_1', '4_2', '4_3', '4_4'])
+
+  def test_mixed_pinned_to_numa_nodes(self):
+    result, slots = self.layout({'slot-layout': 'mixed', 'cpu-affinity': True, 'static-slots': 3, 'reserved-cpus': 2,
+                                 'reserved-memory': 1024},
+                                cores=16, memory_mb=32768, numa_nodes=2)
+    types = slot_types(result)
+    static = int(result['NUM_SLOTS_TYPE_1'])
+    self.assertEqual(static, 3)
+    # One partitionable slot per NUMA node after the static ones, their memory adding up to MEMORY
+    self.assertEqual(sorted(types.keys()), [1, 2, 3])
+    self.assertEqual(int(types[1]['memory']) * static + int(types[2]['memory']) + int(types[3]['memory']),
+                     int(result['MEMORY']))
+    self.assertEqual(result['ENFORCE_CPU_AFFINITY'], 'True')
+
+    # Every CPU but the reserved ones is used exactly once, and no slot spans two NUMA nodes
+    nodes = facts.get('numa_nodes')
+    reserved = sum(nodes, [])[:2]
+    pinned = []
+    for n in range(1, static + 3):
+      cpus = [int(cpu) for cpu in result['SLOT'+str(n)+'_CPU_AFFINITY'].split(',')]
+      self.assertEqual(len([node for node in nodes if set(cpus) & set(node)]), 1)
+      pinned.extend(cpus)
+    self.assertEqual(sorted(pinned), sorted([cpu for cpu in range(16) if cpu not in reserved]))
+    self.assertEqual(result['BASE_CGROUP'], cc_condor.CONDOR_CGROUP)
+    self.assertEqual(len(slots), 14)
+
+
+class NumaCpuSetsTest(support.SandboxTestCase):
+
+  def test_single_node(self):
+    self.make_host(8, 16384, 1)
+    self.assertEqual(cc_condor.numa_cpu_sets(8), None)
+
+  def test_reserved_cpus(self):
+    self.make_host(8, 16384, 2)
+    nodes = facts.get('numa_nodes')
+    self.assertEqual(nodes, [[0, 4, 1, 5], [2, 6, 3, 7]])
+    self.assertEqual(cc_condor.numa_cpu_sets(6, 2), [[1, 5], [2, 6, 3, 7]])
+
+  def test_topology_mismatch(self):
+    self.make_host(8, 16384, 2)
+    self.assertEqual(cc_condor.numa_cpu_sets(4), None)
+
+
+if __name__ == '__main__':
+  unittest.main()
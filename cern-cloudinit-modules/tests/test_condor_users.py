@@ -0,0 +1,72 @@
+import os
+import subprocess
+import support
+import unittest
+
+import cloudinit.config.cc_condor as cc_condor
+
+# newusers saves its batch and exits with 'code', useradd fails for the account 'fail'
+NEWUSERS = '''#!/bin/sh
+echo "$0 $*" >> "%(root)s/commands.log"
+cat > "%(root)s/newusers.in"
+exit %(code)d
+'''
+USERADD = '''#!/bin/sh
+echo "$0 $*" >> "%(root)s/commands.log"
+[ "$4" != "%(fail)s" ]
+'''
+
+
+class SlotUsersTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cc_condor, 'SKEL_DIR', self.path('/etc/skel'))
+    self.users = set(['user2'])
+    self.patch(cc_condor, 'user_exists', lambda name: name in self.users)
+    self.newusers(0)
+    self.useradd(None)
+
+  def newusers(self, code):
+    self.patch(cc_condor, 'NEWUSERS_cmd', self.write('/stubs/newusers', NEWUSERS % {'root': self.root, 'code': code}))
+    os.chmod(cc_condor.NEWUSERS_cmd, 0755)
+
+  def useradd(self, fail):
+    self.patch(cc_condor, 'USERADD_cmd', self.write('/stubs/useradd', USERADD % {'root': self.root, 'fail': fail}))
+    os.chmod(cc_condor.USERADD_cmd, 0755)
+
+  def test_batch(self):
+    lines = cc_condor.provision_slot_users(['1', '2_1', '2_2'], pool=4)
+    self.assertEqual(lines, ['SLOT1_USER = user1\n', 'SLOT2_1_USER = user2\n', 'SLOT2_2_USER = user3\n'])
+    self.assertEqual(self.commands(), [[cc_condor.NEWUSERS_cmd, '-c', 'NONE']])
+    self.assertEqual(self.read('/newusers.in'), 'user1:!!::::/home/user1:/sbin/nologin\n'
+                                                'user3:!!::::/home/user3:/sbin/nologin\n'
+                                                'user4:!!::::/home/user4:/sbin/nologin\n')
+
+  def test_nothing_missing(self):
+    self.users.update(['user1', 'user3'])
+    self.assertEqual(len(cc_condor.provision_slot_users(['1', '2', '3'])), 3)
+    self.assertEqual(self.commands(), [])
+
+  def test_useradd_fallback(self):
+    # newusers created user1 before failing: only the other accounts are added with useradd
+    self.newusers(1)
+    self.users.add('user1')
+    cc_condor.create_users(['user1', 'user3', 'user4'])
+    self.assertEqual(self.commands()[1:], [[cc_condor.USERADD_cmd, '-m', '-s', '/sbin/nologin', 'user3'],
+                                           [cc_condor.USERADD_cmd, '-m', '-s', '/sbin/nologin', 'user4']])
+
+  def test_useradd_failure(self):
+    self.newusers(1)
+    self.useradd('user3')
+    try:
+      cc_condor.create_users(['user3', 'user4'])
+    except subprocess.CalledProcessError, e:
+      self.assertTrue(e.cmd.endswith(' user3'))
+    else:
+      self.fail('no error for the account useradd could not create')
+    self.assertEqual(len(self.commands()), 3)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,108 @@
+import json
+import os
+import support
+import unittest
+
+import cloudinit.config.cc_cvmfs as cc_cvmfs
+import cloudinit.config.cern_prefetch as cern_prefetch
+import cloudinit.config.cern_util as cern_util
+
+
+class PrefetchTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    # A repository of 2 directories with 5 files of 100 KB each, and a loose file
+    for directory in ('sw/a', 'sw/b'):
+      for n in range(5):
+        self.write('/cvmfs/atlas.cern.ch/'+directory+'/f%d' % n, 'x' * 100 * 1024)
+    self.write('/cvmfs/atlas.cern.ch/setup.sh', 'echo\n')
+    self.mount = self.path('/cvmfs')
+
+  def test_read_manifest(self):
+    path = self.write('/manifest', '# warm these\natlas.cern.ch/sw/a\n\n  atlas.cern.ch/setup.sh  # login\n')
+    self.assertEqual(cern_prefetch.read_manifest(path), ['atlas.cern.ch/sw/a', 'atlas.cern.ch/setup.sh'])
+
+  def test_files_below(self):
+    files = list(cern_prefetch.files_below(self.mount, ['/atlas.cern.ch/sw', 'atlas.cern.ch/setup.sh']))
+    self.assertEqual(len(files), 11)
+    self.assertEqual(files[0], os.path.join(self.mount, 'atlas.cern.ch/sw/a/f0'))
+    self.assertEqual(files[-1], os.path.join(self.mount, 'atlas.cern.ch/setup.sh'))
+
+  def test_everything(self):
+    report = cern_prefetch.prefetch(self.mount, ['atlas.cern.ch'], threads=3)
+    self.assertEqual(report['files'], 11)
+    self.assertEqual(report['bytes'], 10 * 100 * 1024 + 5)
+    self.assertEqual((report['errors'], report['stopped']), (0, None))
+
+  def test_budget(self):
+    report = cern_prefetch.prefetch(self.mount, ['atlas.cern.ch/sw'], threads=1, budget=250 * 1024)
+    self.assertEqual(report['stopped'], 'budget')
+    self.assertTrue(250 * 1024 <= report['bytes'] < 400 * 1024)
+    self.assertTrue(report['files'] < 10)
+
+  def test_deadline(self):
+    report = cern_prefetch.prefetch(self.mount, ['atlas.cern.ch'], threads=2, deadline=0)
+    self.assertEqual(report['stopped'], 'deadline')
+    self.assertTrue(report['files'] < 11)
+
+  def test_missing_files(self):
+    report = cern_prefetch.prefetch(self.mount, ['atlas.cern.ch/setup.sh', 'atlas.cern.ch/gone'], threads=2)
+    self.assertEqual((report['files'], report['errors']), (1, 1))
+
+
+class StartPrefetchTest(support.SandboxTestCase):
+
+  def spawned(self, params):
+    calls = []
+    self.patch(cern_util, 'spawn_detached', lambda argv, output: calls.append(argv))
+    cc_cvmfs.start_prefetch(params)
+    self.assertEqual(len(calls), 1)
+    argv = calls[0]
+    self.assertEqual(argv[1], cc_cvmfs.PREFETCH_SCRIPT)
+    return json.loads(argv[argv.index('--config')+1])
+
+  def test_budget_from_the_quota(self):
+    config = self.spawned({'local': {'quota-limit': 8000}, 'prefetch': {'paths': ['atlas.cern.ch/sw'], 'threads': 4}})
+    self.assertEqual(config, {'paths': ['atlas.cern.ch/sw'], 'threads': 4,
+                              'budget': int(8000 * cc_cvmfs.PREFETCH_BUDGET_SHARE) * 1024 * 1024})
+
+  def test_own_budget_and_manifest(self):
+    config = self.spawned({'prefetch': {'manifest': '/etc/cvmfs/prefetch.list', 'budget-mb': 100, 'deadline': 60}})
+    self.assertEqual(config, {'paths': [], 'manifest': '/etc/cvmfs/prefetch.list', 'budget': 100 * 1024 * 1024,
+                              'deadline': 60})
+
+
+class PrefetchPhaseTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cc_cvmfs, 'CVMFS_MOUNT_ROOT', self.path('/cvmfs'))
+    self.patch(cc_cvmfs, 'READY_FILE', self.path('/var/run/cern-cloudinit-cvmfs.ready'))
+    self.write('/var/run/.keep', '')
+    self.addCleanup(cc_cvmfs.clear_ready)
+    self.spawned = []
+    self.patch(cern_util, 'spawn_detached', lambda argv, output: self.spawned.append(argv))
+
+  def run_phases(self):
+    cfg = {'cvmfs': {'local': {'repositories': 'atlas.cern.ch,cms.cern.ch', 'mount-timeout': 5, 'quota-limit': 8000},
+                     'prefetch': {'paths': ['atlas.cern.ch/sw']}}}
+    phases = dict([(phase.name, phase) for phase in cc_cvmfs.phases(cfg, None)])
+    phases['cvmfs.ready'].run()
+    phases['cvmfs.prefetch'].run()
+
+  def test_after_the_mounts(self):
+    self.write('/cvmfs/atlas.cern.ch/sw/setup.sh', '')
+    self.write('/cvmfs/cms.cern.ch/setup.sh', '')
+    self.run_phases()
+    self.assertEqual(len(self.spawned), 1)
+
+  def test_not_after_a_failed_mount(self):
+    self.write('/cvmfs/atlas.cern.ch/sw/setup.sh', '')
+    self.run_phases()
+    self.assertFalse(cc_cvmfs.wait_ready(0))
+    self.assertEqual(self.spawned, [])
+
+
+if __name__ == '__main__':
+  unittest.main()
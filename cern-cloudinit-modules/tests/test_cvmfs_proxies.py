@@ -0,0 +1,62 @@
+import support
+import unittest
+
+import cloudinit.config.cc_cvmfs as cc_cvmfs
+
+PROBE_URL = 'http://cvmfs-stratum-one.cern.ch/cvmfs/atlas.cern.ch/.cvmfspublished'
+
+
+class ProxyRankingTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cc_cvmfs, 'RANKING_CACHE', self.path('/var/lib/cloud/data/cern_cvmfs_ranking.json'))
+
+  def test_groups(self):
+    self.assertEqual(cc_cvmfs.group_proxies([(40, 'c'), (10, 'a'), (12, 'b'), (61, 'd')]), [['a', 'b'], ['c', 'd']])
+    self.assertEqual(cc_cvmfs.group_proxies([]), [])
+
+  def test_unreachable_and_direct_last(self):
+    closed = 'http://127.0.0.1:%d' % self.closed_port()
+    listening = ['http://127.0.0.1:%d' % self.listen() for n in range(2)]
+    groups, measured = cc_cvmfs.rank_proxies(['DIRECT', closed, listening[0], listening[1]], {'probe-deadline': 2})
+    self.assertTrue(measured)
+    self.assertEqual(sorted(sum(groups[:-2], [])), sorted(listening))
+    self.assertEqual(groups[-2:], [[closed], ['DIRECT']])
+
+  def test_probe_url_through_the_proxies(self):
+    # Both proxies accept connections equally fast, only fetching through them tells them apart
+    fast = self.serve({PROBE_URL: 'S1\n'})
+    slow = self.serve({PROBE_URL: 'S1\n'}, delay=0.3)
+    groups, measured = cc_cvmfs.rank_proxies([slow, fast], {'probe-deadline': 2, 'proxy-probe-url': PROBE_URL})
+    self.assertEqual(groups, [[fast], [slow]])
+
+  def test_without_scheme(self):
+    listening = '127.0.0.1:%d' % self.listen()
+    closed = '127.0.0.1:%d' % self.closed_port()
+    groups, measured = cc_cvmfs.rank_proxies([closed, listening], {'probe-deadline': 2})
+    self.assertEqual(groups, [[listening], [closed]])
+    fast = self.serve({PROBE_URL: 'S1\n'})[len('http://'):]
+    slow = self.serve({PROBE_URL: 'S1\n'}, delay=0.3)[len('http://'):]
+    groups, measured = cc_cvmfs.rank_proxies([slow, fast], {'probe-deadline': 2, 'proxy-probe-url': PROBE_URL})
+    self.assertEqual(groups, [[fast], [slow]])
+
+  def test_http_proxy_value(self):
+    self.assertEqual(cc_cvmfs.http_proxy('http://squid:3128', {}), 'http://squid:3128')
+    closed = 'http://127.0.0.1:%d' % self.closed_port()
+    listening = 'http://127.0.0.1:%d' % self.listen()
+    self.assertEqual(cc_cvmfs.http_proxy([closed, listening, 'DIRECT'], {'probe-deadline': 2}), listening+';'+closed+';DIRECT')
+
+  def test_ranking_is_reused(self):
+    closed = 'http://127.0.0.1:%d' % self.closed_port()
+    listening = 'http://127.0.0.1:%d' % self.listen()
+    first = cc_cvmfs.http_proxy([closed, listening], {'probe-deadline': 2})
+    self.assertEqual(first, listening+';'+closed)
+    # Nothing is probed again within the ttl, even once the proxy is gone
+    self._closers.pop()()
+    self.assertEqual(cc_cvmfs.http_proxy([closed, listening], {'probe-deadline': 2}), first)
+    self.assertEqual(cc_cvmfs.http_proxy([closed, listening], {'probe-deadline': 2, 'ranking-ttl': 0}), closed+'|'+listening)
+
+
+if __name__ == '__main__':
+  unittest.main()
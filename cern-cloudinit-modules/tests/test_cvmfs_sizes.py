@@ -0,0 +1,110 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cc_condor as cc_condor
+import cloudinit.config.cc_cvmfs as cc_cvmfs
+import cloudinit.config.cern_facts as facts
+import cloudinit.config.cern_packages as cern_packages
+
+
+class NfilesTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    # fs.file-max of 102400, below fs.nr_open
+    self.make_host(2, 1024)
+
+  def test_default_and_auto_capped(self):
+    self.assertEqual(cc_cvmfs.nfiles({}), 51200)
+    self.assertEqual(cc_cvmfs.nfiles({'nfiles': 'auto'}), 51200)
+
+  def test_explicit_kept(self):
+    self.assertEqual(cc_cvmfs.nfiles({'nfiles': 100000}), 100000)
+    self.assertEqual(cc_cvmfs.nfiles({'nfiles': '65535'}), 65535)
+    self.assertEqual(cc_cvmfs.nfiles({'nfiles': 4096}), 4096)
+
+  def test_within_the_limit(self):
+    self.write('/proc/sys/fs/file-max', '1000000\n')
+    self.assertEqual(cc_cvmfs.nfiles({}), cc_cvmfs.DEFAULT_NFILES)
+    self.assertEqual(cc_cvmfs.nfiles({'nfiles': 'auto'}), cc_cvmfs.AUTO_NFILES)
+
+
+class QuotaTest(support.SandboxTestCase):
+
+  def disk(self, free, used):
+    self.patch(facts, 'free_disk_mb', lambda path: free)
+    self.patch(facts, 'used_disk_mb', lambda path: used)
+
+  def test_fixed(self):
+    self.assertEqual(cc_cvmfs.quota_limit_mb({}), cc_cvmfs.DEFAULT_QUOTA_LIMIT)
+    self.assertEqual(cc_cvmfs.quota_limit_mb({'quota-limit': '5000'}), 5000)
+
+  def test_auto_is_stable_while_the_cache_fills(self):
+    local = {'quota-limit': 'auto', 'quota-headroom': 1000}
+    self.disk(20000, 0)
+    empty = cc_cvmfs.quota_limit_mb(local)
+    self.assertEqual(empty, 19000)
+    # At the next boot 8 GB of it are filled: same quota, the warm cache is kept
+    self.disk(12000, 8000)
+    self.assertEqual(cc_cvmfs.quota_limit_mb(local), empty)
+
+  def test_auto_floor(self):
+    self.disk(500, 0)
+    self.assertEqual(cc_cvmfs.quota_limit_mb({'quota-limit': 'auto', 'quota-floor': 1500}), 1500)
+
+  def test_used_disk(self):
+    self.make_host(1, 1024)
+    cache = self.path('/var/lib/cvmfs/shared')
+    os.makedirs(cache)
+    for n in range(3):
+      f = open(os.path.join(cache, 'chunk%d' % n), 'w')
+      f.write('x' * (1024 * 1024))
+      f.close()
+    self.assertEqual(facts.used_disk_mb(self.path('/var/lib/cvmfs')), 3)
+    self.assertEqual(facts.used_disk_mb(self.path('/var/lib/nothing')), 0)
+
+  def test_condor_reserves_what_is_not_filled_yet(self):
+    self.disk(12000, 8000)
+    cfg = {'cvmfs': {'local': {'cache-base': self.root, 'quota-limit': 10000}}}
+    self.assertEqual(cc_condor.cvmfs_cache_mb(cfg, self.root), 2000)
+
+
+class ReleasePackageTest(support.SandboxTestCase):
+
+  def rpm(self, sl_release):
+    # rpm stub: cvmfs-release is not installed, sl-release is 'sl_release' (or not installed if None)
+    script = '#!/bin/sh\necho "$0 $*" >> %s\n' % self.path('/commands.log')
+    script += 'case "$*" in\n  "-q cvmfs-release") echo "package cvmfs-release is not installed" ;;\n'
+    if sl_release:
+      script += '  *sl-release) printf %s ;;\n' % sl_release
+    else:
+      script += '  *sl-release) echo "package sl-release is not installed"; exit 1 ;;\n'
+    script += 'esac\n'
+    path = self.write('/bin/rpm', script)
+    os.chmod(path, 0755)
+    self.patch(cern_packages, 'RPM_cmd', path)
+    self.patch(cc_cvmfs, 'RPM_cmd', path)
+
+  def test_unknown_release(self):
+    self.make_host(1, 1024)
+    os.unlink(self.path('/etc/redhat-release'))
+    self.rpm(None)
+    self.assertEqual(cc_cvmfs.release_major(), None)
+    self.assertEqual(cc_cvmfs.package_plan({}), cc_cvmfs.CVMFS_PACKAGES)
+
+  def test_release_from_rpm(self):
+    self.make_host(1, 1024)
+    os.unlink(self.path('/etc/redhat-release'))
+    self.rpm('6.5')
+    self.assertEqual(cc_cvmfs.release_major(), '6')
+
+  def test_release_from_etc(self):
+    self.make_host(1, 1024)
+    self.rpm(None)
+    self.assertEqual(cc_cvmfs.release_major(), '6')
+    self.assertEqual(self.commands(), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
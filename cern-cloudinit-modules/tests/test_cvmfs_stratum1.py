@@ -0,0 +1,47 @@
+import support
+import unittest
+
+import cloudinit.config.cc_cvmfs as cc_cvmfs
+
+MANIFEST_PATH = '/cvmfs/atlas.cern.ch/.cvmfspublished'
+
+
+def manifest(revision):
+  return 'C0123456789abcdef\nRd41d8cd98f00b204e9800998ecf8427e\nS%d\nT1381234567\n--\n0123abcd\nsignature' % revision
+
+
+class Stratum1RankingTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cc_cvmfs, 'RANKING_CACHE', self.path('/var/lib/cloud/data/cern_cvmfs_ranking.json'))
+
+  def test_read_manifest(self):
+    fields = cc_cvmfs.read_manifest(manifest(4711))
+    self.assertEqual(fields['S'], '4711')
+    self.assertEqual(fields['T'], '1381234567')
+    self.assertTrue('s' not in fields)
+
+  def test_newest_then_fastest(self):
+    fast = self.serve({MANIFEST_PATH: manifest(12)})+'/cvmfs/@fqrn@'
+    slow = self.serve({MANIFEST_PATH: manifest(12)}, delay=0.2)+'/cvmfs/@fqrn@'
+    stale = self.serve({MANIFEST_PATH: manifest(11)})+'/cvmfs/@fqrn@'
+    down = 'http://127.0.0.1:%d/cvmfs/@fqrn@' % self.closed_port()
+    ranked, measured = cc_cvmfs.rank_stratum1s([down, stale, slow, fast], 'atlas.cern.ch', {'probe-deadline': 2})
+    self.assertTrue(measured)
+    self.assertEqual(ranked, [fast, slow, stale, down])
+
+  def test_server_url(self):
+    up = self.serve({MANIFEST_PATH: manifest(3)})+'/cvmfs/@fqrn@'
+    down = 'http://127.0.0.1:%d/cvmfs/@fqrn@' % self.closed_port()
+    params = {'local': {'repositories': 'alice.cern.ch, atlas.cern.ch', 'probe-deadline': 2}}
+    self.assertEqual(cc_cvmfs.server_url('cern.ch', 'http://s1/cvmfs/@fqrn@', params), 'http://s1/cvmfs/@fqrn@')
+    # 'up' only has atlas.cern.ch, the first repository of the domain is alice.cern.ch
+    params['domains'] = {'cern.ch': {'probe-repository': 'atlas.cern.ch'}}
+    self.assertEqual(cc_cvmfs.server_url('cern.ch', [down, up], params), up+';'+down)
+    # Without a repository of the domain the order is kept
+    self.assertEqual(cc_cvmfs.server_url('egi.eu', [down, up], params), down+';'+up)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,43 @@
+import json
+import support
+import unittest
+
+import cloudinit.config.cern_facts as facts
+
+
+class FactsCacheTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.make_host(4, 8192)
+
+  def reload(self, cores):
+    # The host now has 'cores' CPUs, seen by a new cloud-init process of the same boot unless boot_id changed
+    support.bench_handlers.make_proc(self.root, cores, 8192)
+    facts._facts = None
+
+  def test_cached_for_the_boot(self):
+    self.assertEqual(facts.get('cpu_count'), 4)
+    cache = json.loads(self.read(facts.CACHE_FILE[len(self.root):]))
+    self.assertEqual((cache['boot_id'], cache['cpu_count']), ('bench-boot', 4))
+    self.reload(8)
+    self.assertEqual(facts.get('cpu_count'), 4)
+
+  def test_new_boot(self):
+    self.assertEqual(facts.get('cpu_count'), 4)
+    self.assertEqual(facts.get('memory_mb'), 8192)
+    self.reload(8)
+    self.write('/proc/sys/kernel/random/boot_id', 'next-boot\n')
+    self.assertEqual(facts.get('cpu_count'), 8)
+    cache = json.loads(self.read(facts.CACHE_FILE[len(self.root):]))
+    self.assertEqual(sorted(cache.keys()), ['boot_id', 'cpu_count'])
+    self.assertEqual(cache['boot_id'], 'next-boot')
+
+  def test_broken_cache(self):
+    self.write(facts.CACHE_FILE[len(self.root):], '{"boot_id": "bench-boot", "cpu_')
+    self.assertEqual(facts.get('cpu_count'), 4)
+    self.assertEqual(json.loads(self.read(facts.CACHE_FILE[len(self.root):]))['cpu_count'], 4)
+
+
+if __name__ == '__main__':
+  unittest.main()
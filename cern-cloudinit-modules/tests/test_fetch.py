@@ -0,0 +1,94 @@
+import hashlib
+import json
+import os
+import support
+import unittest
+import urllib2
+
+import cloudinit.config.cc_condor as cc_condor
+import cloudinit.config.cern_fetch as cern_fetch
+import cloudinit.config.cern_packages as cern_packages
+import cloudinit.config.cern_util as cern_util
+
+
+class FetchTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cern_fetch, 'CACHE_DIR', self.path('/cache'))
+    self.patch(cern_fetch, 'OFFLINE', False)
+    self.rpm = self.write('/repo/condor-8.0.0-1.x86_64.rpm', 'not really an rpm\n')
+    self.url = 'file://'+self.rpm
+
+  def test_keeps_the_basename(self):
+    path = cern_fetch.fetch(self.url)
+    self.assertEqual(os.path.basename(path), 'condor-8.0.0-1.x86_64.rpm')
+    self.assertEqual(open(path).read(), 'not really an rpm\n')
+    # The second fetch revalidates and hands out the same file
+    self.assertEqual(cern_fetch.fetch(self.url), path)
+
+  def test_cached_by_checksum(self):
+    path = cern_fetch.fetch(self.url)
+    digest = os.path.basename(os.path.dirname(path))
+    os.unlink(self.rpm)
+    self.assertEqual(cern_fetch.fetch(self.url, digest), path)
+
+  def test_condor_rpm_is_installed_as_a_file(self):
+    # package_plan() hands the cached RPM to cern_packages: it must go to yum as a local file, not to 'rpm -q'
+    self.stub(cern_packages, 'YUM_cmd')
+    self.stub(cern_packages, 'RPM_cmd')
+    packages = cc_condor.package_plan({'rpm-url': self.url})
+    self.assertTrue(packages[-1].endswith('.rpm'))
+    self.assertTrue(cern_packages.install(packages))
+
+    rpm_query, yum_install = self.commands()
+    self.assertEqual(rpm_query[1:], ['-q']+cc_condor.CONDOR_DEPENDENCIES)
+    self.assertEqual(yum_install[1:4], ['-y', 'install', packages[-1]])
+
+
+class RevalidationTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cern_fetch, 'CACHE_DIR', self.path('/cache'))
+    self.patch(cern_fetch, 'OFFLINE', False)
+    self.files = {'/repo/cern.repo': '[cern]\nbaseurl=http://linuxsoft.cern.ch/cern\n'}
+    self.url = self.serve(self.files)+'/repo/cern.repo'
+    self.cached = cern_fetch.fetch(self.url)
+    self.assertEqual([status for path, status, headers in self.requests], [200])
+
+  def test_not_modified(self):
+    self.assertEqual(cern_fetch.fetch(self.url), self.cached)
+    path, status, headers = self.requests[-1]
+    self.assertEqual(status, 304)
+    self.assertEqual(headers.getheader('If-None-Match'), '"'+hashlib.md5(self.files['/repo/cern.repo']).hexdigest()+'"')
+    self.assertEqual(headers.getheader('If-Modified-Since'), 'Sat, 17 Oct 2026 06:00:00 GMT')
+    self.assertEqual(open(self.cached).read(), self.files['/repo/cern.repo'])
+
+  def test_not_modified_since(self):
+    # Without an ETag, the Last-Modified date alone revalidates
+    index = json.load(open(cern_fetch._index_file()))
+    del index[self.url]['etag']
+    cern_util.write_atomic(cern_fetch._index_file(), json.dumps(index))
+    self.assertEqual(cern_fetch.fetch(self.url), self.cached)
+    path, status, headers = self.requests[-1]
+    self.assertEqual((status, headers.getheader('If-None-Match')), (304, None))
+
+  def test_changed_etag(self):
+    self.files['/repo/cern.repo'] = '[cern]\nbaseurl=http://linuxsoft.cern.ch/cern/7\n'
+    path = cern_fetch.fetch(self.url)
+    self.assertEqual(self.requests[-1][1], 200)
+    self.assertNotEqual(path, self.cached)
+    self.assertEqual(open(path).read(), self.files['/repo/cern.repo'])
+    self.assertEqual(cern_fetch.fetch(self.url), path)
+    self.assertEqual(self.requests[-1][1], 304)
+
+  def test_stale_when_the_server_is_down(self):
+    self.stop_serving()
+    self.assertEqual(cern_fetch.fetch(self.url), self.cached)
+    self.assertEqual(len(self.requests), 1)
+    self.assertRaises(urllib2.URLError, cern_fetch.fetch, self.url.replace('cern.repo', 'other.repo'))
+
+
+if __name__ == '__main__':
+  unittest.main()
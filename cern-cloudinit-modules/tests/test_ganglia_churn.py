@@ -0,0 +1,111 @@
+import os
+import support
+import tarfile
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+import cloudinit.config.cern_gmondconf as cern_gmondconf
+import cloudinit.config.cern_rrdexpire as cern_rrdexpire
+
+NOW = 1700000000
+
+
+def gmond_conf():
+  return cern_gmondconf.parse(open(os.path.join(support.bench_handlers.SAMPLES_DIR, 'gmond.conf')).read())
+
+
+class EphemeralTest(unittest.TestCase):
+
+  def test_settings(self):
+    self.assertEqual(cc_ganglia.ephemeral_settings({}), None)
+    self.assertEqual(cc_ganglia.ephemeral_settings({'ephemeral': True}), cc_ganglia.DEFAULT_EPHEMERAL)
+    settings = cc_ganglia.ephemeral_settings({'ephemeral': {'host-dmax': 900}})
+    self.assertEqual(settings['host-dmax'], 900)
+    self.assertEqual(settings['cleanup-threshold'], cc_ganglia.DEFAULT_EPHEMERAL['cleanup-threshold'])
+
+  def test_gmond_globals(self):
+    root = gmond_conf()
+    cc_ganglia.edit_node(root, {'ephemeral': {'host-dmax': 900}})
+    globals_block = root.block('globals')
+    self.assertEqual(globals_block.get('host_dmax'), '900')
+    self.assertEqual(globals_block.get('cleanup_threshold'), '120')
+    self.assertEqual(globals_block.get('send_metadata_interval'), '30')
+
+  def test_explicit_globals_win(self):
+    root = gmond_conf()
+    cc_ganglia.edit_node(root, {'ephemeral': True, 'globals': {'host-dmax': 60, 'send-metadata-interval': 10}})
+    self.assertEqual(root.block('globals').get('host_dmax'), '60')
+    self.assertEqual(root.block('globals').get('send_metadata_interval'), '10')
+
+  def test_without_ephemeral(self):
+    before = gmond_conf().block('globals').render()
+    root = gmond_conf()
+    cc_ganglia.edit_node(root, {})
+    self.assertEqual(root.block('globals').render(), before)
+
+  def test_metadata_switch(self):
+    argv = cc_ganglia.metadata_switch(cc_ganglia.ephemeral_settings({'ephemeral': {'startup-window': 300}}))
+    self.assertEqual(argv[3:], ['sh', '300', cc_ganglia.SED_cmd, '600', cc_ganglia.GMOND_CONF, cc_ganglia.GMOND_cmd])
+
+
+class RetentionTest(unittest.TestCase):
+
+  def test_expire_seconds(self):
+    self.assertEqual(cc_ganglia.rrd_expire_seconds({'rrd-retention': True}), 24 * 3600)
+    self.assertEqual(cc_ganglia.rrd_expire_seconds({'rrd-retention': {'expire-after': 0.5}}), 1800)
+    self.assertEqual(cc_ganglia.rrd_expire_seconds({'rrd-retention': {'expire-after': 12}, 'rrdcached': True}), 12 * 3600)
+    # Shorter than write-timeout + write-jitter + flush-timeout: live hosts would look gone
+    self.assertEqual(cc_ganglia.rrd_expire_seconds({'rrd-retention': {'expire-after': 1}, 'rrdcached': True}), 14400)
+
+  def test_cron(self):
+    cron = cc_ganglia.rrd_expire_cron({'rrd-retention': {'expire-after': 12, 'archive-dir': '/var/lib/ganglia/archive'}})
+    line = cron.splitlines()[1]
+    self.assertTrue(line.startswith('17 * * * * root '))
+    self.assertTrue(' --root '+cc_ganglia.RRD_DIR+' --max-age 43200 --archive /var/lib/ganglia/archive >> ' in line)
+    self.assertTrue('--archive' not in cc_ganglia.rrd_expire_cron({'rrd-retention': True}))
+
+
+class ExpireTest(support.SandboxTestCase):
+
+  def host(self, cluster, host, age):
+    for metric in ('load_one', 'mem_free'):
+      path = self.write('/rrds/'+cluster+'/'+host+'/'+metric+'.rrd', 'x' * 1024)
+      os.utime(path, (NOW - age, NOW - age))
+
+  def test_expire(self):
+    self.host('batch', 'live.cern.ch', 60)
+    self.host('batch', 'gone.cern.ch', 7200)
+    self.host('batch', '__SummaryInfo__', 7200)
+    self.host('__SummaryInfo__', 'x', 7200)
+    report = cern_rrdexpire.expire(self.path('/rrds'), 3600, self.path('/archive'), now=NOW)
+    self.assertEqual(report, {'hosts': 1, 'bytes': 2048, 'errors': 0})
+    self.assertEqual(sorted(os.listdir(self.path('/rrds/batch'))), ['__SummaryInfo__', 'live.cern.ch'])
+    self.assertTrue(os.path.isdir(self.path('/rrds/__SummaryInfo__/x')))
+    archives = os.listdir(self.path('/archive/batch'))
+    self.assertEqual(len(archives), 1)
+    self.assertTrue(archives[0].startswith('gone.cern.ch-'))
+    tar = tarfile.open(self.path('/archive/batch/'+archives[0]))
+    self.assertEqual(sorted(tar.getnames()), ['gone.cern.ch', 'gone.cern.ch/load_one.rrd', 'gone.cern.ch/mem_free.rrd'])
+    tar.close()
+
+  def test_steady_state(self):
+    # Hosts living 3 hours come and go every hour: with a 6 hour expiry, at most 9 hours of hosts remain
+    counts = []
+    for hour in range(48):
+      now = NOW + hour * 3600
+      for n in range(10):
+        host = 'vm%d-%d' % (hour, n)
+        self.host('batch', host, 0)
+      for directory in os.listdir(self.path('/rrds/batch')):
+        started = int(directory[2:].split('-')[0])
+        if hour - started < 3:
+          for name in os.listdir(self.path('/rrds/batch/'+directory)):
+            os.utime(self.path('/rrds/batch/'+directory+'/'+name), (now, now))
+      cern_rrdexpire.expire(self.path('/rrds'), 6 * 3600, now=now)
+      counts.append(len(os.listdir(self.path('/rrds/batch'))))
+    self.assertEqual(max(counts[12:]), min(counts[12:]))
+    self.assertTrue(counts[-1] <= 10 * 9)
+
+
+if __name__ == '__main__':
+  unittest.main()
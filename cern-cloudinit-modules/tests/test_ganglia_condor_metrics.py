@@ -0,0 +1,153 @@
+import os
+import support
+import sys
+import time
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+
+sys.path.insert(0, os.path.join(os.path.dirname(support.TESTS_DIR), 'src'+cc_ganglia.PYTHON_MODULES_DIR))
+import cern_condor
+
+NOW = int(time.time())
+BOOTED = NOW - 3600
+STARTED = NOW - 600
+
+
+def line(when, slot, change):
+  # A StartLog line stamped 'when', e.g. change='Claimed/Idle -> Claimed/Busy'
+  return '%s %s: Changing state and activity: %s\n' % (time.strftime('%m/%d/%y %H:%M:%S', time.localtime(when)),
+                                                       slot, change)
+
+def claim(when, slot, latency):
+  # A slot claimed at 'when' and running its job 'latency' seconds later
+  return (line(when, slot, 'Unclaimed/Idle -> Claimed/Idle') +
+          line(when + latency, slot, 'Claimed/Idle -> Claimed/Busy'))
+
+
+class CondorMetricsTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    for name in ('_slots', '_claimed_at', '_sample'):
+      self.patch(cern_condor, name, {})
+    self.patch(cern_condor, '_latencies', [])
+    self.patch(cern_condor, '_log', {'inode': None, 'offset': 0, 'partial': ''})
+    self.patch(cern_condor, '_first_claim', None)
+    self.patch(cern_condor, '_booted', None)
+    self.patch(cern_condor, '_params', {})
+    self.patch(cern_condor, '_sampled', 0)
+    self.patch(cern_condor, 'PROC_STAT', self.path('/proc/stat'))
+    self.write('/proc/stat', 'cpu  1 2 3 4\nbtime %d\nprocesses 100\n' % BOOTED)
+    self.log = self.path('/var/log/condor/StartLog')
+    cern_condor.metric_init({'log': self.log, 'sample_seconds': '0'})
+    self.patch(cern_condor, '_started', STARTED)
+
+  def append(self, text, path='/var/log/condor/StartLog'):
+    f = open(self.path(path), 'a')
+    f.write(text)
+    f.close()
+
+  def sample(self):
+    self.patch(cern_condor, '_sampled', 0)
+    cern_condor.sample()
+    return cern_condor._sample
+
+  def test_slot_states(self):
+    self.write('/var/log/condor/StartLog',
+               line(NOW - 60, 'slot1_1', 'Unclaimed/Idle -> Claimed/Idle') +
+               line(NOW - 50, 'slot1_1', 'Claimed/Idle -> Claimed/Busy') +
+               line(NOW - 60, 'slot1_2', 'Unclaimed/Idle -> Claimed/Idle') +
+               line(NOW - 40, 'slot1_3', 'Unclaimed/Idle -> Matched/Idle') +
+               line(NOW - 30, 'slot1_4', 'Unclaimed/Idle -> Claimed/Idle') +
+               line(NOW - 20, 'slot1_4', 'Claimed/Idle -> Preempting/Vacating') +
+               line(NOW - 10, 'slot1_4', 'Preempting/Vacating -> Delete/Idle') +
+               '10/17/26 06:44:37 slot1_1: Received match <10.0.0.1:9618>\n')
+    values = self.sample()
+    self.assertEqual((values['condor_slots_claimed'], values['condor_slots_busy']), (2, 1))
+    self.assertEqual((values['condor_slots_matched'], values['condor_slots_preempting']), (1, 0))
+    self.assertEqual(sorted(cern_condor._slots.keys()), ['slot1_1', 'slot1_2', 'slot1_3'])
+
+  def test_state_only_and_activity_only(self):
+    cern_condor.transition(line(NOW, 'slot1', 'Unclaimed/Idle -> Claimed/Idle'))
+    cern_condor.transition(time.strftime('%m/%d/%y %H:%M:%S', time.localtime(NOW + 5)) +
+                           ' slot1: Changing activity: Idle -> Busy')
+    self.assertEqual(cern_condor._slots['slot1'], ['Claimed', 'Busy'])
+    self.assertEqual(cern_condor._latencies, [5])
+    cern_condor.transition(time.strftime('%m/%d/%y %H:%M:%S', time.localtime(NOW + 9)) +
+                           ' slot1: Changing state: Claimed -> Preempting')
+    self.assertEqual(cern_condor._slots['slot1'], ['Preempting', 'Busy'])
+
+  def test_history_before_the_boot(self):
+    self.write('/var/log/condor/StartLog', claim(BOOTED - 7200, 'slot1_1', 3) +
+               line(BOOTED - 60, 'slot1_2', 'Unclaimed/Idle -> Claimed/Idle'))
+    values = self.sample()
+    self.assertEqual(values['condor_first_claim_after_boot'], 0)
+    self.assertEqual(values['condor_slots_claimed'], 0)
+    self.assertEqual(cern_condor._slots, {})
+    self.append(claim(BOOTED + 300, 'slot1_1', 2))
+    self.assertEqual(self.sample()['condor_first_claim_after_boot'], 300)
+
+  def test_history_before_the_start(self):
+    # Claimed before gmond started: the slot counts, but only the jobs started since then are latencies
+    self.write('/var/log/condor/StartLog', claim(BOOTED + 60, 'slot1_1', 40) +
+               line(STARTED - 10, 'slot1_2', 'Unclaimed/Idle -> Claimed/Idle') +
+               line(STARTED + 20, 'slot1_2', 'Claimed/Idle -> Claimed/Busy'))
+    values = self.sample()
+    self.assertEqual(values['condor_slots_busy'], 2)
+    self.assertEqual(values['condor_first_claim_after_boot'], 60)
+    self.assertEqual((values['condor_start_latency_le_30'], values['condor_start_latency_gt_120']), (1, 0))
+    self.assertEqual(values['condor_start_latency_max'], 30)
+
+  def test_latency_buckets(self):
+    self.write('/var/log/condor/StartLog', ''.join([claim(NOW - 500, 'slot1_%d' % n, latency)
+                                                    for n, latency in enumerate((0, 1, 3, 5, 6, 30, 90, 121, 400))]))
+    values = self.sample()
+    self.assertEqual([values[cern_condor.bucket_name(bound)] for bound in list(cern_condor.LATENCY_BUCKETS) + [None]],
+                     [2, 2, 2, 1, 2])
+    self.assertEqual(values['condor_start_latency_max'], 400)
+    # The buckets count the jobs started since the last sample
+    values = self.sample()
+    self.assertEqual(values['condor_start_latency_le_1'] + values['condor_start_latency_gt_120'], 0)
+    self.assertEqual((values['condor_start_latency_max'], values['condor_slots_busy']), (0, 9))
+
+  def test_partial_line(self):
+    text = claim(NOW - 100, 'slot1_1', 4)
+    self.write('/var/log/condor/StartLog', text[:-10])
+    self.assertEqual(self.sample()['condor_slots_busy'], 0)
+    self.append(text[-10:])
+    values = self.sample()
+    self.assertEqual((values['condor_slots_busy'], values['condor_start_latency_le_5']), (1, 1))
+
+  def test_rotation(self):
+    self.write('/var/log/condor/StartLog', line(NOW - 100, 'slot1_1', 'Unclaimed/Idle -> Claimed/Idle'))
+    self.sample()
+    # The rest of the rotated file is read before the new one
+    self.append(line(NOW - 90, 'slot1_1', 'Claimed/Idle -> Claimed/Busy') +
+                line(NOW - 80, 'slot1_2', 'Unclaimed/Idle -> Claimed/Idle'))
+    os.rename(self.log, self.log+'.old')
+    self.write('/var/log/condor/StartLog', line(NOW - 60, 'slot1_2', 'Claimed/Idle -> Claimed/Busy'))
+    values = self.sample()
+    self.assertEqual(values['condor_slots_busy'], 2)
+    self.assertEqual((values['condor_start_latency_le_30'], values['condor_start_latency_max']), (2, 20))
+    self.append(line(NOW - 50, 'slot1_1', 'Claimed/Busy -> Unclaimed/Idle'))
+    self.assertEqual(self.sample()['condor_slots_busy'], 1)
+
+  def test_truncated(self):
+    self.write('/var/log/condor/StartLog', claim(NOW - 100, 'slot1_1', 4) + claim(NOW - 100, 'slot1_2', 4))
+    self.sample()
+    self.write('/var/log/condor/StartLog', line(NOW - 50, 'slot1_1', 'Claimed/Busy -> Unclaimed/Idle'))
+    self.assertEqual(self.sample()['condor_slots_unclaimed'], 1)
+
+  def test_no_log(self):
+    values = self.sample()
+    self.assertEqual((values['condor_slots_busy'], values['condor_first_claim_after_boot']), (0, 0))
+
+  def test_descriptors(self):
+    names = [descriptor['name'] for descriptor in cern_condor.metric_init({'log': self.log})]
+    self.assertEqual(names, [name[0] for name in cern_condor.metric_names()])
+    self.assertEqual(cern_condor._booted, BOOTED)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,147 @@
+import json
+import os
+import socket
+import support
+import sys
+import threading
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+import cloudinit.config.cern_gmondconf as cern_gmondconf
+
+sys.path.insert(0, os.path.join(os.path.dirname(support.TESTS_DIR), 'src'+cc_ganglia.PYTHON_MODULES_DIR))
+import cern_cvmfs
+
+REPOSITORY = 'atlas.cern.ch'
+PREFIX = 'cvmfs_atlas_cern_ch_'
+
+
+class CvmfsMetricsTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    for name in ('_samples', '_counters', '_switches'):
+      self.patch(cern_cvmfs, name, {})
+    self.patch(cern_cvmfs, '_params', {})
+    self.patch(cern_cvmfs, '_sampled', 0)
+    self.patch(cern_cvmfs, 'CVMFS_MOUNT_ROOT', self.path('/cvmfs'))
+    self.patch(cern_cvmfs, 'PROC_MOUNTS', self.path('/proc/mounts'))
+    self.patch(cern_cvmfs, 'READY_FILE', self.path('/var/run/cern-cloudinit-cvmfs.ready'))
+    self.write('/proc/mounts', 'cvmfs2 '+self.path('/cvmfs/'+REPOSITORY)+' fuse ro,nosuid 0 0\n'
+                               'cvmfs2 /other/cms.cern.ch fuse ro 0 0\n')
+    # The extended attributes of the mount points, and how often they were read
+    self.xattrs = {'user.nopen': '1000', 'user.ndownload': '100', 'user.rx': '0', 'user.nioerr': '0',
+                   'user.proxy': 'http://squid1:3128'}
+    self.reads = []
+
+    def getxattr(path, name):
+      self.reads.append((path, name))
+      return self.xattrs.get(name)
+    self.patch(cern_cvmfs, 'getxattr', getxattr)
+    cern_cvmfs.metric_init({'repositories': REPOSITORY+',cms.cern.ch', 'cache_base': self.path('/var/lib/cvmfs'),
+                            'quota_limit': '4000', 'sample_seconds': '20'})
+
+  def cvmfs_io(self, path, answer):
+    # A cvmfs_io socket answering every command with 'answer'
+    received = []
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self.write(path+'.keep', '')
+    server.bind(self.path(path))
+    server.listen(4)
+    self._closers.append(server.close)
+
+    def serve():
+      while True:
+        try:
+          connection = server.accept()[0]
+        except socket.error:
+          return
+        received.append(connection.recv(4096))
+        connection.sendall(answer)
+        connection.close()
+    thread = threading.Thread(target=serve)
+    thread.setDaemon(True)
+    thread.start()
+    return received
+
+  def test_hitrate_and_rates(self):
+    sample = cern_cvmfs.sample_repository(REPOSITORY, 1000.0, {})
+    self.assertEqual((sample['hitrate'], sample['rx'], sample['nioerr']), (100.0, 0.0, 0.0))
+    self.xattrs.update({'user.nopen': '1200', 'user.ndownload': '150', 'user.rx': '20000', 'user.nioerr': '3'})
+    sample = cern_cvmfs.sample_repository(REPOSITORY, 1100.0, {})
+    self.assertEqual(sample['hitrate'], 75.0)
+    self.assertEqual(sample['rx'], 200.0)
+    self.assertEqual(sample['nioerr'], 0.03)
+    # Nothing opened: the hit rate stays at 100%
+    sample = cern_cvmfs.sample_repository(REPOSITORY, 1200.0, {})
+    self.assertEqual((sample['hitrate'], sample['rx']), (100.0, 0.0))
+
+  def test_proxy_switches(self):
+    switches = []
+    for proxy in ('http://squid1:3128', 'http://squid1:3128', 'http://squid2:3128', 'http://squid2:3128',
+                  'http://squid1:3128'):
+      self.xattrs['user.proxy'] = proxy
+      switches.append(cern_cvmfs.sample_repository(REPOSITORY, 1000.0 + len(switches), {})['proxy_switches'])
+    self.assertEqual(switches, [0, 0, 1, 1, 2])
+
+  def test_cache_size(self):
+    received = self.cvmfs_io('/var/lib/cvmfs/shared/cvmfs_io.'+REPOSITORY,
+                             'Current cache size is 1000MB (1048576000 Bytes), pinned: 10MB (10485760 Bytes)\n')
+    self.assertEqual(cern_cvmfs.cache_used_mb(REPOSITORY), 1000)
+    self.assertEqual(received, ['cache size'])
+    sample = cern_cvmfs.sample_repository(REPOSITORY, 1000.0, {})
+    self.assertEqual((sample['cache_used'], sample['cache_fill']), (1000, 25.0))
+
+  def test_cache_size_private_cache(self):
+    self.cvmfs_io('/var/lib/cvmfs/'+REPOSITORY+'/cvmfs_io.'+REPOSITORY, 'Current cache size is 1MB (2097152 Bytes)\n')
+    self.assertEqual(cern_cvmfs.cache_used_mb(REPOSITORY), 2)
+
+  def test_cache_size_unknown(self):
+    self.assertEqual(cern_cvmfs.cache_used_mb(REPOSITORY), None)
+    self.cvmfs_io('/var/lib/cvmfs/shared/cvmfs_io.'+REPOSITORY, 'unknown command\n')
+    self.assertEqual(cern_cvmfs.cache_used_mb(REPOSITORY), None)
+    self.assertTrue('cache_used' not in cern_cvmfs.sample_repository(REPOSITORY, 1000.0, {}))
+
+  def test_mount_time(self):
+    self.assertEqual(cern_cvmfs.metric_handler(PREFIX+'mount_ms'), 0)
+    self.write('/var/run/cern-cloudinit-cvmfs.ready', json.dumps({REPOSITORY: {'ok': True, 'mount_ms': 420}}))
+    self.patch(cern_cvmfs, '_sampled', 0)
+    self.assertEqual(cern_cvmfs.metric_handler(PREFIX+'mount_ms'), 420)
+
+  def test_throttled(self):
+    self.assertEqual(cern_cvmfs.metric_handler(PREFIX+'hitrate'), 100.0)
+    reads = len(self.reads)
+    self.xattrs.update({'user.nopen': '2000'})
+    for suffix in ('hitrate', 'rx', 'nioerr', 'proxy_switches'):
+      cern_cvmfs.metric_handler(PREFIX+suffix)
+    self.assertEqual(len(self.reads), reads)
+    self.patch(cern_cvmfs, '_sampled', 0)
+    cern_cvmfs.metric_handler(PREFIX+'hitrate')
+    self.assertEqual(len(self.reads), 2 * reads)
+
+  def test_unmounted_repository(self):
+    # Only the mounted repositories are read: listing the others would mount them
+    self.assertEqual(cern_cvmfs.metric_handler('cvmfs_cms_cern_ch_hitrate'), 0)
+    self.assertEqual([path for path, name in self.reads if 'cms.cern.ch' in path], [])
+
+  def test_descriptors(self):
+    names = [descriptor['name'] for descriptor in cern_cvmfs.metric_init({'repositories': REPOSITORY})]
+    self.assertEqual(names, [PREFIX+metric[0] for metric in cern_cvmfs.METRICS])
+
+
+class CvmfsMetricsConfTest(unittest.TestCase):
+
+  def test_mount_time_collected_again(self):
+    conf = cern_gmondconf.parse(cc_ganglia.cvmfs_metrics_conf({'local': {'repositories': REPOSITORY, 'quota-limit': 4000}},
+                                                              {}))
+    counters, steady = conf.blocks('collection_group')
+    self.assertEqual((counters.get('collect_every'), counters.get('time_threshold')), ('60', '600'))
+    self.assertEqual(len(counters.blocks('metric')), len(cc_ganglia.CVMFS_METRIC_THRESHOLDS) - 1)
+    self.assertEqual(steady.get('collect_once'), None)
+    self.assertEqual((steady.get('collect_every'), steady.get('time_threshold')), ('60', '3600'))
+    self.assertEqual([(metric.get('name'), metric.get('value_threshold')) for metric in steady.blocks('metric')],
+                     [('"'+PREFIX+'mount_ms"', '1')])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,69 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+import cloudinit.config.cern_facts as facts
+
+PACKAGE_DIR = os.path.dirname(support.TESTS_DIR)
+
+MODPYTHON_CONF = '''/*
+  params - path to the directory where mod_python
+           should look for python metric modules
+*/
+modules {
+  module {
+    name = "python_module"
+    path = "modpython.so"
+    params = "/opt/ganglia/python_modules"
+  }
+}
+
+include ("/etc/ganglia/conf.d/*.pyconf")
+'''
+
+
+class PythonModulesTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.make_host(2, 2048)
+    for name in ('MODPYTHON_CONF', 'GMOND_PYTHON_MODULES_LIB64', 'GMOND_PYTHON_MODULES_LIB'):
+      self.patch(cc_ganglia, name, self.path(getattr(cc_ganglia, name)))
+
+  def arch(self, machine):
+    self.patch(facts, 'FACTS', dict(facts.FACTS, arch=lambda: machine))
+
+  def test_packaged_noarch(self):
+    for module in ('cern_cvmfs', 'cern_condor'):
+      self.assertTrue(os.path.isfile(os.path.join(PACKAGE_DIR, 'src'+cc_ganglia.PYTHON_MODULES_DIR, module+'.py')))
+    files = open(os.path.join(PACKAGE_DIR, 'files')).read().split()
+    self.assertTrue(cc_ganglia.PYTHON_MODULES_DIR+'/*' in files)
+    self.assertEqual([path for path in files if 'lib64' in path], [])
+
+  def test_directory_x86_64(self):
+    self.arch('x86_64')
+    self.assertEqual(cc_ganglia.gmond_python_modules(), cc_ganglia.GMOND_PYTHON_MODULES_LIB64)
+
+  def test_directory_i686(self):
+    self.arch('i686')
+    self.assertEqual(cc_ganglia.gmond_python_modules(), cc_ganglia.GMOND_PYTHON_MODULES_LIB)
+
+  def test_directory_of_modpython_conf(self):
+    self.write('/etc/ganglia/conf.d/modpython.conf', MODPYTHON_CONF)
+    self.assertEqual(cc_ganglia.gmond_python_modules(), '/opt/ganglia/python_modules')
+
+  def test_link(self):
+    self.arch('i686')
+    target = cc_ganglia.link_python_module('cern_cvmfs')
+    self.assertEqual(target, cc_ganglia.GMOND_PYTHON_MODULES_LIB+'/cern_cvmfs.py')
+    self.assertEqual(os.readlink(target), cc_ganglia.PYTHON_MODULES_DIR+'/cern_cvmfs.py')
+    self.assertEqual(cc_ganglia.link_python_module('cern_cvmfs'), target)
+    os.remove(target)
+    self.write(target[len(self.root):], '# an older copy\n')
+    cc_ganglia.link_python_module('cern_cvmfs')
+    self.assertEqual(os.readlink(target), cc_ganglia.PYTHON_MODULES_DIR+'/cern_cvmfs.py')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,144 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+import cloudinit.config.cern_gmondconf as cern_gmondconf
+
+RATES_CONF = '''globals {
+  send_metadata_interval = 60
+}
+collection_group {
+  collect_once = yes
+  time_threshold = 20
+  metric {
+    name = "heartbeat"
+  }
+}
+collection_group {
+  collect_every = 20
+  time_threshold = 90
+  metric {
+    name = "cpu_user"
+    value_threshold = "1.0"
+  }
+  metric {
+    name = "cpu_system"
+    value_threshold = "1.0"
+  }
+  metric {
+    name = "cpu_idle"
+    value_threshold = "5.0"
+  }
+}
+collection_group {
+  collect_every = 40
+  time_threshold = 180
+  metric {
+    name = "mem_total"
+  }
+  metric {
+    name = "swap_total"
+  }
+}
+collection_group {
+  collect_once = yes
+  collect_every = 10
+  time_threshold = 100
+  metric {
+    name = "boottime"
+    value_threshold = 1
+  }
+}
+'''
+
+
+def gmond_conf(params):
+  # The sample gmond.conf with the collection groups of 'params', rendered and parsed again
+  root = cern_gmondconf.parse(open(os.path.join(support.bench_handlers.SAMPLES_DIR, 'gmond.conf')).read())
+  cc_ganglia.conf_collection_groups(root, params)
+  return cern_gmondconf.parse(cern_gmondconf.render(root))
+
+def groups(root):
+  # (collect_once, collect_every, time_threshold, {metric: value_threshold}) of each collection group
+  found = []
+  for group in root.blocks('collection_group'):
+    metrics = {}
+    for metric in group.blocks('metric'):
+      metrics[cc_ganglia.metric_name(metric)] = cc_ganglia.number(metric.get('value_threshold'))
+    found.append((group.get('collect_once'), cc_ganglia.number(group.get('collect_every')),
+                  cc_ganglia.number(group.get('time_threshold')), metrics))
+  return found
+
+def preset_groups(preset):
+  # groups() of what METRIC_PRESETS says
+  expected = []
+  for group in cc_ganglia.METRIC_PRESETS[preset]:
+    metrics = {}
+    for metric in group['metrics']:
+      if not isinstance(metric, dict):
+        metric = {'name': metric}
+      metrics[metric['name']] = metric.get('value-threshold')
+    expected.append((group.get('collect-once') and 'yes' or None, group.get('collect-every'),
+                     group['time-threshold'], metrics))
+  return expected
+
+
+class PresetTest(unittest.TestCase):
+
+  def test_minimal(self):
+    root = gmond_conf({'preset': 'minimal'})
+    self.assertEqual(groups(root), preset_groups('minimal'))
+    self.assertEqual(groups(root)[1], ('yes', None, 3600, {'cpu_num': None, 'mem_total': None, 'os_release': None,
+                                                           'boottime': None}))
+
+  def test_batch_worker(self):
+    root = gmond_conf({'preset': 'batch-worker'})
+    self.assertEqual(groups(root), preset_groups('batch-worker'))
+    self.assertEqual(len(root.blocks('collection_group')), 5)
+
+  def test_collection_groups_on_top(self):
+    root = gmond_conf({'preset': 'minimal',
+                       'collectionGroups': [{'collect-every': 30, 'time-threshold': 120,
+                                             'metrics': [{'name': 'load_one', 'value-threshold': 0.5}]},
+                                            {'drop': True, 'metrics': ['disk_free']}]})
+    found = groups(root)
+    self.assertEqual(found[2], (None, 60, 600, {'mem_free': 1048576.0}))
+    self.assertEqual(found[3], (None, 30, 120, {'load_one': 0.5}))
+
+  def test_unknown(self):
+    before = cern_gmondconf.render(gmond_conf({}))
+    self.assertEqual(cern_gmondconf.render(gmond_conf({'preset': 'tiny'})), before)
+
+
+class PacketRatesTest(unittest.TestCase):
+
+  def assertRates(self, rates, fewest, most):
+    self.assertAlmostEqual(rates[0], fewest)
+    self.assertAlmostEqual(rates[1], most)
+
+  def test_known_config(self):
+    # Each group sends every time_threshold, and every collect_every when it has value thresholds, except
+    # when it is collected once. Plus the metadata of the 7 metrics every 60s
+    self.assertRates(cc_ganglia.packet_rates(cern_gmondconf.parse(RATES_CONF)),
+                     1 / 20.0 + 3 / 90.0 + 2 / 180.0 + 1 / 100.0 + 7 / 60.0,
+                     1 / 20.0 + 3 / 20.0 + 2 / 180.0 + 1 / 100.0 + 7 / 60.0)
+
+  def test_collect_once(self):
+    root = cern_gmondconf.parse(RATES_CONF)
+    root.blocks('collection_group')[-1].remove('collect_once')
+    self.assertAlmostEqual(cc_ganglia.packet_rates(root)[1] - 1 / 10.0,
+                           1 / 20.0 + 3 / 20.0 + 2 / 180.0 + 7 / 60.0)
+
+  def test_presets(self):
+    self.assertRates(cc_ganglia.packet_rates(gmond_conf({'preset': 'minimal'})),
+                     1 / 20.0 + 4 / 3600.0 + 3 / 600.0, 1 / 20.0 + 4 / 3600.0 + 3 / 60.0)
+    self.assertRates(cc_ganglia.packet_rates(gmond_conf({'preset': 'batch-worker'})),
+                     1 / 20.0 + 8 / 3600.0 + 5 / 300.0 + 4 / 600.0 + 2 / 1800.0,
+                     1 / 20.0 + 8 / 3600.0 + 5 / 60.0 + 4 / 120.0 + 2 / 300.0)
+    fewest, most = cc_ganglia.packet_rates(gmond_conf({}))
+    self.assertTrue(cc_ganglia.packet_rates(gmond_conf({'preset': 'batch-worker'}))[1] < most / 4)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,151 @@
+import socket
+import support
+import threading
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+import cloudinit.config.cern_rrdsnapshot as cern_rrdsnapshot
+
+
+def phase(phases, name):
+  return [p for p in phases if p.name == name][0]
+
+
+class RrdConfigTest(unittest.TestCase):
+
+  def test_cron_waits_for_restore_and_flush(self):
+    snapshot, restore = cc_ganglia.rrd_cron(10, cc_ganglia.RRDCACHED_SOCKET).splitlines()[1:]
+    self.assertTrue(snapshot.startswith('*/10 * * * * root '))
+    self.assertTrue(' --snapshot --socket '+cc_ganglia.RRDCACHED_SOCKET+' ' in snapshot)
+    self.assertTrue(restore.startswith('@reboot root '))
+    self.assertTrue(' --restore ' in restore)
+    self.assertTrue(restore.endswith(' && '+cc_ganglia.SERVICE_cmd+' gmetad condrestart'))
+    for line in (snapshot, restore):
+      self.assertTrue(' --root '+cc_ganglia.RRD_DIR+' --target '+cc_ganglia.RRD_SNAPSHOT_DIR in line)
+      self.assertTrue(cc_ganglia.RSYNC_cmd not in line)
+    self.assertTrue('--socket' not in cc_ganglia.rrd_cron(15))
+
+  def test_rrdcached_options(self):
+    options = cc_ganglia.rrdcached_options({'write-timeout': 600}, 2)
+    self.assertTrue('-s ganglia -m 0660 -l unix:'+cc_ganglia.RRDCACHED_SOCKET in options)
+    self.assertTrue('-m 0666 -P FLUSH,STATS,HELP -l unix:'+cc_ganglia.RRDCACHED_WEB_SOCKET in options)
+    self.assertTrue(options.endswith('-w 600 -z 1800 -f 3600 -t 4'))
+    self.assertTrue(cc_ganglia.rrdcached_options({}, 16).endswith(' -t 16'))
+
+  def test_tmpfs_size(self):
+    self.assertEqual(cc_ganglia.rrd_tmpfs_mb({}, {'expected-hosts': 5000}, 16384), 3515)
+    self.assertEqual(cc_ganglia.rrd_tmpfs_mb({}, {'expected-hosts': 5000}, 4096), 2048)
+    self.assertEqual(cc_ganglia.rrd_tmpfs_mb({}, {}, 4096), cc_ganglia.MIN_RRD_TMPFS_MB)
+    self.assertEqual(cc_ganglia.rrd_tmpfs_mb({'size': 512}, {'expected-hosts': 5000}, 4096), 512)
+
+
+class RrdPhasesTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.make_host(4, 8192)
+    for name in ('RRD_DIR', 'RRD_SNAPSHOT_DIR', 'FSTAB', 'PROC_MOUNTS', 'RRD_CRON', 'RRDCACHED_SOCKET',
+                 'RRDCACHED_WEB_SOCKET', 'RRDCACHED_JOURNAL', 'RRDCACHED_SYSCONFIG', 'GMETAD_SYSCONFIG', 'GANGLIA_WEB_CONF'):
+      self.patch(cc_ganglia, name, self.path(getattr(cc_ganglia, name)))
+    for name in ('MOUNT_cmd', 'RSYNC_cmd', 'SERVICE_cmd', 'CHKCONFIG'):
+      self.stub(cc_ganglia, name)
+    self.write('/etc/fstab', '/dev/vda1 / ext4 defaults 1 1\n')
+    self.write('/etc/sysconfig/gmetad', '# gmetad\n')
+    self.write('/proc/mounts', '')
+    self.write('/etc/cron.d/.keep', '')
+    self.write('/etc/ganglia/.keep', '')
+    self.phases = cc_ganglia.phases({'ganglia': {'headnode': {'rrdcached': True, 'rrd-tmpfs': {'size': 256},
+                                                              'expected-hosts': 100}}}, None)
+
+  def test_tmpfs(self):
+    self.write('/var/lib/ganglia/rrds/cluster/host/load_one.rrd', '')
+    phase(self.phases, 'ganglia.rrds').run()
+    rrds = cc_ganglia.RRD_DIR
+    snapshot = cc_ganglia.RRD_SNAPSHOT_DIR
+    self.assertEqual([command[1:] for command in self.commands()],
+                     [['-a', rrds+'/', snapshot+'/'], ['-t', 'tmpfs', '-o', 'size=256m,mode=0755', 'tmpfs', rrds],
+                      ['-a', snapshot+'/', rrds+'/']])
+    self.assertTrue(cern_rrdsnapshot.restored(rrds))
+    self.assertEqual(self.read('/etc/fstab'), '/dev/vda1 / ext4 defaults 1 1\n'
+                                              'tmpfs '+rrds+' tmpfs size=256m,mode=0755 0 0\n')
+    cron = self.read('/etc/cron.d/cern-ganglia-rrds')
+    self.assertTrue(' --snapshot --socket '+cc_ganglia.RRDCACHED_SOCKET+' ' in cron)
+
+  def test_already_mounted(self):
+    self.write('/proc/mounts', 'tmpfs '+cc_ganglia.RRD_DIR+' tmpfs rw 0 0\n')
+    phase(self.phases, 'ganglia.rrds').run()
+    self.assertEqual(self.commands(), [])
+    self.assertFalse(cern_rrdsnapshot.restored(cc_ganglia.RRD_DIR))
+
+  def test_rrdcached(self):
+    phase(self.phases, 'ganglia.rrdcached').run()
+    sysconfig = self.read('/etc/sysconfig/rrdcached')
+    self.assertTrue('RRDC_USER="ganglia"\n' in sysconfig)
+    self.assertTrue('OPTIONS="'+cc_ganglia.rrdcached_options({}, 4)+'"\n' in sysconfig)
+    self.assertEqual(self.read('/etc/sysconfig/gmetad'),
+                     '# gmetad\nexport RRDCACHED_ADDRESS="unix:'+cc_ganglia.RRDCACHED_SOCKET+'"\n')
+    self.assertTrue("$conf['rrdcached_socket'] = \"unix:"+cc_ganglia.RRDCACHED_WEB_SOCKET+"\";\n" in
+                    self.read('/etc/ganglia/conf.php'))
+    self.assertEqual([command[1:] for command in self.commands()], [['rrdcached', 'restart'], ['rrdcached', 'on']])
+
+
+class SnapshotTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.stub(cern_rrdsnapshot, 'RSYNC_cmd')
+    self.patch(cern_rrdsnapshot, 'FLUSH_POLL', 0.01)
+    self.write('/rrds/cluster/host/load_one.rrd', '')
+    self.rrds = self.path('/rrds')
+    self.snapshot = self.path('/snapshot')
+
+  def rrdcached(self, queue):
+    # A local rrdcached answering FLUSHALL, and STATS with the queue lengths one after the other
+    received = []
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(self.path('/rrdcached.sock'))
+    server.listen(8)
+    self._closers.append(server.close)
+
+    def serve():
+      while True:
+        try:
+          connection = server.accept()[0]
+        except socket.error:
+          return
+        command = connection.makefile('r').readline().strip()
+        received.append(command)
+        if command == 'FLUSHALL':
+          connection.sendall('0 Started flush.\n')
+        else:
+          connection.sendall('2 Statistics follow\nQueueLength: %d\nUpdatesReceived: 12\n' % queue.pop(0))
+        connection.close()
+    thread = threading.Thread(target=serve)
+    thread.setDaemon(True)
+    thread.start()
+    return received
+
+  def test_skipped_until_restored(self):
+    self.assertFalse(cern_rrdsnapshot.snapshot(self.rrds, self.snapshot))
+    self.assertEqual(self.commands(), [])
+    cern_rrdsnapshot.restore(self.rrds, self.snapshot)
+    self.assertTrue(cern_rrdsnapshot.snapshot(self.rrds, self.snapshot))
+    self.assertEqual([command[1:] for command in self.commands()],
+                     [['-a', self.snapshot+'/', self.rrds+'/'],
+                      ['-a', '--delete', '--exclude', '/.restored', self.rrds+'/', self.snapshot+'/']])
+
+  def test_flush_before_copy(self):
+    received = self.rrdcached([3, 1, 0])
+    cern_rrdsnapshot.restore(self.rrds, self.snapshot)
+    self.assertTrue(cern_rrdsnapshot.snapshot(self.rrds, self.snapshot, self.path('/rrdcached.sock')))
+    self.assertEqual(received, ['FLUSHALL', 'STATS', 'STATS', 'STATS'])
+    self.assertEqual(len(self.commands()), 2)
+
+  def test_rrdcached_down(self):
+    cern_rrdsnapshot.restore(self.rrds, self.snapshot)
+    self.assertTrue(cern_rrdsnapshot.snapshot(self.rrds, self.snapshot, self.path('/rrdcached.sock')))
+    self.assertEqual(len(self.commands()), 2)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,66 @@
+import support
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+
+AGGREGATORS = ['agg1.cern.ch', ['agg2a.cern.ch:8650', 'agg2b.cern.ch:8650'], 'agg3.cern.ch', 'agg4.cern.ch:9000']
+NODES = ['node%04d.cern.ch' % n for n in range(2000)]
+
+
+def assignment(shards):
+  result = {}
+  for node in NODES:
+    result[node] = cc_ganglia.pick_shard(node, shards)
+  return result
+
+
+class ShardTest(unittest.TestCase):
+
+  def test_addresses(self):
+    self.assertEqual(cc_ganglia.aggregator_shards(AGGREGATORS),
+                     [[['agg1.cern.ch', 8649]], [['agg2a.cern.ch', 8650], ['agg2b.cern.ch', 8650]],
+                      [['agg3.cern.ch', 8649]], [['agg4.cern.ch', 9000]]])
+
+  def test_balanced(self):
+    shards = cc_ganglia.aggregator_shards(AGGREGATORS)
+    picked = assignment(shards).values()
+    for shard in shards:
+      self.assertTrue(abs(picked.count(shard) - len(NODES) / len(shards)) < len(NODES) / 10)
+
+  def test_order_and_ports_do_not_matter(self):
+    shards = cc_ganglia.aggregator_shards(AGGREGATORS)
+    moved = cc_ganglia.aggregator_shards(['agg4.cern.ch', 'agg3.cern.ch:8651', ['agg2b.cern.ch', 'agg2a.cern.ch'],
+                                          'agg1.cern.ch'])
+    before = assignment(shards)
+    after = assignment(moved)
+    for node in NODES:
+      self.assertEqual(sorted([host for host, port in before[node]]), sorted([host for host, port in after[node]]))
+
+  def test_removing_a_shard_only_moves_its_nodes(self):
+    shards = cc_ganglia.aggregator_shards(AGGREGATORS)
+    before = assignment(shards)
+    after = assignment(shards[:1]+shards[2:])
+    for node in NODES:
+      if before[node] == shards[1]:
+        self.assertNotEqual(after[node], shards[1])
+      else:
+        self.assertEqual(after[node], before[node])
+
+  def test_adding_a_shard_only_moves_nodes_to_it(self):
+    shards = cc_ganglia.aggregator_shards(AGGREGATORS)
+    added = cc_ganglia.aggregator_shards(AGGREGATORS+['agg5.cern.ch'])
+    before = assignment(shards)
+    after = assignment(added)
+    moved = [node for node in NODES if after[node] != before[node]]
+    self.assertTrue(moved)
+    for node in moved:
+      self.assertEqual(after[node], added[-1])
+
+  def test_channels(self):
+    shard = cc_ganglia.pick_shard('node0001.cern.ch', cc_ganglia.aggregator_shards(AGGREGATORS))
+    self.assertEqual(cc_ganglia.aggregation_channels({'aggregators': AGGREGATORS}, 'node0001.cern.ch'),
+                     [{'host': host, 'port': port} for host, port in shard])
+
+
+if __name__ == '__main__':
+  unittest.main()
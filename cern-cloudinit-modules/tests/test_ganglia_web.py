@@ -0,0 +1,88 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cc_ganglia as cc_ganglia
+
+
+def phase(phases, name):
+  return [p for p in phases if p.name == name][0]
+
+
+class HttpdConfTest(unittest.TestCase):
+
+  def test_settings(self):
+    self.assertEqual(cc_ganglia.web_settings({}), cc_ganglia.DEFAULT_WEB)
+    settings = cc_ganglia.web_settings({'web': {'allow': '.example.org', 'cache-ttl': 60}})
+    self.assertEqual(settings['allow'], ['.example.org'])
+    self.assertEqual(settings['cache-ttl'], 60)
+    self.assertEqual(settings['static-ttl'], cc_ganglia.DEFAULT_WEB['static-ttl'])
+
+  def test_expiry(self):
+    expiry = cc_ganglia.web_expiry({'cache-ttl': 45, 'static-ttl': 3600})
+    self.assertEqual(expiry['image/png'], 45)
+    self.assertEqual(expiry['application/json'], 45)
+    self.assertEqual(expiry['text/css'], 3600)
+    self.assertEqual(expiry['image/gif'], 3600)
+    self.assertTrue('text/html' not in expiry)
+
+  def test_access(self):
+    conf = cc_ganglia.ganglia_httpd_conf({'web': {'allow': ['cern.ch', '10.0.0.0/8']}})
+    location = conf[conf.index('<Location /ganglia>\n'):conf.index('</Location>\n')]
+    self.assertEqual(location.splitlines()[1:],
+                     ['  Order deny,allow', '  Deny from all', '  Allow from 127.0.0.1', '  Allow from ::1',
+                      '  Allow from cern.ch', '  Allow from 10.0.0.0/8'])
+    self.assertTrue('Alias /ganglia '+cc_ganglia.GANGLIA_WEB_ROOT+'\n' in conf)
+
+  def test_deflate_and_expires(self):
+    conf = cc_ganglia.ganglia_httpd_conf({'web': {'cache-ttl': 20}})
+    directory = conf[conf.index('<Directory '+cc_ganglia.GANGLIA_WEB_ROOT+'>\n'):conf.index('</Directory>\n')]
+    deflate = directory[directory.index('<IfModule mod_deflate.c>'):directory.index('<IfModule mod_expires.c>')]
+    self.assertEqual(deflate.splitlines()[1].split()[:2], ['AddOutputFilterByType', 'DEFLATE'])
+    self.assertEqual(deflate.splitlines()[1].split()[2:], list(cc_ganglia.WEB_DEFLATE_TYPES))
+    self.assertTrue('image/png' not in deflate)
+    self.assertTrue('    ExpiresActive On\n' in directory)
+    self.assertTrue('    ExpiresByType image/png "access plus 20 seconds"\n' in directory)
+    self.assertTrue('    ExpiresByType text/css "access plus 604800 seconds"\n' in directory)
+    self.assertEqual(directory.count('ExpiresByType'), len(cc_ganglia.WEB_GRAPH_TYPES+cc_ganglia.WEB_STATIC_TYPES))
+
+  def test_web_load_directives(self):
+    # bench --web-load serves what the generated ganglia.conf asks for, and nothing for the stock one
+    deflate, expiry = support.bench_handlers.httpd_directives(cc_ganglia.ganglia_httpd_conf({'web': {'cache-ttl': 20}}))
+    self.assertEqual(deflate, list(cc_ganglia.WEB_DEFLATE_TYPES))
+    self.assertEqual(expiry, cc_ganglia.web_expiry(cc_ganglia.web_settings({'web': {'cache-ttl': 20}})))
+    stock = open(os.path.join(support.bench_handlers.SAMPLES_DIR, 'ganglia-httpd.conf')).read()
+    self.assertEqual(support.bench_handlers.httpd_directives(stock), ([], {}))
+
+
+class GangliaWebConfTest(unittest.TestCase):
+
+  def test_replaces_settings(self):
+    content = "<?php\n$conf['cachedata'] = 0;\n$conf['gweb_root'] = dirname(__FILE__);\n?>\n"
+    self.assertEqual(cc_ganglia.ganglia_web_conf(content, {'cachedata': '1', 'cachetime': "'30'"}),
+                     "<?php\n$conf['gweb_root'] = dirname(__FILE__);\n$conf['cachedata'] = 1;\n"
+                     "$conf['cachetime'] = '30';\n?>\n")
+
+  def test_without_file(self):
+    self.assertEqual(cc_ganglia.ganglia_web_conf(None, {'cachedata': '1'}), "<?php\n$conf['cachedata'] = 1;\n?>\n")
+    self.assertEqual(cc_ganglia.ganglia_web_conf('<?php\n', {'cachedata': '1'}), "<?php\n$conf['cachedata'] = 1;\n")
+
+
+class WebPhaseTest(support.SandboxTestCase):
+
+  def test_web(self):
+    for name in ('HTTPD_GANGLIA_CONF', 'GANGLIA_WEB_CONF'):
+      self.patch(cc_ganglia, name, self.path(getattr(cc_ganglia, name)))
+    self.stub(cc_ganglia, 'SERVICE_cmd')
+    self.write('/etc/httpd/conf.d/ganglia.conf',
+               open(os.path.join(support.bench_handlers.SAMPLES_DIR, 'ganglia-httpd.conf')).read())
+    self.write('/etc/ganglia/conf.php', "<?php\n$conf['cachetime'] = '60';\n?>\n")
+    phases = cc_ganglia.phases({'ganglia': {'headnode': {'web': {'cache-ttl': 15}}}}, None)
+    phase(phases, 'ganglia.web').run()
+    self.assertEqual(self.read('/etc/httpd/conf.d/ganglia.conf'), cc_ganglia.ganglia_httpd_conf({'web': {'cache-ttl': 15}}))
+    self.assertEqual(self.read('/etc/ganglia/conf.php'), "<?php\n$conf['cachedata'] = 1;\n$conf['cachetime'] = '15';\n?>\n")
+    self.assertEqual([command[1:] for command in self.commands()], [['httpd', 'restart'], ['gmetad', 'restart']])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,87 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cern_gmondconf as cern_gmondconf
+
+CONF = '''globals {
+  daemonize = yes
+  send_metadata_interval = 0 /* secs */
+}
+udp_send_channel {
+  mcast_join = 239.2.11.71
+  port = 8649
+  ttl = 1
+  ttl = 2
+}
+udp_send_channel {
+  host = backup
+  port = 8649
+}
+collection_group {
+  collect_every = 20
+  metric {
+    name = "load_one"
+    value_threshold = 1.0
+  }
+  metric {
+    name = "load_five"
+  }
+}
+'''
+
+
+class ApplyTest(unittest.TestCase):
+
+  def test_round_trip(self):
+    text = open(os.path.join(support.bench_handlers.SAMPLES_DIR, 'gmond.conf')).read()
+    self.assertEqual(cern_gmondconf.render(cern_gmondconf.parse(text)), text)
+
+  def test_first_entry_only(self):
+    root = cern_gmondconf.parse(CONF)
+    cern_gmondconf.apply(root, {'udp_send_channel': {'ttl': 5, 'port': 9000}})
+    first, second = root.blocks('udp_send_channel')
+    self.assertEqual([entry.value for entry in first.entries('ttl')], ['5', '2'])
+    self.assertEqual(first.get('port'), '9000')
+    self.assertEqual(second.get('port'), '9000')
+    self.assertEqual(second.get('ttl'), '5')
+
+  def test_comment_kept(self):
+    root = cern_gmondconf.parse(CONF)
+    cern_gmondconf.apply(root, {'globals': {'send_metadata_interval': 30}})
+    self.assertTrue('  send_metadata_interval = 30 /* secs */\n' in cern_gmondconf.render(root))
+
+  def test_remove_and_disable_all(self):
+    root = cern_gmondconf.parse(CONF)
+    cern_gmondconf.apply(root, {'udp_send_channel': {'ttl': None, 'mcast_join': cern_gmondconf.DISABLE}})
+    first = root.blocks('udp_send_channel')[0]
+    self.assertEqual(first.entries('ttl'), [])
+    self.assertTrue('  #mcast_join = 239.2.11.71\n' in first.render())
+    self.assertEqual(first.entries('mcast_join'), [])
+
+  def test_disable_repeated_key(self):
+    root = cern_gmondconf.parse(CONF)
+    cern_gmondconf.apply(root, {'udp_send_channel': {'ttl': cern_gmondconf.DISABLE}})
+    first, second = root.blocks('udp_send_channel')
+    self.assertEqual(first.entries('ttl'), [])
+    self.assertTrue('  #ttl = 1\n  #ttl = 2\n' in first.render())
+    self.assertEqual(first.get('port'), '8649')
+    self.assertEqual(second.render(), 'udp_send_channel {\n  host = backup\n  port = 8649\n}\n')
+
+  def test_repeated_key_render(self):
+    root = cern_gmondconf.parse(CONF)
+    cern_gmondconf.apply(root, {'udp_send_channel': {'ttl': 3}})
+    self.assertEqual(cern_gmondconf.render(root), CONF.replace('  ttl = 1\n', '  ttl = 3\n').replace(
+      '  host = backup\n  port = 8649\n', '  host = backup\n  port = 8649\n  ttl = 3\n'))
+
+  def test_nested_blocks_and_new_keys(self):
+    root = cern_gmondconf.parse(CONF)
+    cern_gmondconf.apply(root, {'metric': {'value_threshold': 2}, '': {'include': '("/etc/ganglia/conf.d/*.conf")'}})
+    metrics = root.block('collection_group').blocks('metric')
+    self.assertEqual([metric.get('value_threshold') for metric in metrics], ['2', '2'])
+    self.assertEqual(root.get('include'), '("/etc/ganglia/conf.d/*.conf")')
+    self.assertTrue(cern_gmondconf.render(root).endswith('include = ("/etc/ganglia/conf.d/*.conf")\n'))
+
+
+if __name__ == '__main__':
+  unittest.main()
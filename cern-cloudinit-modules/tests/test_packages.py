@@ -0,0 +1,79 @@
+import os
+import support
+import unittest
+
+import cloudinit.config.cern_packages as cern_packages
+
+# An rpm database in the file 'installed', and a yum whose transactions fail as a whole when they hold 'broken'
+RPM = '''#!/bin/sh
+shift
+for package in "$@"; do
+  if grep -qx "$package" "%(root)s/installed"; then echo "$package-1.0-1.x86_64"; else echo "package $package is not installed"; fi
+done
+'''
+YUM = '''#!/bin/sh
+echo "$0 $*" >> "%(root)s/commands.log"
+shift 2
+for package in "$@"; do
+  [ "$package" != broken ] || exit 1
+done
+for package in "$@"; do
+  echo "$package" >> "%(root)s/installed"
+done
+'''
+
+
+class FakeModule(object):
+
+  def __init__(self, packages):
+    self.packages = packages
+
+  def package_plan(self, params):
+    return self.packages
+
+
+class EnsureTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cern_packages, '_results', None)
+    self.write('/installed', 'bash\n')
+    for name, script in (('RPM_cmd', RPM), ('YUM_cmd', YUM)):
+      self.patch(cern_packages, name, self.write('/stubs/'+name, script % {'root': self.root}))
+      os.chmod(getattr(cern_packages, name), 0755)
+
+  def ensure(self, plans):
+    modules = dict([(name, FakeModule(packages)) for name, packages in plans.items()])
+    self.patch(cern_packages, '_module', lambda name: modules[name])
+    cfg = dict([(name, {'install': True}) for name in plans])
+    return cern_packages.ensure(cfg)
+
+  def yum_installs(self):
+    return [command[3:] for command in self.commands()]
+
+  def test_single_transaction(self):
+    results = self.ensure({'cvmfs': ['cvmfs', 'fuse'], 'condor': ['condor', 'fuse', 'bash'], 'ganglia': ['ganglia-gmond']})
+    self.assertEqual(results, {'cvmfs': True, 'condor': True, 'ganglia': True})
+    self.assertEqual(self.yum_installs(), [['cvmfs', 'fuse', 'condor', 'ganglia-gmond']])
+
+  def test_fallback_per_module(self):
+    # The common transaction fails on the broken package of condor: every module is retried on its own
+    results = self.ensure({'cvmfs': ['cvmfs', 'fuse'], 'condor': ['condor', 'broken'], 'ganglia': ['ganglia-gmond']})
+    self.assertEqual(results, {'cvmfs': True, 'condor': False, 'ganglia': True})
+    self.assertEqual(self.yum_installs(), [['cvmfs', 'fuse', 'condor', 'broken', 'ganglia-gmond'], ['cvmfs', 'fuse'],
+                                           ['condor', 'broken'], ['ganglia-gmond']])
+    self.assertEqual(self.read('/installed').split(), ['bash', 'cvmfs', 'fuse', 'ganglia-gmond'])
+
+  def test_unplanned_module(self):
+    results = self.ensure({'cvmfs': ['cvmfs'], 'condor': None})
+    self.assertEqual(results, {'cvmfs': True, 'condor': False})
+    self.assertEqual(self.yum_installs(), [['cvmfs']])
+
+  def test_once_per_run(self):
+    self.ensure({'cvmfs': ['cvmfs']})
+    self.assertEqual(self.ensure({'cvmfs': ['cvmfs'], 'condor': ['broken']}), {'cvmfs': True})
+    self.assertEqual(len(self.commands()), 1)
+
+
+if __name__ == '__main__':
+  unittest.main()
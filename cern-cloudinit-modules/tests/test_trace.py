@@ -0,0 +1,102 @@
+import json
+import os
+import subprocess
+import support
+import threading
+import time
+import unittest
+
+import cloudinit.config.cern_trace as cern_trace
+
+
+class Log(object):
+
+  def __init__(self):
+    self.lines = []
+
+  def info(self, line):
+    self.lines.append(line)
+
+
+def event(cat, kind, dur, cpu_ms=0):
+  return {'name': kind, 'cat': cat, 'ph': 'X', 'ts': 0, 'dur': dur, 'pid': 1, 'tid': 1,
+          'args': {'kind': kind, 'cpu_ms': cpu_ms}}
+
+
+class TraceTest(support.SandboxTestCase):
+
+  def setUp(self):
+    support.SandboxTestCase.setUp(self)
+    self.patch(cern_trace, '_events', [])
+    self.patch(cern_trace, 'TRACE_FILE', self.path('/cern-cloudinit-trace.json'))
+
+  def in_module(self, name, run):
+    # Run 'run' in a thread attributed to module 'name', like a phase
+    def target():
+      cern_trace.set_module(name)
+      run()
+    thread = threading.Thread(target=target)
+    thread.start()
+    thread.join()
+
+  def test_event_fields(self):
+    def run():
+      with cern_trace.span('download', url='http://example.org/a.rpm') as s:
+        time.sleep(0.05)
+        s.set(source='network')
+    before = time.time()
+    self.in_module('condor', run)
+    [event] = cern_trace._events
+    self.assertEqual((event['name'], event['cat'], event['ph'], event['pid']), ('download', 'condor', 'X', os.getpid()))
+    self.assertTrue(before * 1000000 - 1 <= event['ts'] <= time.time() * 1000000)
+    self.assertTrue(50000 <= event['dur'] < 5000000)
+    self.assertTrue(isinstance(event['tid'], (int, long)))
+    self.assertEqual(sorted(event['args'].keys()), ['cpu_ms', 'kind', 'source', 'url'])
+    self.assertEqual((event['args']['kind'], event['args']['source']), ('step', 'network'))
+
+  def test_error(self):
+    def run():
+      with cern_trace.span('condor.config', 'phase'):
+        raise ValueError('no condor-host')
+    self.assertRaises(ValueError, run)
+    self.assertEqual(cern_trace._events[0]['args']['error'], 'no condor-host')
+
+  def test_commands(self):
+    self.assertEqual(cern_trace.call(['/bin/sh', '-c', 'exit 3']), 3)
+    self.assertRaises(subprocess.CalledProcessError, cern_trace.check_call, ['/bin/sh', '-c', 'exit 1'])
+    self.assertEqual(cern_trace.communicate(['/bin/cat'], 'input'), (0, 'input'))
+    self.assertEqual([(event['name'], event['args']['kind'], event['args']['exit_code']) for event in cern_trace._events],
+                     [('sh', 'command', 3), ('sh', 'command', 1), ('cat', 'command', 0)])
+    self.assertEqual(cern_trace._events[0]['args']['argv'], ['/bin/sh', '-c', 'exit 3'])
+
+  def test_summary(self):
+    events = [event('condor', 'phase', 2000000, 500), event('condor', 'phase', 1000000, 250),
+              event('condor', 'command', 1500000), event('condor', 'step', 9000000),
+              event('cvmfs', 'command', 250000), event('cvmfs', 'command', 250000)]
+    self.assertEqual(cern_trace.summary(events),
+                     {'condor': {'wall': 3.0, 'cpu': 0.75, 'commands': 1, 'command_wall': 1.5},
+                      'cvmfs': {'wall': 0.0, 'cpu': 0.0, 'commands': 2, 'command_wall': 0.5}})
+
+  def test_flush(self):
+    # The file stays a loadable Chrome trace (an array left open) across runs
+    log = Log()
+    self.in_module('cvmfs', lambda: cern_trace.call(['/bin/true']))
+    cern_trace.flush(log)
+    self.assertEqual(cern_trace._events, [])
+    self.in_module('ganglia', lambda: cern_trace.call(['/bin/true']))
+    cern_trace.flush()
+    cern_trace.flush()
+    text = self.read('/cern-cloudinit-trace.json')
+    self.assertTrue(text.startswith('[\n{'))
+    self.assertEqual(len(json.loads(text.rstrip().rstrip(',')+']')), 2)
+    self.assertEqual([event['cat'] for event in cern_trace.load()], ['cvmfs', 'ganglia'])
+    self.assertEqual(len(log.lines), 1)
+    self.assertTrue(log.lines[0].startswith('cvmfs: 0.00s wall, 0.00s cpu in phases, 1 commands taking '))
+
+  def test_load_empty(self):
+    self.write('/cern-cloudinit-trace.json', '')
+    self.assertEqual(cern_trace.load(), [])
+
+
+if __name__ == '__main__':
+  unittest.main()